@@ -0,0 +1,117 @@
+"""
+MS Color Generator - 合成エンジンのベンチマーク
+
+使い方:
+    python benchmark_compose.py [繰り返し回数]
+
+各合成エンジン（フルフレーム・タイル合成）について、1回の合成にかかる時間と
+合成中に確保される作業メモリのピーク（tracemalloc計測）を表示する。
+倍率は元の合成（レイヤー画像ごとに replace_color → multiply_rgba を繰り返すfloatのループ）との比。
+"""
+
+import sys
+import time
+import tracemalloc
+import contextlib
+import io
+from typing import Callable, Dict, Tuple
+
+import numpy as np
+
+from config import COMPOSITE_SETTINGS
+from layer_manager import LayerColorizer
+
+
+def measure(compose: Callable[[], object], repeat: int) -> Tuple[float, int]:
+    """合成処理の平均時間とピーク作業メモリを計測
+
+    Args:
+        compose: 計測する合成処理
+        repeat: 繰り返し回数
+
+    Returns:
+        (平均時間[ms], ピーク作業メモリ[bytes])のタプル
+    """
+    compose()  # ウォームアップ（遅延構築を計測に含めない）
+
+    tracemalloc.start()
+    compose()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        compose()
+    elapsed = (time.perf_counter() - start) / repeat
+    return elapsed * 1000.0, peak
+
+
+def run_benchmark(repeat: int = 10) -> Dict[str, Tuple[float, int]]:
+    """全合成エンジンでベンチマークを実行
+
+    Args:
+        repeat: 繰り返し回数
+
+    Returns:
+        エンジン名 → (平均時間[ms], ピーク作業メモリ[bytes])の辞書
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        colorizer = LayerColorizer()
+
+    stack = colorizer.layer_stack
+    print(f"🖼️ [BENCH] {stack.num_layers}レイヤー, {stack.width}x{stack.height}, {repeat}回平均")
+
+    # 毎回全グループの色を変えて差分合成が効かない条件で計測する
+    rng = np.random.default_rng(0)
+    groups = sorted(set(colorizer.layers))
+
+    def compose():
+        for group in groups:
+            colorizer.group_colors[group] = "#%06x" % rng.integers(0, 1 << 24)
+        with contextlib.redirect_stdout(io.StringIO()):
+            return colorizer.compose_layers()
+
+    # 元の合成（PIL画像のレイヤーごとに色を置換して float で乗算）
+    layers = [colorizer.get_layer_image(i) for i in np.flatnonzero(stack.valid)]
+    
+    def compose_reference():
+        for group in groups:
+            colorizer.group_colors[group] = "#%06x" % rng.integers(0, 1 << 24)
+        colors = [colorizer.get_layer_color(i) for i in np.flatnonzero(stack.valid)]
+        base = None
+        for img, color in zip(layers, colors):
+            colored = colorizer.replace_color(img, colorizer.hex_to_rgb(color))
+            base = colored if base is None else colorizer.multiply_rgba(base, colored)
+        return base
+    
+    results = {"multiply_rgba": measure(compose_reference, repeat)}
+    
+    # 近似エンジンも計測する
+    allow_approximate = COMPOSITE_SETTINGS["allow_approximate"]
+    COMPOSITE_SETTINGS["allow_approximate"] = True
+    try:
+        for engine in COMPOSITE_SETTINGS["available_engines"]:
+            colorizer.composite_engine = engine
+            results[engine] = measure(compose, repeat)
+        
+        # タイル合成（作業メモリが1タイル分に収まることを確認する）
+        tiled = COMPOSITE_SETTINGS["tiled"]
+        COMPOSITE_SETTINGS["tiled"] = True
+        try:
+            for engine in COMPOSITE_SETTINGS["available_engines"]:
+                colorizer.composite_engine = engine
+                results[f"{engine}+tile"] = measure(compose, repeat)
+        finally:
+            COMPOSITE_SETTINGS["tiled"] = tiled
+    finally:
+        COMPOSITE_SETTINGS["allow_approximate"] = allow_approximate
+
+    baseline_ms, baseline_peak = results["multiply_rgba"]
+    for engine, (ms, peak) in results.items():
+        print(f"⏱️ [BENCH] {engine:>15}: {ms:8.2f} ms/合成 (x{baseline_ms / ms:5.1f}), "
+              f"作業メモリ {peak / 1024 / 1024:7.2f} MB (1/{baseline_peak / max(peak, 1):.1f})")
+    return results
+
+
+if __name__ == "__main__":
+    run_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
@@ -0,0 +1,257 @@
+"""
+MS Color Generator - 配列ベースの色変換（複数の色をまとめて変換）
+
+色は (N, 3) の配列で扱い、1色ずつcolorsysや文字列操作を通さずにまとめて変換する。
+計算はcolorsysと同じ式をfloat64で行うため、1色ずつの変換と同じ結果になる。
+
+- HEX: "#rrggbb"（"#" は省略可）の文字列のリスト
+- RGB: 0-1 の浮動小数点（0-255 の整数は「バイト」と呼ぶ）
+- HSV: 色相・彩度・明度とも 0-1（colorsysと同じ）
+- Lab: CIE L*a*b*（sRGB・D65白色点、L* は 0-100）
+"""
+
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+# 16進数の文字（ASCIIコード）→ 値（16進数でない文字は255）
+_HEX_DIGITS = np.full(256, 255, dtype=np.uint8)
+for _i, _c in enumerate(b"0123456789abcdef"):
+    _HEX_DIGITS[_c] = _i
+    _HEX_DIGITS[bytes([_c]).upper()[0]] = _i
+
+# sRGB（線形）→ XYZ の変換行列と D65 の白色点
+_RGB_TO_XYZ = np.array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041],
+])
+_XYZ_TO_RGB = np.linalg.inv(_RGB_TO_XYZ)
+_WHITE_D65 = _RGB_TO_XYZ.sum(axis=1)
+
+# hsv_to_rgbで色相の区間（0-5）ごとにR, G, Bへ割り当てる値（v=0, p=1, q=2, t=3）
+_SECTOR_CHANNELS = np.array([
+    [0, 3, 1],
+    [2, 0, 1],
+    [1, 0, 3],
+    [1, 2, 0],
+    [3, 1, 0],
+    [0, 1, 2],
+])
+
+
+def hsv_to_rgb(hsv: np.ndarray) -> np.ndarray:
+    """HSVをRGBに変換（colorsys.hsv_to_rgbの配列版）
+
+    Args:
+        hsv: (..., 3) の配列（色相・彩度・明度とも 0-1）
+
+    Returns:
+        (..., 3) float64 のRGB配列（0-1）
+    """
+    hsv = np.asarray(hsv, dtype=np.float64)
+    h, s, v = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+    sector = np.trunc(h * 6.0)
+    f = h * 6.0 - sector
+    p = v * (1.0 - s)
+    q = v * (1.0 - s * f)
+    t = v * (1.0 - s * (1.0 - f))
+    sector = sector.astype(np.int64) % 6
+
+    # 色相の区間ごとに (R, G, B) として使う値を (v, p, q, t) から選ぶ
+    values = np.stack([v, p, q, t], axis=-1)
+    rgb = np.take_along_axis(values, _SECTOR_CHANNELS[sector], axis=-1)
+    # 彩度0は無彩色（colorsysと同じく明度をそのまま使う）
+    return np.where((s == 0.0)[..., None], v[..., None], rgb)
+
+
+def rgb_to_hsv(rgb: np.ndarray) -> np.ndarray:
+    """RGBをHSVに変換（colorsys.rgb_to_hsvの配列版）
+
+    Args:
+        rgb: (..., 3) の配列（0-1）
+
+    Returns:
+        (..., 3) float64 のHSV配列（色相・彩度・明度とも 0-1）
+    """
+    rgb = np.asarray(rgb, dtype=np.float64)
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    maxc = rgb.max(axis=-1)
+    minc = rgb.min(axis=-1)
+    rangec = maxc - minc
+    chromatic = rangec != 0.0
+    # 無彩色（最大 = 最小）は色相・彩度とも0
+    safe_max = np.where(chromatic, maxc, 1.0)
+    safe_range = np.where(chromatic, rangec, 1.0)
+    s = np.where(chromatic, rangec / safe_max, 0.0)
+    rc = (maxc - r) / safe_range
+    gc = (maxc - g) / safe_range
+    bc = (maxc - b) / safe_range
+    # colorsysと同じく R, G, B の順に最大の成分を選ぶ
+    h = np.where(r == maxc, bc - gc, np.where(g == maxc, 2.0 + rc - bc, 4.0 + gc - rc))
+    h = np.where(chromatic, (h / 6.0) % 1.0, 0.0)
+    return np.stack([h, s, maxc], axis=-1)
+
+
+def _linearize(rgb: np.ndarray) -> np.ndarray:
+    """sRGBのガンマを外して線形RGBに変換"""
+    return np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+
+
+def _gamma(linear: np.ndarray) -> np.ndarray:
+    """線形RGBにsRGBのガンマをかける"""
+    linear = np.clip(linear, 0.0, 1.0)
+    return np.where(linear <= 0.0031308, linear * 12.92, 1.055 * linear ** (1 / 2.4) - 0.055)
+
+
+def rgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    """sRGBをCIE L*a*b*に変換（D65）
+
+    Args:
+        rgb: (..., 3) の配列（0-1）
+
+    Returns:
+        (..., 3) float64 のLab配列（L* は 0-100）
+    """
+    xyz = _linearize(np.asarray(rgb, dtype=np.float64)) @ _RGB_TO_XYZ.T / _WHITE_D65
+    f = np.where(xyz > (6 / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+    return np.stack([
+        116.0 * f[..., 1] - 16.0,
+        500.0 * (f[..., 0] - f[..., 1]),
+        200.0 * (f[..., 1] - f[..., 2]),
+    ], axis=-1)
+
+
+def lab_to_rgb(lab: np.ndarray) -> np.ndarray:
+    """CIE L*a*b*をsRGBに変換（D65、sRGBの範囲外は 0-1 に切り詰める）
+
+    Args:
+        lab: (..., 3) の配列
+
+    Returns:
+        (..., 3) float64 のRGB配列（0-1）
+    """
+    lab = np.asarray(lab, dtype=np.float64)
+    fy = (lab[..., 0] + 16.0) / 116.0
+    f = np.stack([fy + lab[..., 1] / 500.0, fy, fy - lab[..., 2] / 200.0], axis=-1)
+    xyz = np.where(f > 6 / 29, f ** 3, 3 * (6 / 29) ** 2 * (f - 4 / 29)) * _WHITE_D65
+    return _gamma(xyz @ _XYZ_TO_RGB.T)
+
+
+def hex_to_rgb_bytes(colors: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """16進数カラーコードを 0-255 のRGBに変換
+
+    Args:
+        colors: 16進数カラーコード（"#rrggbb" または "rrggbb"）のリスト
+
+    Returns:
+        ((N, 3) uint8 のRGB配列, (N,) bool の有効フラグ) のタプル
+        （カラーコードとして解釈できない要素は黒で、有効フラグがFalse）
+    """
+    digits = [color.lstrip("#") if isinstance(color, str) else "" for color in colors]
+    lengths = np.array([len(d) == 6 for d in digits], dtype=bool)
+    text = "".join(d if ok else "000000" for d, ok in zip(digits, lengths))
+    # ASCII以外の文字は "?"（16進数でない文字）になる
+    codes = np.frombuffer(text.encode("ascii", "replace"), dtype=np.uint8)
+    values = _HEX_DIGITS[codes].reshape(-1, 6)
+    valid = lengths & (values != 255).all(axis=1)
+    values[~valid] = 0
+    rgb = (values[:, 0::2] << 4) | values[:, 1::2]
+    return rgb, valid
+
+
+def hex_to_rgb(colors: Sequence[str]) -> np.ndarray:
+    """16進数カラーコードを 0-1 のRGBに変換（解釈できない要素は黒）
+
+    Args:
+        colors: 16進数カラーコードのリスト
+
+    Returns:
+        (N, 3) float64 のRGB配列（0-1）
+    """
+    return hex_to_rgb_bytes(colors)[0] / 255.0
+
+
+def hex_to_hsv(colors: Sequence[str]) -> np.ndarray:
+    """16進数カラーコードをHSVに変換（解釈できない要素は黒）
+
+    Args:
+        colors: 16進数カラーコードのリスト
+
+    Returns:
+        (N, 3) float64 のHSV配列（色相・彩度・明度とも 0-1）
+    """
+    return rgb_to_hsv(hex_to_rgb(colors))
+
+
+def hex_to_lab(colors: Sequence[str]) -> np.ndarray:
+    """16進数カラーコードをCIE L*a*b*に変換（解釈できない要素は黒）
+
+    Args:
+        colors: 16進数カラーコードのリスト
+
+    Returns:
+        (N, 3) float64 のLab配列
+    """
+    return rgb_to_lab(hex_to_rgb(colors))
+
+
+def rgb_to_bytes(rgb: np.ndarray) -> np.ndarray:
+    """0-1 のRGBを 0-255 の整数に変換（int(x * 255) と同じ切り捨て）
+
+    Args:
+        rgb: (..., 3) の配列（0-1）
+
+    Returns:
+        (..., 3) uint8 の配列
+    """
+    return np.clip(np.trunc(np.asarray(rgb, dtype=np.float64) * 255), 0, 255).astype(np.uint8)
+
+
+def rgb_bytes_to_hex(rgb: np.ndarray) -> List[str]:
+    """0-255 のRGBを16進数カラーコードに変換
+
+    Args:
+        rgb: (N, 3) の整数配列（0-255）
+
+    Returns:
+        16進数カラーコード (#rrggbb) のリスト
+    """
+    digits = np.ascontiguousarray(rgb, dtype=np.uint8).reshape(-1, 3).tobytes().hex()
+    return ["#" + digits[i:i + 6] for i in range(0, len(digits), 6)]
+
+
+def rgb_to_hex(rgb: np.ndarray) -> List[str]:
+    """0-1 のRGBを16進数カラーコードに変換
+
+    Args:
+        rgb: (N, 3) の配列（0-1）
+
+    Returns:
+        16進数カラーコード (#rrggbb) のリスト
+    """
+    return rgb_bytes_to_hex(rgb_to_bytes(rgb))
+
+
+def lab_to_hex(lab: np.ndarray) -> List[str]:
+    """CIE L*a*b*を16進数カラーコードに変換（sRGBの範囲外は切り詰める）
+
+    Args:
+        lab: (N, 3) の配列
+
+    Returns:
+        16進数カラーコード (#rrggbb) のリスト
+    """
+    return rgb_to_hex(lab_to_rgb(lab))
+
+
+def hsv_to_hex(hsv: np.ndarray) -> List[str]:
+    """HSVを16進数カラーコードに変換（color_utils.hsv_to_hexの配列版）
+
+    Args:
+        hsv: (N, 3) の配列（色相・彩度・明度とも 0-1）
+
+    Returns:
+        16進数カラーコード (#rrggbb) のリスト
+    """
+    return rgb_to_hex(hsv_to_rgb(hsv))
@@ -2,14 +2,20 @@
 MS Color Generator - 色関連ユーティリティ（config統合版）
 """
 
+import math
 import random
-import colorsys
-import itertools
-from typing import List, Tuple, Optional
+from collections import Counter
+from typing import List, Tuple, Optional, Sequence, Hashable
 
+import numpy as np
+
+import color_convert
 from models import ColorGenerationParams
 from config import COLOR_SETTINGS, SYSTEM_SETTINGS
 
+# 色生成用の乱数生成器（候補をまとめて引く）
+_rng = np.random.default_rng()
+
 
 def hsv_to_hex(h: float, s: float, v: float) -> str:
     """HSV値を16進数カラーコードに変換
@@ -23,16 +29,7 @@ def hsv_to_hex(h: float, s: float, v: float) -> str:
         16進数カラーコード (#rrggbb)
     """
     try:
-        # HSV → RGB変換
-        r, g, b = colorsys.hsv_to_rgb(h / 360.0, s, v)
-        
-        # RGB値を0-255の整数に変換
-        r_int = max(0, min(255, int(r * 255)))
-        g_int = max(0, min(255, int(g * 255)))
-        b_int = max(0, min(255, int(b * 255)))
-        
-        # 16進数文字列に変換
-        return f"#{r_int:02x}{g_int:02x}{b_int:02x}"
+        return color_convert.hsv_to_hex(np.array([[h / 360.0, s, v]]))[0]
     except Exception as e:
         print(f"❌ [COLOR_UTILS] HSV→HEX変換エラー: {e}")
         # configからフォールバック色を取得
@@ -48,37 +45,37 @@ def hex_to_hsv(hex_color: str) -> Tuple[float, float, float]:
     Returns:
         (色相[度], 彩度[%], 明度[%])のタプル
     """
-    if not hex_color or not isinstance(hex_color, str):
-        return (0.0, 0.0, 0.0)
-    
-    # #を除去
-    hex_color = hex_color.lstrip('#')
-    
-    if len(hex_color) != 6:
-        return (0.0, 0.0, 0.0)
+    h, s, v = hex_to_hsv_array([hex_color])[0].tolist()
+    return (h, s, v)
+
+
+def hex_to_hsv_array(colors: Sequence[str]) -> np.ndarray:
+    """16進数カラーコードをまとめてHSV値に変換（hex_to_hsvの配列版）
     
-    try:
-        # RGB値を取得
-        r = int(hex_color[0:2], 16) / 255.0
-        g = int(hex_color[2:4], 16) / 255.0
-        b = int(hex_color[4:6], 16) / 255.0
-        
-        # HSV値に変換
-        h, s, v = colorsys.rgb_to_hsv(r, g, b)
-        
-        # 度数とパーセンテージに変換（configから精度取得）
-        hue_precision = COLOR_SETTINGS["hue_display_precision"]
-        sat_precision = COLOR_SETTINGS["saturation_display_precision"]
-        bright_precision = COLOR_SETTINGS["brightness_display_precision"]
+    Args:
+        colors: 16進数カラーコード (#rrggbb または rrggbb) のリスト
         
-        h_deg = round(h * 360.0, hue_precision)
-        s_percent = round(s * 100.0, sat_precision)
-        v_percent = round(v * 100.0, bright_precision)
+    Returns:
+        (N, 3) の [色相(度), 彩度(%), 明度(%)]（configの表示精度で丸め、不正な色は0）
+    """
+    hsv = color_convert.hex_to_hsv(colors) * np.array([360.0, 100.0, 100.0])
+    # 度数とパーセンテージを表示精度で丸める（configから精度取得）
+    for channel, key in enumerate(("hue_display_precision", "saturation_display_precision",
+                                   "brightness_display_precision")):
+        hsv[:, channel] = np.round(hsv[:, channel], COLOR_SETTINGS[key])
+    return hsv
+
+
+def hsv_array_to_hex(hsv: np.ndarray) -> List[str]:
+    """[色相(度), 彩度(%), 明度(%)] の配列をまとめて16進数カラーコードに変換
+    
+    Args:
+        hsv: (N, 3) の配列（hex_to_hsv_arrayと同じ単位）
         
-        return (h_deg, s_percent, v_percent)
-    except (ValueError, TypeError) as e:
-        print(f"❌ [COLOR_UTILS] HEX→HSV変換エラー ({hex_color}): {e}")
-        return (0.0, 0.0, 0.0)
+    Returns:
+        16進数カラーコード (#rrggbb) のリスト
+    """
+    return color_convert.hsv_to_hex(np.asarray(hsv, dtype=np.float64) / np.array([360.0, 100.0, 100.0]))
 
 
 def calculate_hue_distance(hue1: float, hue2: float) -> float:
@@ -98,9 +95,144 @@ def calculate_hue_distance(hue1: float, hue2: float) -> float:
         return 0.0
 
 
+def _uniform_range(base: float, spread: float, size) -> np.ndarray:
+    """base ± spread（0-100 に制限）の一様乱数を 0-1 に換算して生成（size は配列の形状）"""
+    return _rng.uniform(max(0, base - spread), min(100, base + spread), size) / 100.0
+
+
+def max_hue_distance(hue_range: float, count: int) -> float:
+    """色相範囲に count 色を置いたときに実現できる最小色相距離の最大値
+
+    Args:
+        hue_range: 色相誤差範囲（中心から±この値、度）
+        count: 色数
+
+    Returns:
+        最小色相距離の上限（度）
+    """
+    if count <= 1:
+        return 180.0
+    width = 2 * hue_range
+    if width >= 360:
+        # 全周: 等間隔に並べたときの間隔
+        return 360.0 / count
+    # 弧: 両端の色同士も円周側で離す必要がある
+    return min(width / (count - 1), 360.0 / count)
+
+
+def sample_separated_hues(hue_start: float, hue_width: float, count: int,
+                          min_distance: float, size: Optional[int] = None) -> np.ndarray:
+    """色相の弧上に互いの距離が min_distance 以上の色相を一様に配置（間隔分割法、O(n)）
+
+    各間隔に min_distance を先に割り当て、残りの幅を一様な比率（指数乱数の正規化）で
+    分配する。棄却を行わないため、実現可能な組み合わせなら必ず1回で得られる。
+    min_distance が0なら独立な一様乱数と同じ分布になる。
+
+    Args:
+        hue_start: 弧の始点（度）
+        hue_width: 弧の幅（度、360以上なら全周）
+        count: 色数
+        min_distance: 最小色相距離（max_hue_distance以下であること）
+        size: 生成する配色数（省略時は1配色分を1次元で返す）
+
+    Returns:
+        (count,) または (size, count) の色相（0-360度、配色ごとにランダムな順序）
+    """
+    batch = () if size is None else (size,)
+    if hue_width >= 360:
+        # 全周: count個の間隔に余りを分配し、全体をランダムに回転
+        gaps = _rng.exponential(size=batch + (count,))
+        gaps *= (360.0 - count * min_distance) / gaps.sum(axis=-1, keepdims=True)
+        gaps += min_distance
+        hues = _rng.uniform(0, 360, batch)[..., None] + np.cumsum(gaps, axis=-1)
+    else:
+        # 弧: 両端の色同士が円周側で近づかないよう、配置する幅を 360 - min_distance までに制限
+        span = min(hue_width, 360.0 - min_distance)
+        start = hue_start + _rng.uniform(0, hue_width - span, batch)[..., None]
+        # 両端の余白を含む count + 1 個の区間に余りを分配
+        parts = _rng.exponential(size=batch + (count + 1,))
+        offsets = np.cumsum(parts[..., :count], axis=-1)
+        offsets *= (span - (count - 1) * min_distance) / parts.sum(axis=-1, keepdims=True)
+        hues = start + offsets + np.arange(count) * min_distance
+    return _rng.permuted(hues % 360, axis=-1)
+
+
+def _equal_hues(params: ColorGenerationParams) -> np.ndarray:
+    """等間隔生成モードの色相（0-360度、並び替え前）"""
+    count = params.color_count
+    
+    # 色相範囲を計算
+    hue_start = params.hue_center - params.hue_range
+    hue_end = params.hue_center + params.hue_range
+    total_range = hue_end - hue_start
+    
+    if count == 1:
+        # 1色の場合は中心色相を使用
+        hues = np.array([params.hue_center])
+    elif total_range >= 360:
+        # 全色相範囲（360度以上）の場合は特別処理
+        step = 360.0 / count
+        hues = np.arange(count) * step
+        print(f"🔍 [DEBUG] 全色相範囲: step={step:.1f}°")
+    else:
+        # 部分的な色相範囲の場合
+        step = total_range / max(1, count - 1)
+        hues = hue_start + np.arange(count) * step
+    
+    # 色相を0-360度の範囲に正規化
+    return hues % 360
+
+
+def feasible_hue_distance(params: ColorGenerationParams) -> Tuple[float, Optional[str]]:
+    """実現できる範囲に制限した最小色相距離
+    
+    Args:
+        params: 色生成パラメータ
+        
+    Returns:
+        (生成に使う最小色相距離, 制限した場合の警告文（制限しない場合はNone）)
+    """
+    min_distance = params.min_hue_distance
+    limit = max_hue_distance(params.hue_range, params.color_count)
+    if min_distance <= limit:
+        return min_distance, None
+    warning = (f"最小色相距離 {min_distance:g}° は色相範囲 ±{params.hue_range:g}° の"
+               f"{params.color_count}色では実現できません。最大の {limit:.1f}° で生成しました")
+    return limit, warning
+
+
+def sample_palettes(params: ColorGenerationParams, size: int) -> np.ndarray:
+    """パラメータに基づいて配色をまとめて生成
+    
+    Args:
+        params: 色生成パラメータ
+        size: 生成する配色数
+        
+    Returns:
+        (size, color_count, 3) のHSV配列（色相・彩度・明度とも 0-1）
+    """
+    count = params.color_count
+    if params.equal_hue_spacing:
+        # 等間隔で生成した色相を配色ごとにランダムに並び替え
+        hues = _rng.permuted(np.tile(_equal_hues(params), (size, 1)), axis=-1)
+    else:
+        # 最小色相距離を満たす配置を直接生成（実現できない距離は最大値に制限）
+        min_distance, _ = feasible_hue_distance(params)
+        hues = sample_separated_hues(
+            params.hue_center - params.hue_range, 2 * params.hue_range, count, min_distance, size
+        )
+    
+    # 彩度と明度はランダム生成
+    saturations = _uniform_range(params.saturation_base, params.saturation_range, (size, count))
+    brightnesses = _uniform_range(params.brightness_base, params.brightness_range, (size, count))
+    return np.stack([hues / 360.0, saturations, brightnesses], axis=-1)
+
+
 def generate_colors_from_params(params: ColorGenerationParams) -> List[str]:
     """パラメータに基づいて色を動的生成
     
+    乱数はnumpy.random.Generatorでまとめて引き、HEX変換も配列で行う。
+    
     Args:
         params: 色生成パラメータ
         
@@ -111,105 +243,21 @@ def generate_colors_from_params(params: ColorGenerationParams) -> List[str]:
     
     try:
         if params.equal_hue_spacing:
-            # 等間隔生成モード
             print(f"🔍 [DEBUG] 等間隔生成モード: {params.color_count}色を等間隔で生成")
-            
-            # 色相範囲を計算
-            hue_start = params.hue_center - params.hue_range
-            hue_end = params.hue_center + params.hue_range
-            total_range = hue_end - hue_start
-            
-            if params.color_count == 1:
-                # 1色の場合は中心色相を使用
-                hues = [params.hue_center]
-            elif total_range >= 360:
-                # 全色相範囲（360度以上）の場合は特別処理
-                step = 360.0 / params.color_count
-                hues = [i * step for i in range(params.color_count)]
-                print(f"🔍 [DEBUG] 全色相範囲: step={step:.1f}°")
-            else:
-                # 部分的な色相範囲の場合
-                step = total_range / max(1, params.color_count - 1)
-                hues = [hue_start + i * step for i in range(params.color_count)]
-            
-            # 色相を0-360度の範囲に正規化
-            hues = [h % 360 for h in hues]
-            
-            # 等間隔で生成した色相をランダムに並び替え
-            random.shuffle(hues)
-            
-            # 表示精度でフォーマット（configから取得）
-            hue_precision = COLOR_SETTINGS["hue_display_precision"]
-            print(f"🔍 [DEBUG] 等間隔色相（シャッフル後）: {[f'{h:.{hue_precision}f}°' for h in hues]}")
-            
-            for h in hues:
-                # 彩度と明度はランダム生成
-                s_percent = random.uniform(
-                    max(0, params.saturation_base - params.saturation_range),
-                    min(100, params.saturation_base + params.saturation_range)
-                )
-                s = s_percent / 100.0
-                
-                v_percent = random.uniform(
-                    max(0, params.brightness_base - params.brightness_range),
-                    min(100, params.brightness_base + params.brightness_range)
-                )
-                v = v_percent / 100.0
-                
-                colors.append(hsv_to_hex(h, s, v))
-        
         else:
-            # 従来のランダム生成モード（色相距離チェック付き）
             print(f"🔍 [DEBUG] ランダム生成モード: 最小色相距離 {params.min_hue_distance}°")
-            
-            generated_hues = []
-            # configから最大試行回数を取得
-            max_attempts = SYSTEM_SETTINGS["max_color_generation_attempts"]
-            
-            for i in range(params.color_count):
-                attempts = 0
-                while attempts < max_attempts:
-                    # 色相をランダム生成
-                    h = random.uniform(
-                        params.hue_center - params.hue_range,
-                        params.hue_center + params.hue_range
-                    ) % 360
-                    
-                    # 既存の色相との距離をチェック
-                    if all(calculate_hue_distance(h, existing_h) >= params.min_hue_distance 
-                           for existing_h in generated_hues):
-                        generated_hues.append(h)
-                        break
-                    
-                    attempts += 1
-                
-                # 最大試行回数に達した場合は距離チェックを無視して追加
-                if attempts >= max_attempts:
-                    h = random.uniform(
-                        params.hue_center - params.hue_range,
-                        params.hue_center + params.hue_range
-                    ) % 360
-                    generated_hues.append(h)
-                    print(f"⚠️ [DEBUG] 色相距離チェック失敗: {h:.1f}° を強制追加")
-                
-                # 彩度と明度はランダム生成
-                s_percent = random.uniform(
-                    max(0, params.saturation_base - params.saturation_range),
-                    min(100, params.saturation_base + params.saturation_range)
-                )
-                s = s_percent / 100.0
-                
-                v_percent = random.uniform(
-                    max(0, params.brightness_base - params.brightness_range),
-                    min(100, params.brightness_base + params.brightness_range)
-                )
-                v = v_percent / 100.0
-                
-                colors.append(hsv_to_hex(generated_hues[-1], s, v))
-            
-            # 表示精度でフォーマット（configから取得）
-            hue_precision = COLOR_SETTINGS["hue_display_precision"]
-            print(f"🔍 [DEBUG] ランダム生成色相: {[f'{h:.{hue_precision}f}°' for h in generated_hues]}")
+            _, warning = feasible_hue_distance(params)
+            if warning:
+                print(f"⚠️ [COLOR_UTILS] {warning}")
+        
+        hsv = sample_palettes(params, 1)[0]
+        
+        # 表示精度でフォーマット（configから取得）
+        hue_precision = COLOR_SETTINGS["hue_display_precision"]
+        label = "等間隔色相（シャッフル後）" if params.equal_hue_spacing else "ランダム生成色相"
+        print(f"🔍 [DEBUG] {label}: {[f'{h * 360:.{hue_precision}f}°' for h in hsv[:, 0]]}")
+        
+        colors = color_convert.hsv_to_hex(hsv)
         
     except Exception as e:
         print(f"❌ [COLOR_UTILS] 色生成エラー: {e}")
@@ -223,6 +271,81 @@ def generate_colors_from_params(params: ColorGenerationParams) -> List[str]:
     return colors
 
 
+def count_distinct_permutations(items: Sequence[Hashable]) -> int:
+    """重複を含む列の異なる並びの数（多項係数 n! / Π 各値の個数!）
+    
+    Args:
+        items: 並べる要素のリスト（同じ値は区別しない）
+        
+    Returns:
+        異なる並びの数
+    """
+    total = math.factorial(len(items))
+    for count in Counter(items).values():
+        total //= math.factorial(count)
+    return total
+
+
+def unrank_distinct_permutation(items: Sequence[Hashable], rank: int) -> List[Hashable]:
+    """異なる並びを辞書順（値は最初に現れた順）に番号付けしたときの rank 番目の並びを作成
+    
+    各位置で「その値を置いた場合の残りの並びの数」を引きながら値を決める（Lehmer符号の多重集合版）。
+    計算量は要素数 × 異なる値の数で、並びを列挙しない。
+    
+    Args:
+        items: 並べる要素のリスト
+        rank: 0 以上 count_distinct_permutations(items) 未満の番号
+        
+    Returns:
+        rank 番目の並び
+    """
+    counts = Counter(items)
+    values = list(counts)
+    remaining = len(items)
+    block = count_distinct_permutations(items)
+    result = []
+    while remaining:
+        for value in values:
+            if counts[value] == 0:
+                continue
+            # この値を先頭に置いた並びの数 = 残りの並びの数 × この値の割合
+            size = block * counts[value] // remaining
+            if rank < size:
+                result.append(value)
+                counts[value] -= 1
+                remaining -= 1
+                block = size
+                break
+            rank -= size
+    return result
+
+
+def sample_distinct_permutations(items: Sequence[Hashable], k: int) -> List[List[Hashable]]:
+    """互いに異なる並びを k 個ランダムに選ぶ（全順列を作らない）
+    
+    異なる並びの番号を重複なしで抽選し、番号から並びを復元する。
+    時間・メモリは k × 要素数 × 異なる値の数に比例し、n! に依存しない。
+    
+    Args:
+        items: 並べる要素のリスト（同じ値は区別しない）
+        k: 選ぶ並びの数
+        
+    Returns:
+        異なる並びのリスト（異なる並びが k 個未満なら全ての並び）
+    """
+    total = count_distinct_permutations(items)
+    # random.sample(range(total), ...) は total が 2**63 を超えると OverflowError になるため、
+    # 番号を1つずつ引いて重複を捨てる（k は小さく、total が大きいほど重複はまれ）
+    ranks: List[int] = []
+    drawn = set()
+    while len(ranks) < min(k, total):
+        rank = random.randrange(total)
+        if rank not in drawn:
+            drawn.add(rank)
+            ranks.append(rank)
+    return [unrank_distinct_permutation(items, rank) for rank in ranks]
+
+
 def generate_four_patterns(colors: List[str], groups: List[str]) -> List[List[str]]:
     """4つの異なる色割り当てパターンを生成（重複なし完全ランダム）
     
@@ -239,28 +362,23 @@ def generate_four_patterns(colors: List[str], groups: List[str]) -> List[List[st
         raise ValueError(f"色数({len(colors)})とグループ数({len(groups)})が一致しません")
     
     try:
-        # 全ての順列を生成
-        all_permutations = list(itertools.permutations(colors))
-        print(f"🎨 [DEBUG] 全順列数: {len(all_permutations)}通り")
+        # 同じ色を含む場合は見た目が同じになる並びを1つとして数える（順列は列挙しない）
+        total = count_distinct_permutations(colors)
+        print(f"🎨 [DEBUG] 異なる並びの数: {total}通り")
         
         # パターン数をconfigから取得
         from config import HSV_VARIATION_PATTERNS
         pattern_count = HSV_VARIATION_PATTERNS["pattern_count"]
         
-        # 指定数以上の順列がある場合は重複なしで選択
-        if len(all_permutations) >= pattern_count:
-            selected_patterns = random.sample(all_permutations, pattern_count)
+        # 異なる並びから重複なしで選択
+        result_patterns = sample_distinct_permutations(colors, pattern_count)
+        if len(result_patterns) >= pattern_count:
             print(f"🎨 [DEBUG] 完全ランダムで{pattern_count}パターン選択")
         else:
-            # 不足の場合は全て使用
-            selected_patterns = all_permutations
-            # 不足分は最初のパターンをコピーして補完
-            while len(selected_patterns) < pattern_count:
-                selected_patterns.append(all_permutations[0] if all_permutations else tuple(colors))
-            print(f"🎨 [DEBUG] 全パターン使用+補完: {len(selected_patterns)}個")
-        
-        # tupleをlistに変換
-        result_patterns = [list(pattern) for pattern in selected_patterns]
+            # 不足の場合は全て使用し、不足分は最初のパターンをコピーして補完
+            while len(result_patterns) < pattern_count:
+                result_patterns.append(list(result_patterns[0]) if result_patterns else list(colors))
+            print(f"🎨 [DEBUG] 全パターン使用+補完: {len(result_patterns)}個")
         
         # デバッグ出力
         for i, pattern in enumerate(result_patterns, 1):
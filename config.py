@@ -18,7 +18,9 @@ else:
 
 # ======================= アプリケーション基本設定 =======================
 VERSION = "v1.4.2 beta"
-MAX_LAYERS = 50  # 読み込み可能な最大レイヤー数
+# 読み込み可能な最大レイヤー数（layerN.png の N がこれを超えるファイルは読み込まない）
+# 閉形式合成は被覆レイヤー数を uint8 で数えるため 255 まで（layer_manager.MAX_COVERAGE_LAYERS）
+MAX_LAYERS = 255
 
 # ======================= 色設定 =======================
 TARGET_COLOR = (255, 0, 255)  # マゼンタ色をターゲット色として指定（RGB値）
@@ -40,6 +42,7 @@ PATTERN_GALLERY_HEIGHT = 250  # パターンギャラリーの高さ（ピクセ
 FILE_PREFIX = "composite"
 SAVE_DIR = "./output"      # 保存フォルダ
 LAYER_DIR = "./layer"      # レイヤー読み込みフォルダ
+STACK_CACHE_DIR = "./layer_cache"  # コンパイル済みレイヤースタックのディスクキャッシュ
 CONFIG_FILE = "grouping.txt"  # 設定ファイル名
 BACKUP_DIR = "./oldpy"     # バックアップフォルダ
 
@@ -172,6 +175,7 @@ COLOR_SETTINGS = {
     
     # 透明度・表示設定
     "overlay_alpha": 0.5,               # レイヤークリック時のオーバーレイ透明度（0.0-1.0）
+    "overlay_sprite_cache_size": 4,     # キャッシュするオーバーレイ（レイヤー×色、1枚あたり約5MB）の数
     "default_rgb_fallback": (170, 207, 83),  # RGB変換エラー時のフォールバック値
     
     # エラー時フォールバック色セット
@@ -183,6 +187,30 @@ COLOR_SETTINGS = {
     "brightness_display_precision": 0   # 明度表示小数点桁数
 }
 
+# ======================= ベスト配色探索設定 =======================
+# 多数の候補配色を生成・採点して上位を返すモード（ColorGenerationParams.best_of_n）
+PALETTE_SEARCH_SETTINGS = {
+    "time_budget_ms": 150,              # 候補の生成・採点に使う時間の上限（ミリ秒）
+    "finish_reserve_ms": 10,            # 予算のうち採点後の集計（正規化・並べ替え）に残す時間（ミリ秒）
+    "probe_batch": 32,                  # 処理速度が未計測のときに速度を測るために最初に生成する候補数
+    "min_batch": 256,                   # 追加で生成する候補数の下限（残り時間で足りなければ打ち切り）
+    "max_batch": 4096,                  # 1回にまとめて採点する候補数の上限（作業メモリの制限）
+    "max_candidates": 20000,            # 1回の探索の候補数の上限
+    # 採点の重み（各指標は候補全体で 0-1 に正規化してから重み付けする）
+    "weights": {
+        "value_contrast": 1.0,          # 明度差（L*の全ペアの平均差）
+        "hue_spread": 1.0,              # 色相の広がり（最小色相距離）
+        "harmony": 1.0,                 # 色相ハーモニー（テンプレートへの適合度）
+    },
+    # 色相ハーモニーのテンプレート: [(扇形の中心の相対角度, 扇形の幅), ...]
+    # Cohen-Orらの色相テンプレートのうち、他に含まれない T型（半円）と X型（向かい合う2つの扇形）。
+    # i・V・L型は T型に、I・Y型は X型に含まれるため、最小のずれを求める際には結果が変わらない
+    "harmony_templates": {
+        "T": [(0, 180)],
+        "X": [(0, 93.6), (180, 93.6)],
+    },
+}
+
 # ======================= Phase 2: 画像処理設定 =======================
 # 画像読み込み・処理に関する設定
 IMAGE_SETTINGS = {
@@ -195,17 +223,73 @@ IMAGE_SETTINGS = {
     "file_encoding": "utf-8",           # 設定ファイル読み込みエンコーディング
     "layer_file_pattern": r"layer(\d+)\.png",  # レイヤーファイル名正規表現パターン
     "layer_file_flags": re.IGNORECASE,  # レイヤーファイル検索フラグ
+    "layer_package_file": "layers.npz", # ラベルマップ形式のレイヤーパッケージ（あればlayerXファイルより優先）
     
     # 画像キャッシュ設定
     "enable_image_cache": True,         # 画像キャッシュ有効化
     "cache_cleanup_threshold": 50       # キャッシュクリーンアップ閾値
 }
 
+# ======================= 合成エンジン設定 =======================
+# レイヤー合成処理に関する設定
+COMPOSITE_SETTINGS = {
+    # 合成エンジン選択
+    # "sequential": 従来のレイヤー順次乗算（multiply_rgbaと同じ計算）
+    # "fixed": 整数固定小数点でのレイヤー順次乗算（uint16バッファに上書き累積、各乗算をsequentialと同じく
+    #          切り捨てるため結果はsequentialと同一）
+    # "factorized": グループ分解型の閉形式合成（陰影積 × グループ色^被覆数）【近似】
+    #              正確な積を1回だけ丸めるため、レイヤーごとに切り捨てるsequentialより明るくなる
+    #              許容誤差: 各ピクセル・チャンネルで sequential との差が -1 〜 (値を暗くするレイヤー数 + 1) 階調
+    #              （同梱の26レイヤー・ランダム配色で最大23階調・平均約1.2階調）
+    # "signature": 画素クラス（各レイヤーの乗数の列・アルファの組）ごとにfixedと同じ計算をして索引で集める（既定）
+    #              （結果はsequentialと同一。クラスが多すぎるセットではfixedにフォールバック）
+    "engine": "signature",
+    "available_engines": ["sequential", "fixed", "factorized", "signature"],
+    # sequentialと結果が一致しない近似エンジン。allow_approximate が False の間は選んでも
+    # 結果が一致する "fixed" で合成する
+    "approximate_engines": ["factorized"],
+    "allow_approximate": False,
+    "signature_max_class_ratio": 0.25,  # クラス数 / ピクセル数 の上限（超えると効果がないため使わない）
+    
+    # 解像度ピラミッド（読み込み時に面積平均で作成する縮小率）
+    # ギャラリーは PATTERN_GALLERY_HEIGHT 以上を保てる最小の解像度で合成する
+    "pyramid_factors": [2, 4],
+    
+    # コンパイル済みスタックを STACK_CACHE_DIR にメモリマップ可能な形式で保存し、
+    # 次回起動時はレイヤーファイルの更新時刻とサイズが変わったものだけデコードする
+    "use_disk_cache": True,
+    
+    # 合成結果キャッシュの容量（MB）。同じ色・解像度の再合成を省く
+    "composite_cache_mb": 64,
+    
+    # タイル合成（キャンバスを tile_size 四方のタイルに分け、作業メモリを1タイル分に抑える）
+    # True: 常に使う, False: 使わない, "auto": tiled_min_pixels 以上のキャンバスだけで使う
+    # 結果はフルフレーム合成と同一（差分合成・バッチ合成は行わない）
+    "tiled": "auto",
+    "tile_size": 512,
+    "tiled_min_pixels": 3840 * 2160,
+    
+    # 出力バッファプール（合成結果を書き込む (H, W, 4) 配列を解像度ごとに再利用する）
+    # 包んだ画像がすべて破棄された（キャッシュ・UI状態・表示のどこからも参照されない）バッファだけを再利用する
+    "reuse_output_buffers": True,
+    "output_pool_size": 8               # 解像度ごとにプールが管理するバッファの最大数（超えた分は通常の配列）
+}
+
+# ======================= レイヤーセット設定 =======================
+# 別のMSレイヤーセット（LAYER_DIRと同じ階層にあるlayerXファイルのフォルダ）の切り替え設定
+LAYER_SET_SETTINGS = {
+    "discover_siblings": True,          # LAYER_DIRと同じ階層からレイヤーセットを探す
+    "resident_budget_mb": 256,          # 常駐させるコンパイル済みセットのメモリ上限（MB）
+    
+    # レイヤーPNGのデコード（PILのデコーダはGILを解放するためスレッドで並列化できる）
+    "decode_workers": min(8, os.cpu_count() or 1),  # デコードに使うスレッド数
+    "background_decode": True           # デコード完了を待たずにUIを起動（初回合成で未完了のレイヤーだけ待つ）
+}
+
 # ======================= Phase 2: システム設定 =======================
 # アプリケーション動作に関するシステム設定
 SYSTEM_SETTINGS = {
     # 色生成・処理設定
-    "max_color_generation_attempts": 100,  # 色生成最大試行回数
     "flag_reset_delay": 1.0,               # プログラム的更新フラグリセット遅延時間（秒）
     
     # ファイル・フォーマット設定
@@ -236,9 +320,9 @@ RESTART_SETTINGS = {
 BACKUP_SETTINGS = {
     # バックアップ対象ファイル一覧
     "target_files": [
-        "config.py", "models.py", "presets.py", "color_utils.py",
-        "layer_manager.py", "ui.py", "ui_handlers.py", "ui_state.py", 
-        "ui_utils.py", "ui_generators.py", "main.py", "grouping.txt"
+        "config.py", "models.py", "presets.py", "color_utils.py", "color_convert.py", "palette_search.py",
+        "layer_manager.py", "layer_stack.py", "layer_sets.py", "layer_package.py", "image_cache.py", "startup_timing.py", "ui.py", "ui_handlers.py", "ui_state.py", 
+        "ui_utils.py", "ui_generators.py", "main.py", "benchmark_compose.py", "grouping.txt"
     ],
     
     # バックアップフォルダ設定
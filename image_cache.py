@@ -0,0 +1,270 @@
+"""
+MS Color Generator - レイヤー画像・合成画像キャッシュ
+"""
+
+import sys
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+
+class LayerImageCache:
+    """デコード済みレイヤー画像の容量制限付きLRUキャッシュ
+
+    ヒット時は最近使用した位置に移動し、容量を超えたら最も古い画像から破棄する。
+    キャッシュした画像は共有されるため、呼び出し側で変更してはならない。
+    デコードスレッドから並行して呼ばれるため、登録・破棄はロックで保護する。
+    """
+
+    def __init__(self, max_size: int, cleanup_threshold: int, enabled: bool = True):
+        """初期化
+
+        Args:
+            max_size: キャッシュする画像の最大数（IMAGE_CACHE_SIZE）
+            cleanup_threshold: この数を超えたら古い画像を破棄する閾値
+            enabled: キャッシュを有効にするか（無効時は毎回デコード）
+        """
+        self.capacity = max(1, min(max_size, cleanup_threshold))
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: 'OrderedDict[Hashable, Image.Image]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, loader: Callable[[Hashable], Image.Image]) -> Image.Image:
+        """画像を取得（未キャッシュならloaderでデコードして登録）
+
+        Args:
+            key: キャッシュキー（レイヤーファイルパス）
+            loader: キャッシュミス時に画像をデコードする関数
+
+        Returns:
+            デコード済み画像
+        """
+        with self._lock:
+            img = self._entries.get(key)
+            if img is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return img
+            self.misses += 1
+
+        # デコードはロックの外で行う（他のスレッドのデコードを妨げない）
+        img = loader(key)
+        if self.enabled:
+            with self._lock:
+                self._entries[key] = img
+                while len(self._entries) > self.capacity:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return img
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        """キャッシュした画像をすべて破棄（統計はそのまま）"""
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """ヒット・ミス・破棄回数と現在のサイズ"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+            "capacity": self.capacity,
+        }
+
+
+class CompositeCache:
+    """合成結果の容量（バイト数）制限付きLRUキャッシュ
+
+    キーは合成内容（各レイヤーの色・解像度レベル・合成エンジン）から作るため、
+    ギャラリーの切り替えや色を元に戻した場合など、同じ内容の再合成を省ける。
+    キャッシュした画像は共有されるため、呼び出し側で変更してはならない。
+    複数のリクエストから並行して呼ばれるため、登録・破棄はロックで保護する。
+    """
+
+    def __init__(self, budget_bytes: int):
+        """初期化
+
+        Args:
+            budget_bytes: キャッシュする画像の合計バイト数の上限
+        """
+        self.budget_bytes = budget_bytes
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: 'OrderedDict[Hashable, Image.Image]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _image_bytes(img: Image.Image) -> int:
+        """画像のバイト数"""
+        return img.width * img.height * len(img.getbands())
+
+    def get(self, key: Hashable) -> Optional[Image.Image]:
+        """合成画像を取得
+
+        Args:
+            key: 合成内容のキー
+
+        Returns:
+            キャッシュ済みの画像（なければNone）
+        """
+        with self._lock:
+            img = self._entries.get(key)
+            if img is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return img
+
+    def put(self, key: Hashable, img: Image.Image):
+        """合成画像を登録（容量を超えたら古い画像から破棄）
+
+        Args:
+            key: 合成内容のキー
+            img: 合成画像
+        """
+        size = self._image_bytes(img)
+        if size > self.budget_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.used_bytes -= self._image_bytes(self._entries.pop(key))
+            self._entries[key] = img
+            self.used_bytes += size
+            while self.used_bytes > self.budget_bytes:
+                _, old = self._entries.popitem(last=False)
+                self.used_bytes -= self._image_bytes(old)
+                self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        """キャッシュした画像をすべて破棄（統計はそのまま）"""
+        with self._lock:
+            self._entries.clear()
+            self.used_bytes = 0
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """ヒット・ミス・破棄回数と使用バイト数"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+                "used_bytes": self.used_bytes,
+                "budget_bytes": self.budget_bytes,
+            }
+
+
+def _refcount(buffers: List[np.ndarray], index: int) -> int:
+    """プールが管理するバッファの参照カウント（_FREE_REFCOUNT と同じ数え方で測る）"""
+    return sys.getrefcount(buffers[index])
+
+
+# プールのリストだけが参照しているバッファの参照カウント
+_FREE_REFCOUNT = _refcount([np.empty(0, dtype=np.uint8)], 0)
+
+
+class OutputBufferPool:
+    """合成出力バッファ（解像度ごとの (H, W, 4) uint8 配列）の再利用プール
+
+    合成エンジンはプールから取り出したバッファに直接書き込み、画像はバッファを
+    コピーせずに包む（Image.fromarray は連続したRGBA配列のメモリを共有する）。
+    プールは渡したバッファを解像度ごとに max_buffers 個まで覚えておき、
+    どこからも参照されていない（包んだ画像・配列のビューがすべて破棄された）バッファだけを
+    再利用する。参照の有無はバッファの参照カウントで判定するため、画像を保持する側
+    （合成結果キャッシュ・UI状態・Gradio）は何もしなくてよい。
+    """
+
+    def __init__(self, max_buffers: int, enabled: bool = True):
+        """初期化
+
+        Args:
+            max_buffers: 解像度ごとにプールが管理するバッファの最大数（超えた分は通常の配列として確保）
+            enabled: 再利用を有効にするか（無効時は毎回新しいバッファを確保）
+        """
+        self.max_buffers = max(0, max_buffers)
+        self.enabled = enabled
+        self.allocations = 0
+        self.reuses = 0
+        self._buffers: Dict[Tuple[int, int], List[np.ndarray]] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, height: int, width: int) -> np.ndarray:
+        """出力バッファを取得（参照されていないバッファがなければ新しく確保）
+
+        最も前に渡したバッファから使う（表示が終わってから時間が経ったものを優先する）。
+
+        Args:
+            height: 高さ
+            width: 幅
+
+        Returns:
+            (height, width, 4) uint8 の配列（内容は未初期化）
+        """
+        with self._lock:
+            buffers = self._buffers.setdefault((height, width), []) if self.enabled else []
+            for index in range(len(buffers)):
+                if _refcount(buffers, index) <= _FREE_REFCOUNT:
+                    # 再利用したバッファは最後に回す
+                    buffers.append(buffers.pop(index))
+                    self.reuses += 1
+                    return buffers[-1]
+            self.allocations += 1
+            buffer = np.empty((height, width, 4), dtype=np.uint8)
+            if self.enabled and len(buffers) < self.max_buffers:
+                buffers.append(buffer)
+            return buffer
+
+    @staticmethod
+    def wrap(buffer: np.ndarray) -> Image.Image:
+        """バッファをコピーせずにRGBA画像として包む
+
+        画像が残っている間はバッファの参照が残るため、プールは再利用しない。
+
+        Args:
+            buffer: acquireで取得したバッファ（書き込み済み）
+
+        Returns:
+            バッファとメモリを共有する読み取り専用の画像
+        """
+        return Image.fromarray(buffer, "RGBA")
+
+    def clear(self):
+        """管理しているバッファをすべて手放す（使用中のバッファは参照している側が使い終わるまで残る）"""
+        with self._lock:
+            self._buffers.clear()
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """新規確保・再利用回数と、管理しているバッファの数・使用中の数・バイト数"""
+        with self._lock:
+            in_use = sum(_refcount(buffers, index) > _FREE_REFCOUNT
+                         for buffers in self._buffers.values() for index in range(len(buffers)))
+            buffers = [buffer for group in self._buffers.values() for buffer in group]
+            return {
+                "allocations": self.allocations,
+                "reuses": self.reuses,
+                "buffers": len(buffers),
+                "in_use": in_use,
+                "buffer_bytes": sum(buffer.nbytes for buffer in buffers),
+            }
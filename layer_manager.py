@@ -3,21 +3,636 @@ MS Color Generator - レイヤー管理クラス（config統合版）
 """
 
 import os
-import re
+import threading
 from datetime import datetime
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Tuple, Optional, Sequence
 
 import numpy as np
 from PIL import Image
 
 from config import (
-    MAX_LAYERS, TARGET_COLOR, DEFAULT_GROUP_COLOR, 
-    SAVE_DIR, LAYER_DIR, CONFIG_FILE, IMAGE_SETTINGS, 
-    SYSTEM_SETTINGS, COLOR_SETTINGS
+    TARGET_COLOR, DEFAULT_GROUP_COLOR, 
+    SAVE_DIR, IMAGE_SETTINGS, 
+    SYSTEM_SETTINGS, COLOR_SETTINGS, COMPOSITE_SETTINGS, PATTERN_GALLERY_HEIGHT, HSV_VARIATION_PATTERNS,
+    IMAGE_CACHE_SIZE, LAYER_SET_SETTINGS
 )
 from models import ColorGenerationParams
 from presets import COLOR_PRESETS
+import color_convert
 from color_utils import generate_colors_from_params, generate_four_patterns
+from palette_search import PaletteSearch
+from layer_stack import LayerStack
+from image_cache import LayerImageCache, CompositeCache, OutputBufferPool
+from layer_sets import LayerSetRegistry, LayerSet
+from startup_timing import startup_timer
+
+# 指数（ピクセルを覆うグループ内レイヤー数）は uint8 で数えるため、閉形式合成で扱えるレイヤー数の上限
+MAX_COVERAGE_LAYERS = int(np.iinfo(np.uint8).max)
+
+
+class FactorizedCompositor:
+    """グループ分解型の閉形式合成エンジン
+
+    乗算合成の結果は「全レイヤーのマゼンタ以外の陰影の積」に
+    「各グループ色 ^ そのピクセルを覆うグループ内レイヤー数」を掛けたものになる。
+    陰影積を1回だけ計算しておき、再着色はグループの被覆領域だけを乗算する。
+    正確な積を1回だけ丸めるため、レイヤーごとに切り捨てる順次乗算とは一致しない近似エンジン
+    （許容誤差は COMPOSITE_SETTINGS の説明を参照）。
+    グループ分割と差分合成の状態は複数のリクエストから並行して使われるため、ロックで保護する。
+    """
+
+    def __init__(self, stack: LayerStack):
+        """初期化（定数陰影積とアルファを事前計算）
+
+        Args:
+            stack: 合成対象のレイヤースタック
+        """
+        self.check_layer_count(stack.num_layers)
+        self.stack = stack
+        height, width = stack.height, stack.width
+        # 合成中に他のスレッドがグループ分割・差分合成の状態を書き換えないようにする
+        self._lock = threading.RLock()
+
+        # 定数陰影積（マゼンタ領域の陰影は白 = 1.0）
+        self.shading_product = stack.shading_product()
+        self.alpha = np.zeros((height, width), dtype=np.uint8)
+        for i in np.flatnonzero(stack.valid):
+            np.maximum(self.alpha, stack.alphas[i], out=self.alpha)
+
+        # どのグループにも覆われないピクセルは配色によらず一定なので先に量子化しておく
+        self.base_output = self._quantize(self.shading_product.copy())
+
+        # グループ分割ごとの指数マップ（分割が変わった時だけ再構築）
+        self._partition: Optional[Tuple[str, ...]] = None
+        self.group_members: List[List[int]] = []
+        self.group_regions: List[Tuple[np.ndarray, np.ndarray]] = []
+        self.exponent_maps = np.zeros((0, height * width), dtype=np.uint8)
+        self.covered = np.zeros(0, dtype=np.intp)
+        self.covered_shading = np.zeros((0, 3), dtype=np.float32)
+        self.class_exponents = np.zeros((0, 0), dtype=np.uint8)
+        self.class_counts = np.zeros(0, dtype=np.intp)
+
+        # 差分合成用の状態（メイン画像の直前の合成結果）
+        self.reset_incremental()
+
+    @staticmethod
+    def check_layer_count(num_layers: int):
+        """閉形式合成で扱えるレイヤー数か確認（超える場合は指数が桁あふれするためValueError）
+
+        Args:
+            num_layers: レイヤー数
+        """
+        if num_layers > MAX_COVERAGE_LAYERS:
+            raise ValueError(f"レイヤー数 {num_layers} は閉形式合成の上限 {MAX_COVERAGE_LAYERS} を超えています")
+
+    def reset_incremental(self):
+        """差分合成キャッシュを破棄"""
+        with self._lock:
+            self._state_colors: Optional[List[Tuple[int, int, int]]] = None
+            self._state_output: Optional[np.ndarray] = None
+            self._others: Dict[int, np.ndarray] = {}
+
+    def set_partition(self, layer_groups: List[str]):
+        """レイヤー→グループの割り当てから指数マップを構築
+
+        Args:
+            layer_groups: 各レイヤーのグループ名（同じ名前のレイヤーは同じ色）
+        """
+        with self._lock:
+            partition = tuple(layer_groups[:self.stack.num_layers])
+            if partition == self._partition:
+                return
+
+            members: Dict[str, List[int]] = {}
+            for i, group in enumerate(partition):
+                if self.stack.valid[i]:
+                    members.setdefault(group, []).append(i)
+
+            self.group_members = []
+            self.group_regions = []
+            exponent_maps = []
+            for indices in members.values():
+                # ピクセルごとの被覆レイヤー数（= グループ色の指数）
+                exponent = self.stack.masks[indices].sum(axis=0, dtype=np.uint8).ravel()
+                region = np.flatnonzero(exponent)
+                if region.size == 0:
+                    continue
+                self.group_members.append(indices)
+                self.group_regions.append((region, exponent[region]))
+                exponent_maps.append(exponent)
+
+            self.exponent_maps = (np.stack(exponent_maps) if exponent_maps
+                                  else np.zeros((0, self.stack.height * self.stack.width), dtype=np.uint8))
+
+            # いずれかのグループに覆われるピクセルを、グループごとの指数の組（クラス）順に並べる
+            # 同じクラスのピクセルは配色ごとに同じ係数が掛かるため、連続領域としてまとめて処理できる
+            covered = np.flatnonzero(self.exponent_maps.any(axis=0))
+            if covered.size:
+                signatures, inverse, counts = np.unique(
+                    self.exponent_maps[:, covered].T, axis=0, return_inverse=True, return_counts=True
+                )
+                covered = covered[np.argsort(inverse.reshape(-1), kind="stable")]
+            else:
+                signatures = np.zeros((0, len(self.group_regions)), dtype=np.uint8)
+                counts = np.zeros(0, dtype=np.intp)
+            self.covered = covered
+            self.covered_shading = self.shading_product.reshape(-1, 3)[covered] * 255.0
+            self.class_exponents = signatures
+            self.class_counts = counts
+            self._partition = partition
+            self.reset_incremental()
+
+    def _group_colors(self, layer_colors: List[str]) -> List[Tuple[int, int, int]]:
+        """各グループの代表色（グループ先頭レイヤーの色）をRGBで取得"""
+        rgbs = LayerColorizer.colors_to_rgb([layer_colors[indices[0]] for indices in self.group_members])
+        return [tuple(rgb) for rgb in rgbs.tolist()]
+
+    @staticmethod
+    def _powers(rgb: Tuple[int, int, int], max_exponent: int) -> np.ndarray:
+        """色の累乗テーブル (max_exponent+1, 3) を作成"""
+        color = np.asarray(rgb, dtype=np.float32) / 255.0
+        return color[None, :] ** np.arange(max_exponent + 1, dtype=np.float32)[:, None]
+
+    def _quantize(self, rgb: np.ndarray) -> np.ndarray:
+        """0-1のRGB積をRGBA uint8配列に変換"""
+        out = np.empty((self.stack.height, self.stack.width, 4), dtype=np.uint8)
+        np.rint(rgb * 255.0, out=rgb)
+        out[..., :3] = rgb.clip(0, 255)
+        out[..., 3] = self.alpha
+        return out
+
+    def _compose_covered(self, batch_colors: List[List[Tuple[int, int, int]]]) -> np.ndarray:
+        """被覆ピクセルだけを配色ごとに乗算（パターン軸でベクトル化）
+
+        Args:
+            batch_colors: 配色ごとの各グループRGBのリスト
+
+        Returns:
+            (N, 被覆ピクセル数, 3) uint8 の配列
+        """
+        count = len(batch_colors)
+        colors = np.asarray(batch_colors, dtype=np.float32).reshape(count, -1, 3) / 255.0
+
+        # クラスごとの係数 = Π グループ色^指数
+        factors = np.ones((count, len(self.class_counts), 3), dtype=np.float32)
+        for k in range(colors.shape[1]):
+            exponent = self.class_exponents[:, k]
+            powers = colors[:, k, None, :] ** np.arange(int(exponent.max()) + 1, dtype=np.float32)[None, :, None]
+            factors *= powers[:, exponent]
+
+        values = np.repeat(factors, self.class_counts, axis=1)
+        values *= self.covered_shading
+        np.rint(values, out=values)
+        return values.clip(0, 255).astype(np.uint8)
+
+    def _compose_full(self, group_colors: List[Tuple[int, int, int]],
+                      out: Optional[np.ndarray] = None) -> np.ndarray:
+        """全グループを乗算して合成（outを指定した場合はそこに書き込む）"""
+        if out is None:
+            out = self.base_output.copy()
+        else:
+            np.copyto(out, self.base_output)
+        out.reshape(-1, 4)[self.covered, :3] = self._compose_covered([group_colors])[0]
+        return out
+
+    def compose(self, layer_colors: List[str], layer_groups: List[str],
+                out: Optional[np.ndarray] = None) -> np.ndarray:
+        """閉形式で合成
+
+        Args:
+            layer_colors: 各レイヤーの色のリスト
+            layer_groups: 各レイヤーのグループ名のリスト
+            out: 書き込み先の (H, W, 4) uint8 配列（省略時は新しく確保）
+
+        Returns:
+            (H, W, 4) uint8 のRGBA配列
+        """
+        with self._lock:
+            self.set_partition(layer_groups)
+            return self._compose_full(self._group_colors(layer_colors), out)
+
+    def compose_batch(self, layer_colors_batch: List[List[str]], layer_groups: List[str],
+                      out: Optional[Sequence[np.ndarray]] = None) -> Sequence[np.ndarray]:
+        """複数の配色をまとめて閉形式で合成（パターン軸でベクトル化）
+
+        Args:
+            layer_colors_batch: 配色ごとの各レイヤー色リストのリスト
+            layer_groups: 各レイヤーのグループ名のリスト（全配色で共通）
+            out: 配色ごとの書き込み先 (H, W, 4) uint8 配列のリスト（省略時は (N, H, W, 4) を確保）
+
+        Returns:
+            配色ごとの (H, W, 4) uint8 のRGBA配列（outを省略した場合は (N, H, W, 4) 配列）
+        """
+        with self._lock:
+            self.set_partition(layer_groups)
+            count = len(layer_colors_batch)
+            batch_colors = [self._group_colors(layer_colors) for layer_colors in layer_colors_batch]
+
+            if out is None:
+                out = np.empty((count,) + self.base_output.shape, dtype=np.uint8)
+            values = self._compose_covered(batch_colors)
+            for k in range(count):
+                np.copyto(out[k], self.base_output)
+                out[k].reshape(-1, 4)[self.covered, :3] = values[k]
+            return out
+
+    def _other_groups_product(self, k: int) -> np.ndarray:
+        """グループkの被覆領域における「陰影積 × 他グループの寄与」を計算"""
+        region = self.group_regions[k][0]
+        values = self.shading_product.reshape(-1, 3)[region]
+        for j, color in enumerate(self._state_colors):
+            if j == k:
+                continue
+            exponent = self.exponent_maps[j, region]
+            overlap = np.flatnonzero(exponent)
+            if overlap.size:
+                values[overlap] *= self._powers(color, int(exponent.max()))[exponent[overlap]]
+        return values
+
+    def compose_incremental(self, layer_colors: List[str], layer_groups: List[str],
+                            out: Optional[np.ndarray] = None) -> np.ndarray:
+        """直前の合成結果から差分合成（1グループだけの変更は被覆領域のみ再計算）
+
+        Args:
+            layer_colors: 各レイヤーの色のリスト
+            layer_groups: 各レイヤーのグループ名のリスト
+            out: 書き込み先の (H, W, 4) uint8 配列（省略時は新しく確保）
+
+        Returns:
+            (H, W, 4) uint8 のRGBA配列
+        """
+        with self._lock:
+            self.set_partition(layer_groups)
+            group_colors = self._group_colors(layer_colors)
+
+            if self._state_output is None:
+                changed = None
+            else:
+                changed = [k for k, (new, old) in enumerate(zip(group_colors, self._state_colors)) if new != old]
+
+            if changed is None or len(changed) > 1:
+                # 初回または複数グループ変更時は全体を再合成
+                self._state_output = self._compose_full(group_colors)
+                self._state_colors = group_colors
+                self._others = {}
+            elif changed:
+                k = changed[0]
+                if k not in self._others:
+                    # 他グループが変わるまで再利用する
+                    self._others = {k: self._other_groups_product(k)}
+                region, exponent = self.group_regions[k]
+                values = self._others[k] * self._powers(group_colors[k], int(exponent.max()))[exponent]
+                np.rint(values * 255.0, out=values)
+                self._state_output.reshape(-1, 4)[region, :3] = values.clip(0, 255)
+                self._state_colors[k] = group_colors[k]
+
+            if out is None:
+                return self._state_output.copy()
+            np.copyto(out, self._state_output)
+            return out
+
+
+class SignatureCompositor:
+    """画素クラス（各レイヤーの乗数の列・アルファの組）ごとに計算して集める合成エンジン
+
+    順次乗算の結果は、各レイヤーがピクセルに掛ける乗数（マゼンタ領域は指定色、それ以外は陰影）の列と
+    アルファだけで決まる。読み込み時に乗数の列とアルファが同じピクセルをクラスにまとめ、
+    ピクセル → クラスの索引を作っておく。合成ではクラスごとに LayerColorizer._compose_fixed_point と
+    同じ切り捨ての乗算を行い、索引で1回 take してキャンバスに戻すため、結果は順次乗算と同一。
+    差分合成では、色が変わったグループのマゼンタ領域を含むクラスのピクセルだけを集め直す。
+    グループ分割と差分合成の状態は複数のリクエストから並行して使われるため、ロックで保護する。
+    """
+
+    def __init__(self, stack: LayerStack, max_class_ratio: float):
+        """初期化（画素クラスと索引を構築）
+
+        Args:
+            stack: 合成対象のレイヤースタック
+            max_class_ratio: クラス数 / ピクセル数 がこれを超えたら使わない（enabled=False）
+        """
+        self.stack = stack
+        pixels = stack.height * stack.width
+        alpha = stack.composite_alpha.reshape(-1)
+        layers = np.flatnonzero(stack.valid)
+        self._lock = threading.RLock()
+
+        # レイヤーごとに、値が変わるピクセルの (現在のクラス, 乗数) の組を一意化して新しいクラスに分ける
+        # 乗数は陰影のRGBを24ビットに詰めた値、マゼンタ領域は配色で決まるため 1 << 24 とする
+        ids = alpha.astype(np.int64)
+        next_id = 256
+        for i in layers:
+            indices, active, positions = stack.active_pixels(i)
+            codes = (active[:, 0].astype(np.int64) << 16) | (active[:, 1].astype(np.int64) << 8) | active[:, 2]
+            codes[positions] = 1 << 24
+            keys, inverse = np.unique(ids[indices] << 25 | codes, return_inverse=True)
+            ids[indices] = next_id + inverse.reshape(-1)
+            next_id += keys.size
+        _, first, inverse = np.unique(ids, return_index=True, return_inverse=True)
+
+        self.num_classes = first.size
+        self.enabled = self.num_classes <= max_class_ratio * pixels
+        self.index = inverse.reshape(stack.height, stack.width).astype(np.int32)
+        self.class_alpha = alpha[first]
+
+        # レイヤーごとに値が変わるクラスとその乗数（LayerStack.active_pixels のクラス版）
+        # 同じクラスのピクセルは乗数の列が同じなので、代表ピクセルで判定すればよい
+        self.layer_classes: Dict[int, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+        for i in layers:
+            indices, active, positions = stack.active_pixels(i)
+            rows = np.searchsorted(indices, first)
+            hit = rows < indices.size
+            hit[hit] = indices[rows[hit]] == first[hit]
+            rows = rows[hit]
+            is_mask = np.zeros(indices.size, dtype=bool)
+            is_mask[positions] = True
+            self.layer_classes[int(i)] = (np.flatnonzero(hit).astype(np.int32), active[rows],
+                                          np.flatnonzero(is_mask[rows]).astype(np.int32))
+
+        # グループ分割ごとの被覆ピクセル（分割が変わった時だけ再構築）
+        self._partition: Optional[Tuple[str, ...]] = None
+        self.group_members: List[List[int]] = []
+        self.group_regions: List[np.ndarray] = []
+        self.reset_incremental()
+
+        status = "使用" if self.enabled else f"クラスが多すぎるため固定小数点合成にフォールバック（上限 {max_class_ratio:.0%}）"
+        print(f"🧮 [COMPOSITE] 画素クラス: {self.num_classes}クラス / {pixels}ピクセル "
+              f"({self.num_classes / max(pixels, 1):.1%}), {status}")
+
+    def reset_incremental(self):
+        """差分合成キャッシュを破棄"""
+        with self._lock:
+            self._state_rgbs: Optional[np.ndarray] = None
+            self._state_output: Optional[np.ndarray] = None
+
+    def set_partition(self, layer_groups: List[str]):
+        """レイヤー→グループの割り当てから、グループごとの被覆ピクセルを計算
+
+        Args:
+            layer_groups: 各レイヤーのグループ名（同じ名前のレイヤーは同じ色）
+        """
+        with self._lock:
+            partition = tuple(layer_groups[:self.stack.num_layers])
+            if partition == self._partition:
+                return
+
+            members: Dict[str, List[int]] = {}
+            for i, group in enumerate(partition):
+                if self.stack.valid[i]:
+                    members.setdefault(group, []).append(i)
+            self.group_members = list(members.values())
+            # グループのいずれかのレイヤーのマゼンタ領域を含むクラスのピクセル（グループ色で値が変わる範囲）
+            index = self.index.reshape(-1)
+            self.group_regions = []
+            for indices in self.group_members:
+                covered = np.zeros(self.num_classes, dtype=bool)
+                for i in indices:
+                    classes, _, positions = self.layer_classes[i]
+                    covered[classes[positions]] = True
+                self.group_regions.append(np.flatnonzero(covered[index]))
+            self._partition = partition
+            self.reset_incremental()
+
+    def _class_tables(self, layer_rgbs: np.ndarray) -> np.ndarray:
+        """配色ごとにクラスの合成色を計算（パターン軸でベクトル化）
+
+        Args:
+            layer_rgbs: 配色ごとの各レイヤーのRGB (N, レイヤー数, 3) uint8
+
+        Returns:
+            (N, クラス数, 4) uint8 のRGBAテーブル
+        """
+        count = layer_rgbs.shape[0]
+        # クラス × 配色の順に並べ、4チャンネル目は詰め物（1クラス・1配色=uint64の1要素として集める）
+        acc = np.full((self.num_classes, count, 4), 255, dtype=np.uint16)
+        pixels = acc.view(np.uint64).reshape(self.num_classes, count)
+        for i, (classes, active, positions) in self.layer_classes.items():
+            colored = np.repeat(active[:, None], count, axis=1).astype(np.uint16)
+            colored[positions, :, :3] = layer_rgbs[:, i]
+            values = pixels[classes].view(np.uint16).reshape(-1, count, 4)
+            values *= colored
+            LayerColorizer._div255_floor_inplace(values, colored)
+            pixels[classes] = values.view(np.uint64).reshape(-1, count)
+
+        table = np.empty((count, self.num_classes, 4), dtype=np.uint8)
+        table[..., :3] = acc.transpose(1, 0, 2)[..., :3]
+        table[..., 3] = self.class_alpha
+        return table
+
+    def _gather(self, table: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """クラスのテーブルを索引でキャンバスに集める（1ピクセル=uint32の1要素として集める）"""
+        if out is None:
+            out = np.empty((self.stack.height, self.stack.width, 4), dtype=np.uint8)
+        np.take(table.view(np.uint32).reshape(-1), self.index, out=out.view(np.uint32).reshape(out.shape[:2]))
+        return out
+
+    def compose(self, layer_colors: List[str], layer_groups: List[str],
+                out: Optional[np.ndarray] = None) -> np.ndarray:
+        """クラスごとに色を計算して索引で集める
+
+        Args:
+            layer_colors: 各レイヤーの色のリスト
+            layer_groups: 各レイヤーのグループ名のリスト
+            out: 書き込み先の (H, W, 4) uint8 配列（省略時は新しく確保）
+
+        Returns:
+            (H, W, 4) uint8 のRGBA配列
+        """
+        rgbs = LayerColorizer.colors_to_rgb(layer_colors[:self.stack.num_layers])
+        return self._gather(self._class_tables(rgbs[None])[0], out)
+
+    def compose_batch(self, layer_colors_batch: List[List[str]], layer_groups: List[str],
+                      out: Optional[Sequence[np.ndarray]] = None) -> Sequence[np.ndarray]:
+        """複数の配色をまとめて合成（クラスのテーブルをパターン軸でベクトル化し、配色ごとに1回 take）
+
+        Args:
+            layer_colors_batch: 配色ごとの各レイヤー色リストのリスト
+            layer_groups: 各レイヤーのグループ名のリスト（全配色で共通）
+            out: 配色ごとの書き込み先 (H, W, 4) uint8 配列のリスト（省略時は (N, H, W, 4) を確保）
+
+        Returns:
+            配色ごとの (H, W, 4) uint8 のRGBA配列（outを省略した場合は (N, H, W, 4) 配列）
+        """
+        rgbs = np.stack([LayerColorizer.colors_to_rgb(layer_colors[:self.stack.num_layers])
+                         for layer_colors in layer_colors_batch])
+        tables = self._class_tables(rgbs)
+        if out is None:
+            out = np.empty((len(tables), self.stack.height, self.stack.width, 4), dtype=np.uint8)
+        for table, buffer in zip(tables, out):
+            self._gather(table, buffer)
+        return out
+
+    def compose_incremental(self, layer_colors: List[str], layer_groups: List[str],
+                            out: Optional[np.ndarray] = None) -> np.ndarray:
+        """直前の合成結果から差分合成（1グループだけの変更はその被覆ピクセルだけを集め直す）
+
+        クラスのテーブルは全体を計算し直す（クラス数はピクセル数よりはるかに少ない）。
+
+        Args:
+            layer_colors: 各レイヤーの色のリスト
+            layer_groups: 各レイヤーのグループ名のリスト
+            out: 書き込み先の (H, W, 4) uint8 配列（省略時は新しく確保）
+
+        Returns:
+            (H, W, 4) uint8 のRGBA配列
+        """
+        with self._lock:
+            self.set_partition(layer_groups)
+            rgbs = LayerColorizer.colors_to_rgb(layer_colors[:self.stack.num_layers])
+
+            if self._state_output is None:
+                changed = None
+            else:
+                layers = set(np.flatnonzero((rgbs != self._state_rgbs).any(axis=1)).tolist())
+                changed = [k for k, indices in enumerate(self.group_members) if layers.intersection(indices)]
+
+            if changed is None or len(changed) > 1:
+                # 初回または複数グループ変更時は全体を再合成
+                self._state_output = self.compose(layer_colors, layer_groups)
+            elif changed:
+                region = self.group_regions[changed[0]]
+                table = self._class_tables(rgbs[None])[0]
+                pixels = self._state_output.view(np.uint32).reshape(-1)
+                pixels[region] = table.view(np.uint32).reshape(-1)[self.index.reshape(-1)[region]]
+            self._state_rgbs = rgbs
+
+            if out is None:
+                return self._state_output.copy()
+            np.copyto(out, self._state_output)
+            return out
+
+
+class TiledCompositor:
+    """キャンバスを固定サイズのタイルに分けて合成するエンジン
+
+    各合成エンジンの計算はピクセルごとに独立しているため、タイル単位で
+    同じ演算を行えばフルフレームと同一の結果になる。作業バッファは
+    1タイル分（tile_size²ピクセル）だけで、キャンバスやレイヤー数に比例しない。
+    タイルごとの描画ピクセルと陰影積はスタックにキャッシュし、合成のたびに計算し直さない。
+    """
+
+    def __init__(self, stack: LayerStack, tile_size: int):
+        """初期化
+
+        Args:
+            stack: 合成対象のレイヤースタック
+            tile_size: タイルの1辺のピクセル数
+        """
+        self.stack = stack
+        self.tile_size = max(1, int(tile_size))
+
+    def tiles(self):
+        """タイルの範囲を行優先で列挙
+
+        Yields:
+            (縦スライス, 横スライス)のタプル
+        """
+        for y in range(0, self.stack.height, self.tile_size):
+            for x in range(0, self.stack.width, self.tile_size):
+                yield (slice(y, min(y + self.tile_size, self.stack.height)),
+                       slice(x, min(x + self.tile_size, self.stack.width)))
+
+    def compose(self, layer_colors: List[str], layer_groups: List[str], engine: str,
+                out: Optional[np.ndarray] = None) -> np.ndarray:
+        """タイルごとに合成
+
+        Args:
+            layer_colors: 各レイヤーの色のリスト
+            layer_groups: 各レイヤーのグループ名のリスト
+            engine: 合成エンジン名（"sequential" / "fixed" / "factorized" / "signature"、signatureはタイル内を固定小数点で合成）
+            out: 書き込み先の (H, W, 4) uint8 配列（省略時は新しく確保）
+
+        Returns:
+            (H, W, 4) uint8 のRGBA配列
+        """
+        if out is None:
+            out = np.empty((self.stack.height, self.stack.width, 4), dtype=np.uint8)
+        if engine == "factorized" and len(layer_colors) >= self.stack.num_layers:
+            FactorizedCompositor.check_layer_count(self.stack.num_layers)
+            groups = self._group_members(layer_groups)
+            group_colors = LayerColorizer.colors_to_rgb([layer_colors[indices[0]] for indices in groups])
+            for rows, cols in self.tiles():
+                out[rows, cols] = self._compose_factorized(groups, group_colors, rows, cols)
+        elif engine in ("fixed", "signature"):
+            for rows, cols in self.tiles():
+                out[rows, cols] = self._compose_fixed_point(layer_colors, rows, cols)
+        else:
+            for rows, cols in self.tiles():
+                out[rows, cols] = self._compose_sequential(layer_colors, rows, cols)
+        return out
+
+    def _compose_sequential(self, layer_colors: List[str], rows: slice, cols: slice) -> np.ndarray:
+        """タイル内を順次乗算合成（LayerColorizer._compose_sequentialと同じ計算）"""
+        alpha = self.stack.composite_alpha[rows, cols]
+        tile = np.full(alpha.shape + (4,), 255, dtype=np.uint8)
+        tile[..., 3] = alpha
+        pixels = tile.view(np.uint32).reshape(-1)
+
+        for i, rgb in enumerate(LayerColorizer.colors_to_rgb(layer_colors[:self.stack.num_layers])):
+            if not self.stack.valid[i]:
+                continue
+            indices, shading, positions = self.stack.tile_active_pixels(i, rows, cols)
+            colored = shading.astype(np.float32)
+            colored[positions, :3] = rgb
+            values = pixels[indices].view(np.uint8).reshape(-1, 4).astype(np.float32)
+            product = values / 255.0 * (colored / 255.0)
+            pixels[indices] = (product * 255).clip(0, 255).astype(np.uint8).view(np.uint32).reshape(-1)
+        return tile
+
+    def _compose_fixed_point(self, layer_colors: List[str], rows: slice, cols: slice) -> np.ndarray:
+        """タイル内を整数固定小数点で順次乗算合成（LayerColorizer._compose_fixed_pointと同じ計算）"""
+        alpha = self.stack.composite_alpha[rows, cols]
+        acc = np.full((alpha.size, 4), 255, dtype=np.uint16)
+        pixels = acc.view(np.uint64).reshape(-1)
+
+        for i, rgb in enumerate(LayerColorizer.colors_to_rgb(layer_colors[:self.stack.num_layers])):
+            if not self.stack.valid[i]:
+                continue
+            indices, shading, positions = self.stack.tile_active_pixels(i, rows, cols)
+            colored = shading.astype(np.uint16)
+            colored[positions, :3] = rgb
+            values = pixels[indices].view(np.uint16).reshape(-1, 4)
+            values *= colored
+            LayerColorizer._div255_floor_inplace(values, colored)
+            pixels[indices] = values.view(np.uint64).reshape(-1)
+
+        tile = np.empty(alpha.shape + (4,), dtype=np.uint8)
+        tile[..., :3] = acc.reshape(alpha.shape + (4,))[..., :3]
+        tile[..., 3] = alpha
+        return tile
+
+    def _group_members(self, layer_groups: List[str]) -> List[List[int]]:
+        """グループごとの有効レイヤー（FactorizedCompositor.set_partitionと同じ順序）"""
+        members: Dict[str, List[int]] = {}
+        for i, group in enumerate(layer_groups[:self.stack.num_layers]):
+            if self.stack.valid[i]:
+                members.setdefault(group, []).append(i)
+        return list(members.values())
+
+    def _compose_factorized(self, groups: List[List[int]], group_colors: np.ndarray,
+                            rows: slice, cols: slice) -> np.ndarray:
+        """タイル内を閉形式で合成（FactorizedCompositorと同じ計算）
+
+        陰影積 × Π グループ色^被覆数 を、グループ順・乗算順もそろえて計算する。
+        """
+        alpha = self.stack.composite_alpha[rows, cols]
+        shading_product = self.stack.tile_shading_product(rows, cols)
+
+        factors = np.ones_like(shading_product)
+        for indices, rgb in zip(groups, group_colors):
+            # マゼンタ領域の外接矩形がタイルと重ならないレイヤーは指数に寄与しない
+            indices = [i for i in indices if self.stack.mask_overlaps(i, rows, cols)]
+            if not indices:
+                continue
+            exponent = self.stack.masks[indices, rows, cols].sum(axis=0, dtype=np.uint8)
+            if exponent.any():
+                factors *= FactorizedCompositor._powers(rgb, int(exponent.max()))[exponent]
+
+        factors *= shading_product * 255.0
+        np.rint(factors, out=factors)
+        tile = np.empty(alpha.shape + (4,), dtype=np.uint8)
+        tile[..., :3] = factors.clip(0, 255)
+        tile[..., 3] = alpha
+        return tile
 
 
 class LayerColorizer:
@@ -25,96 +640,301 @@ class LayerColorizer:
     
     def __init__(self):
         """LayerColorizerの初期化"""
-        # レイヤーファイル読み込み
-        self.layer_files = self._load_layer_files()
-        self.num_layers = len(self.layer_files)
+        # 画像キャッシュ初期化（容量制限付きLRU）
+        self._image_cache = LayerImageCache(
+            IMAGE_CACHE_SIZE,
+            IMAGE_SETTINGS["cache_cleanup_threshold"],
+            IMAGE_SETTINGS["enable_image_cache"]
+        )
         
-        # 画像キャッシュ初期化
-        self._image_cache: Dict[str, Image.Image] = {}
-        self._load_images_with_cache()
+        # レイヤーセット一覧（コンパイル済みスタックはメモリ上限まで常駐）
+        with startup_timer.phase("レイヤーセット検出"):
+            self.layer_sets = LayerSetRegistry(
+                self._load_layer_image, LAYER_SET_SETTINGS["resident_budget_mb"] * 1024 * 1024
+            )
+        
+        # 合成エンジン（閉形式エンジンは解像度レベルごとに初回使用時に構築）
+        self.composite_engine = COMPOSITE_SETTINGS["engine"]
+        if self.active_engine != self.composite_engine:
+            print(f"⚠️ [COMPOSITE] {self.composite_engine} は近似エンジンのため {self.active_engine} で合成します"
+                  f"（使う場合は COMPOSITE_SETTINGS['allow_approximate'] を True に）")
+        self._composite_cache = CompositeCache(COMPOSITE_SETTINGS["composite_cache_mb"] * 1024 * 1024)
+        # 合成結果の出力バッファ（包んだ画像がすべて破棄されたバッファを次の合成で再利用）
+        self.output_pool = OutputBufferPool(
+            COMPOSITE_SETTINGS["output_pool_size"], COMPOSITE_SETTINGS["reuse_output_buffers"]
+        )
+        self._overlay_sprites = LayerImageCache(
+            COLOR_SETTINGS["overlay_sprite_cache_size"], COLOR_SETTINGS["overlay_sprite_cache_size"]
+        )
+        # ベスト配色探索（処理速度を探索をまたいで引き継ぐ）
+        self.palette_search = PaletteSearch()
         
         # 状態初期化
         self.current_composite: Optional[Image.Image] = None
-        self.current_max_group = 0
+        # 解像度レベルごとの合成エンジンの遅延構築（並行したリクエストで二重に構築しない）
+        self._compositor_lock = threading.Lock()
+        self.active_layer_set: Optional[str] = None
+        self._layer_set: Optional[LayerSet] = None
+        
+        # 既定のレイヤーセットを読み込み（スタック構築・グループ設定読み込み）
+        # PNGのデコードはバックグラウンドで続き、合成時に未完了のレイヤーだけを待つ
+        with startup_timer.phase("レイヤースタック準備・グループ設定"):
+            self._activate_layer_set(self.layer_sets.default_name)
+    
+    def _activate_layer_set(self, name: str):
+        """レイヤーセットを読み込んで現在のセットにする
+        
+        Args:
+            name: セット名
+        """
+        # 切り替え前のグループ割り当てと色はセットに保存しておく
+        if self._layer_set is not None:
+            self._layer_set.saved_state = {
+                "layers": list(self.layers),
+                "group_colors": dict(self.group_colors),
+                "current_max_group": self.current_max_group,
+            }
+        
+        # 合成用レイヤースタックはセットごとに1回だけ構築（ホットパスではPIL/ファイルに触れない）
+        layer_set = self.layer_sets.get(name)
+        self._layer_set = layer_set
+        self.active_layer_set = layer_set.name
+        self.layer_files = layer_set.files
+        self.num_layers = len(layer_set.files)
+        self.layer_stack = layer_set.stack
+        self.grouping_file = layer_set.grouping_file
+        self._factorized: Dict[int, FactorizedCompositor] = layer_set.compositors
+        self._signature: Dict[int, SignatureCompositor] = layer_set.signature_compositors
+        self.current_composite = None
+        
+        if layer_set.saved_state is not None:
+            self.layers = list(layer_set.saved_state["layers"])
+            self.group_colors = dict(layer_set.saved_state["group_colors"])
+            self.current_max_group = layer_set.saved_state["current_max_group"]
+            self.invalidate_composite_cache()
+            return
         
         # グループ設定初期化
+        self.current_max_group = 0
         self.layers = [SYSTEM_SETTINGS["default_group_name"]] * self.num_layers
         self.group_colors = {SYSTEM_SETTINGS["default_group_name"]: DEFAULT_GROUP_COLOR}
         
         # 設定ファイル読み込み
         self._load_grouping_config()
-    
-    def _load_layer_files(self) -> List[str]:
-        """layerXファイルを読み込み
+        self.invalidate_composite_cache()
+
+    def switch_layer_set(self, name: str) -> bool:
+        """別のレイヤーセットに切り替え（常駐済みならコンパイル不要）
         
+        Args:
+            name: セット名
+            
         Returns:
-            レイヤーファイルパスのリスト
+            切り替えに成功したか
         """
-        layer_pattern = re.compile(
-            IMAGE_SETTINGS["layer_file_pattern"], 
-            IMAGE_SETTINGS["layer_file_flags"]
-        )
-        layer_files = {}
+        if name not in self.layer_sets.directories:
+            print(f"❌ [LAYER SET] 不明なレイヤーセット: {name}")
+            return False
+        if name == self.active_layer_set:
+            return True
+        try:
+            self._activate_layer_set(name)
+            print(f"🔁 [LAYER SET] {name} に切り替え: {self.num_layers}レイヤー, "
+                  f"常駐 {', '.join(self.layer_sets.resident_names)}")
+            return True
+        except Exception as e:
+            print(f"❌ [LAYER SET] 切り替えエラー {name}: {e}")
+            return False
+
+    @property
+    def picker_count(self) -> int:
+        """UIに用意するカラーピッカー数（どのセットに切り替えても足りる数）"""
+        return max(self.layer_sets.max_layer_count, self.num_layers)
+
+    def _decode_layer(self, fname: str) -> Image.Image:
+        """レイヤー画像をファイルからデコード
         
-        # layerフォルダが存在しない場合は作成
-        os.makedirs(LAYER_DIR, exist_ok=True)
+        Args:
+            fname: レイヤーファイルパス
+            
+        Returns:
+            デコードされた画像
+        """
+        print(f"📁 [LOAD] ファイルから読み込み: {fname}")
+        return Image.open(fname).convert(IMAGE_SETTINGS["default_image_mode"])
+
+    @staticmethod
+    def _dummy_image() -> Image.Image:
+        """読み込みに失敗したレイヤーの代わりのダミー画像を作成"""
+        # configからダミー画像設定を取得
+        dummy_size = IMAGE_SETTINGS["dummy_image_size"]
+        dummy_color = IMAGE_SETTINGS["dummy_image_color"]
+        return Image.new(IMAGE_SETTINGS["default_image_mode"], dummy_size, dummy_color)
+
+    def get_layer_image(self, index: int) -> Optional[Image.Image]:
+        """レイヤー画像を取得（共有キャッシュ経由、変更禁止）
         
-        # layerフォルダ内のファイルをチェック
-        if os.path.exists(LAYER_DIR):
-            for fname in os.listdir(LAYER_DIR):
-                m = layer_pattern.fullmatch(fname)
-                if m:
-                    idx = int(m.group(1))
-                    if 1 <= idx <= MAX_LAYERS:
-                        layer_files[idx] = os.path.join(LAYER_DIR, fname)
+        デコードした画像は保持せず、必要になった時にスタック（1ビットマスク・陰影）から復元する。
         
-        return [layer_files[i] for i in sorted(layer_files)]
-    
-    def _load_images_with_cache(self):
-        """レイヤー画像をキャッシュ付きで読み込み"""
-        self.orig_images = []
+        Args:
+            index: レイヤーインデックス
+            
+        Returns:
+            レイヤー画像（読み込めない場合はNone）
+        """
+        self.layer_stack.wait_layer(index)
+        if not self.layer_stack.valid[index]:
+            return None
+        return self._image_cache.get((self._layer_set.cache_key, index), lambda _: Image.fromarray(
+            self.layer_stack.colored_layer(index, TARGET_COLOR), "RGBA"))
+
+    def _load_layer_image(self, fname: str) -> Optional[Image.Image]:
+        """スタック構築用にレイヤー画像をデコード（画像はスタックに変換した後は保持しない）
         
-        for i, fname in enumerate(self.layer_files):
-            try:
-                if fname in self._image_cache:
-                    print(f"🔄 [CACHE] キャッシュから読み込み: {fname}")
-                    self.orig_images.append(self._image_cache[fname])
-                else:
-                    print(f"📁 [LOAD] ファイルから読み込み: {fname}")
-                    img = Image.open(fname).convert(IMAGE_SETTINGS["default_image_mode"])
-                    self._image_cache[fname] = img
-                    self.orig_images.append(img)
-                    
-            except FileNotFoundError:
-                print(f"❌ [ERROR] ファイルが見つかりません: {fname}")
-                # configからダミー画像設定を取得
-                dummy_size = IMAGE_SETTINGS["dummy_image_size"]
-                dummy_color = IMAGE_SETTINGS["dummy_image_color"]
-                dummy_img = Image.new(IMAGE_SETTINGS["default_image_mode"], dummy_size, dummy_color)
-                self.orig_images.append(dummy_img)
-            except Exception as e:
-                print(f"❌ [ERROR] 画像読み込みエラー {fname}: {e}")
-                # configからダミー画像設定を取得
-                dummy_size = IMAGE_SETTINGS["dummy_image_size"]
-                dummy_color = IMAGE_SETTINGS["dummy_image_color"]
-                dummy_img = Image.new(IMAGE_SETTINGS["default_image_mode"], dummy_size, dummy_color)
-                self.orig_images.append(dummy_img)
+        Args:
+            fname: レイヤーファイルパス
+            
+        Returns:
+            レイヤー画像（読み込めない場合はNone）
+        """
+        try:
+            return self._decode_layer(fname)
+        except FileNotFoundError:
+            print(f"❌ [ERROR] ファイルが見つかりません: {fname}")
+        except Exception as e:
+            print(f"❌ [ERROR] 画像読み込みエラー {fname}: {e}")
+        return None
+
+    @property
+    def orig_images(self) -> List[Image.Image]:
+        """全レイヤーの元画像（共有キャッシュ経由、変更禁止）"""
+        images = [self.get_layer_image(i) for i in range(self.num_layers)]
+        return [img if img is not None else self._dummy_image() for img in images]
+
+    def layers_at(self, x: int, y: int) -> List[int]:
+        """クリック位置にあるレイヤー（マゼンタ領域）を取得
+        
+        Args:
+            x: X座標
+            y: Y座標
+            
+        Returns:
+            レイヤーインデックスのリスト
+        """
+        return self.layer_stack.layers_at(x, y)
+
+    def groups_at(self, x: int, y: int) -> List[str]:
+        """クリック位置にあるレイヤーのグループを取得
+        
+        Args:
+            x: X座標
+            y: Y座標
+            
+        Returns:
+            グループ名のリスト（重複なし、レイヤー順）
+        """
+        return list(dict.fromkeys(self.layers[i] for i in self.layers_at(x, y)))
+
+    def selection_overlay(self, base: Image.Image, layer_indices: List[int]) -> Image.Image:
+        """選択レイヤーを半透明で重ねたハイライト画像を作成
+        
+        各レイヤーを現在の色で着色し、アルファに overlay_alpha を掛けて
+        base の上に重ねる（Image.alpha_composite と同じ合成をNumPyで一括計算）。
+        
+        Args:
+            base: 下地の画像（メイン画像）
+            layer_indices: ハイライトするレイヤーインデックスのリスト
+            
+        Returns:
+            ハイライト画像
+        """
+        out = np.array(base.convert("RGBA"))
+        if out.shape[:2] != (self.layer_stack.height, self.layer_stack.width):
+            print(f"⚠️ [OVERLAY] メイン画像のサイズ{base.size}がレイヤーと異なるためハイライトしません")
+            return base
+        
+        if not (out[..., 3] == 255).all():
+            # 下地が半透明の場合は一般の over 合成を浮動小数点で計算
+            result = out.astype(np.float32) / 255.0
+            for layer_idx in layer_indices:
+                sprite = self._overlay_layer(layer_idx).astype(np.float32) / 255.0
+                src_alpha = sprite[..., 3:]
+                dst_weight = result[..., 3:] * (1.0 - src_alpha)
+                out_alpha = src_alpha + dst_weight
+                result[..., :3] = (sprite[..., :3] * src_alpha + result[..., :3] * dst_weight) / np.maximum(out_alpha, 1e-6)
+                result[..., 3:] = out_alpha
+            return Image.fromarray(np.rint(result * 255.0).astype(np.uint8), "RGBA")
+        
+        # 不透明な下地では round((src * a + dst * (255 - a)) / 255) を uint16 で計算
+        acc = np.empty(out.shape, dtype=np.uint16)
+        scratch = np.empty_like(acc)
+        for layer_idx in layer_indices:
+            premultiplied, inverse_alpha = self._overlay_sprite(layer_idx)
+            np.multiply(out, inverse_alpha, out=acc)
+            acc += premultiplied
+            out[:] = self._div255_inplace(acc, scratch)
+        return Image.fromarray(out, "RGBA")
+
+    def _overlay_layer(self, layer_index: int) -> np.ndarray:
+        """現在の色で着色し、アルファに overlay_alpha を掛けたレイヤー
+        
+        Args:
+            layer_index: レイヤーインデックス
+            
+        Returns:
+            (H, W, 4) uint8 のRGBA配列
+        """
+        stack = self.layer_stack
+        sprite = stack.colored_layer(layer_index, self.hex_to_rgb(self.get_layer_color(layer_index)))
+        sprite[..., 3] = np.floor(stack.alphas[layer_index] * COLOR_SETTINGS["overlay_alpha"])
+        return sprite
+
+    def _overlay_sprite(self, layer_index: int) -> Tuple[np.ndarray, np.ndarray]:
+        """不透明な下地に重ねるためのハイライト用スプライト（レイヤーと色ごとにキャッシュ）
+        
+        Args:
+            layer_index: レイヤーインデックス
+            
+        Returns:
+            (色 × アルファ, 255 - アルファ)の (H, W, 4) uint16 配列のタプル
+            （アルファチャンネルは 0 と 255 にして下地の不透明度を保つ）
+        """
+        def build(key):
+            sprite = self._overlay_layer(layer_index)
+            alpha = sprite[..., 3:].astype(np.uint16)
+            premultiplied = sprite.astype(np.uint16) * alpha
+            premultiplied[..., 3] = 0
+            inverse_alpha = np.repeat(255 - alpha, 4, axis=-1)
+            inverse_alpha[..., 3] = 255
+            return premultiplied, inverse_alpha
+        
+        rgb = self.hex_to_rgb(self.get_layer_color(layer_index))
+        return self._overlay_sprites.get((self._layer_set.cache_key, layer_index, rgb), build)
+
+    @property
+    def image_cache_stats(self) -> Dict[str, int]:
+        """レイヤー画像キャッシュのヒット・ミス統計"""
+        return self._image_cache.stats
 
     def _load_grouping_config(self):
-        """grouping.txtからグループ設定を読み込み（エラーハンドリング強化）"""
+        """現在のレイヤーセットのgrouping.txt（またはバンドル）からグループ設定を読み込み（エラーハンドリング強化）"""
         try:
-            if not os.path.exists(CONFIG_FILE):
-                print(f"⚠️ [CONFIG] {CONFIG_FILE} が見つかりません。デフォルト設定を使用します。")
+            if self._layer_set.grouping is not None:
+                # バンドルに同梱されたグループ設定
+                text = self._layer_set.grouping
+            elif not os.path.exists(self.grouping_file):
+                print(f"⚠️ [CONFIG] {self.grouping_file} が見つかりません。デフォルト設定を使用します。")
                 self.current_max_group = 3
                 return
-                
-            # configからエンコーディングを取得
-            encoding = IMAGE_SETTINGS["file_encoding"]
-            with open(CONFIG_FILE, encoding=encoding) as f:
-                lines = [line.strip() for line in f if line.strip() and not line.strip().startswith('#')]
+            else:
+                # configからエンコーディングを取得
+                encoding = IMAGE_SETTINGS["file_encoding"]
+                with open(self.grouping_file, encoding=encoding) as f:
+                    text = f.read()
+            lines = [line.strip() for line in text.splitlines() if line.strip() and not line.strip().startswith('#')]
                 
             if not lines:
-                print(f"⚠️ [CONFIG] {CONFIG_FILE} が空です。デフォルト設定を使用します。")
+                print(f"⚠️ [CONFIG] {self.grouping_file} が空です。デフォルト設定を使用します。")
                 self.current_max_group = 3
                 return
                 
@@ -188,16 +1008,16 @@ class LayerColorizer:
                 print(f"✅ [CONFIG] {valid_groups}個のグループを読み込みました")
                 
         except FileNotFoundError:
-            print(f"⚠️ [CONFIG] {CONFIG_FILE} ファイルが見つかりません")
+            print(f"⚠️ [CONFIG] {self.grouping_file} ファイルが見つかりません")
             self.current_max_group = 3
         except PermissionError:
-            print(f"❌ [CONFIG] {CONFIG_FILE} の読み込み権限がありません")
+            print(f"❌ [CONFIG] {self.grouping_file} の読み込み権限がありません")
             self.current_max_group = 3
         except UnicodeDecodeError:
-            print(f"❌ [CONFIG] {CONFIG_FILE} の文字エンコーディングエラー")
+            print(f"❌ [CONFIG] {self.grouping_file} の文字エンコーディングエラー")
             self.current_max_group = 3
         except Exception as e:
-            print(f"❌ [CONFIG] {CONFIG_FILE} 読み込み中に予期しないエラー: {e}")
+            print(f"❌ [CONFIG] {self.grouping_file} 読み込み中に予期しないエラー: {e}")
             self.current_max_group = 3
 
     def get_layer_color(self, layer_index: int) -> str:
@@ -254,8 +1074,19 @@ class LayerColorizer:
             new_group: 新しいグループ名
         """
         if 0 <= layer_index < self.num_layers:
+            if self.layers[layer_index] != new_group:
+                self.invalidate_composite_cache()
             self.layers[layer_index] = new_group
 
+    def invalidate_composite_cache(self):
+        """差分合成キャッシュを破棄（グループ割り当て変更時）
+        
+        group_colorsの変更は合成時に直前の色と比較して検出するため、
+        ここではグループ構成が変わった場合のみ呼び出す。
+        """
+        for compositor in list(self._factorized.values()) + list(self._signature.values()):
+            compositor.reset_incremental()
+
     def sync_colors_by_group(self, color_values: List[str], group_assignments: List[str]) -> List[str]:
         """グループ内で色を同期
         
@@ -309,27 +1140,32 @@ class LayerColorizer:
         """
         print(f"🔍 [DEBUG] パラメータベース色生成開始")
         
-        # 色を動的生成
-        generated_colors = generate_colors_from_params(params)
-        print(f"🔍 [DEBUG] 生成色: {generated_colors}")
-        
         # 使用中のグループを取得（configから）
         default_group = SYSTEM_SETTINGS["default_group_name"]
         used_groups = set(group for group in self.layers if group != default_group)
         used_groups_list = sorted(used_groups)
         print(f"🔍 [DEBUG] 使用中グループ: {used_groups_list}")
-        
-        # 必要な色数を確認
         needed_colors = len(used_groups_list)
-        if needed_colors > len(generated_colors):
-            print(f"⚠️ [DEBUG] 不足している色数: 必要{needed_colors}色、生成{len(generated_colors)}色")
-            # 不足分は色を繰り返して補う
-            while len(generated_colors) < needed_colors:
-                generated_colors.extend(generated_colors)
-            generated_colors = generated_colors[:needed_colors]
         
-        # 4パターン生成
-        pattern_compositions = generate_four_patterns(generated_colors[:needed_colors], used_groups_list)
+        if params.best_of_n:
+            # ベスト配色探索: 採点上位の配色をそれぞれ1パターンとして使う
+            palettes = self.palette_search.search(
+                params, HSV_VARIATION_PATTERNS["pattern_count"], min(needed_colors, params.color_count)
+            )
+            pattern_compositions = [self._repeat_colors(palette, needed_colors) for palette in palettes]
+        else:
+            # 色を動的生成
+            generated_colors = generate_colors_from_params(params)
+            print(f"🔍 [DEBUG] 生成色: {generated_colors}")
+            
+            # 必要な色数を確認
+            if needed_colors > len(generated_colors):
+                print(f"⚠️ [DEBUG] 不足している色数: 必要{needed_colors}色、生成{len(generated_colors)}色")
+            
+            # 4パターン生成
+            pattern_compositions = generate_four_patterns(
+                self._repeat_colors(generated_colors, needed_colors), used_groups_list
+            )
         
         # 最初のパターンを現在の設定として適用
         first_pattern = pattern_compositions[0]
@@ -343,6 +1179,22 @@ class LayerColorizer:
         
         return pattern_compositions
 
+    @staticmethod
+    def _repeat_colors(colors: List[str], count: int) -> List[str]:
+        """色のリストを count 色にそろえる（不足分は色を繰り返して補う）
+        
+        Args:
+            colors: 色のリスト
+            count: 必要な色数
+            
+        Returns:
+            count 色のリスト
+        """
+        repeated = list(colors)
+        while colors and len(repeated) < count:
+            repeated.extend(colors)
+        return repeated[:count]
+
     def apply_random_colors(self, preset_name: str = "ダル") -> List[List[str]]:
         """プリセット名でランダムカラーを適用（後方互換性）
         
@@ -359,60 +1211,46 @@ class LayerColorizer:
             # フォールバック: ダルプリセット
             return self.apply_random_colors_with_params(COLOR_PRESETS["ダル"])
 
-    def compose_layers_with_colors(self, colors: List[str]) -> Image.Image:
+    def _pattern_layer_colors(self, colors: List[str]) -> List[str]:
+        """使用中グループ順の色リストを各レイヤーの色リストに展開
+        
+        Args:
+            colors: 使用中グループ（ソート順）ごとの色のリスト
+            
+        Returns:
+            各レイヤーの色のリスト
+        """
+        # 使用中のグループを取得（configから）
+        default_group = SYSTEM_SETTINGS["default_group_name"]
+        used_groups = set(group for group in self.layers if group != default_group)
+        used_groups_list = sorted(used_groups)
+        
+        # 色をグループに割り当て
+        color_assignment = {}
+        for i, group in enumerate(used_groups_list):
+            if i < len(colors):
+                color_assignment[group] = colors[i]
+            else:
+                color_assignment[group] = DEFAULT_GROUP_COLOR
+        
+        # 各レイヤーの色を決定
+        return [color_assignment.get(layer_group, DEFAULT_GROUP_COLOR) for layer_group in self.layers]
+
+    def compose_layers_with_colors(self, colors: List[str], level: int = 1) -> Image.Image:
         """指定された色リストでレイヤーを合成（エラーハンドリング強化）
         
         Args:
             colors: 色のリスト
+            level: 解像度レベル（縮小率、1はフル解像度）
             
         Returns:
             合成された画像
         """
         try:
-            # 使用中のグループを取得（configから）
-            default_group = SYSTEM_SETTINGS["default_group_name"]
-            used_groups = set(group for group in self.layers if group != default_group)
-            used_groups_list = sorted(used_groups)
-            
-            # 色をグループに割り当て
-            color_assignment = {}
-            for i, group in enumerate(used_groups_list):
-                if i < len(colors):
-                    color_assignment[group] = colors[i]
-                else:
-                    color_assignment[group] = DEFAULT_GROUP_COLOR
-            
-            # 各レイヤーの色を決定
-            layer_colors = []
-            for layer_group in self.layers:
-                layer_colors.append(color_assignment.get(layer_group, DEFAULT_GROUP_COLOR))
-            
-            # 合成処理
-            base = None
-            for i, (fname, col) in enumerate(zip(self.layer_files, layer_colors)):
-                try:
-                    # キャッシュから画像を取得
-                    if fname in self._image_cache:
-                        layer = self._image_cache[fname].copy()
-                    else:
-                        layer = Image.open(fname).convert(IMAGE_SETTINGS["default_image_mode"])
-                        self._image_cache[fname] = layer.copy()
-                    
-                    rgb = self.hex_to_rgb(col)
-                    colored = self.replace_color(layer, rgb)
-                    base = colored if base is None else self.multiply_rgba(base, colored)
-                    
-                except Exception as e:
-                    print(f"❌ [ERROR] レイヤー{i+1}合成エラー: {e}")
-                    continue
+            layer_colors = self._pattern_layer_colors(colors)
             
-            if base is None:
-                print("⚠️ [WARNING] 合成画像がありません。空の画像を作成します")
-                dummy_size = IMAGE_SETTINGS["dummy_image_size"]
-                dummy_color = IMAGE_SETTINGS["dummy_image_color"]
-                base = Image.new(IMAGE_SETTINGS["default_image_mode"], dummy_size, dummy_color)
-                
-            return base
+            # 合成処理（レイヤースタックから）
+            return self._compose_from_stack(layer_colors, self.layers, level=level)
             
         except Exception as e:
             print(f"❌ [ERROR] compose_layers_with_colors 致命的エラー: {e}")
@@ -420,6 +1258,53 @@ class LayerColorizer:
             dummy_color = IMAGE_SETTINGS["dummy_image_color"]
             return Image.new(IMAGE_SETTINGS["default_image_mode"], dummy_size, dummy_color)
 
+    def compose_batch(self, patterns: List[List[str]], level: int = 1) -> List[Image.Image]:
+        """複数パターンをまとめて合成
+        
+        マスク・陰影の処理を全パターンで共有し、パターン軸でベクトル化する。
+        各パターンは出力バッファプールのバッファに直接書き込み、コピーせずに画像にする。
+        
+        Args:
+            patterns: パターンごとの色リスト（compose_layers_with_colorsと同じ形式）
+            level: 解像度レベル（縮小率、1はフル解像度）
+            
+        Returns:
+            合成画像のリスト（キャッシュと共有されるため変更禁止）
+        """
+        self.layer_stack.wait_ready()
+        stack = self.layer_stack.level(level)
+        batch = [self._pattern_layer_colors(colors) for colors in patterns]
+        if not batch or not stack.valid.any():
+            return [self._compose_from_stack(layer_colors, self.layers, level=level) for layer_colors in batch]
+        
+        # 合成済みのパターンはキャッシュから取り出し、残りだけを合成する
+        keys = [self._composite_key(layer_colors, level) for layer_colors in batch]
+        images: List[Optional[Image.Image]] = [self._composite_cache.get(key) for key in keys]
+        missing = [i for i, img in enumerate(images) if img is None]
+        if not missing:
+            return images
+        
+        # 画素クラス・閉形式エンジンはパターン軸でベクトル化して合成する
+        # （画素クラスが多すぎて使わないセットとタイル合成はパターンごとに合成する）
+        engine = self.active_engine
+        if engine in ("factorized", "signature") and not self.uses_tiles(stack) and (
+                engine == "factorized" or self.signature_compositor_for(level).enabled):
+            buffers = [self.output_pool.acquire(stack.height, stack.width) for _ in missing]
+            try:
+                compositor = (self.signature_compositor_for(level) if engine == "signature"
+                              else self.factorized_compositor_for(level))
+                compositor.compose_batch([batch[i] for i in missing], self.layers, out=buffers)
+                for i, buffer in zip(missing, buffers):
+                    images[i] = self.output_pool.wrap(buffer)
+            except Exception as e:
+                print(f"❌ [ERROR] バッチ合成エラー、パターンごとの合成にフォールバック: {e}")
+        
+        for i in missing:
+            if images[i] is None:
+                images[i] = self._render_from_stack(batch[i], self.layers, level=level)
+            self._composite_cache.put(keys[i], images[i])
+        return images
+
     def compose_layers(self, colors: Optional[List[str]] = None) -> Image.Image:
         """レイヤーを合成
         
@@ -430,30 +1315,331 @@ class LayerColorizer:
             合成された画像
         """
         if colors is None:
+            # 現在の色での合成は直前の結果から差分合成する
             colors = [self.get_layer_color(i) for i in range(self.num_layers)]
+            return self._compose_from_stack(colors, self.layers, incremental=True)
+        
+        # 任意の色リストの場合は色ごとにグループ化
+        return self._compose_from_stack(colors, colors)
+
+    @property
+    def factorized_compositor(self) -> FactorizedCompositor:
+        """フル解像度の閉形式合成エンジン（遅延構築）"""
+        return self.factorized_compositor_for(1)
+
+    def factorized_compositor_for(self, level: int) -> FactorizedCompositor:
+        """解像度レベルごとの閉形式合成エンジンを取得（遅延構築）
+        
+        Args:
+            level: 解像度レベル（縮小率）
+            
+        Returns:
+            該当レベルのFactorizedCompositor
+        """
+        with self._compositor_lock:
+            if level not in self._factorized:
+                self.layer_stack.wait_ready()
+                self._factorized[level] = FactorizedCompositor(self.layer_stack.level(level))
+            return self._factorized[level]
+
+    def signature_compositor_for(self, level: int) -> SignatureCompositor:
+        """解像度レベルごとの画素クラス合成エンジンを取得（遅延構築）
+        
+        Args:
+            level: 解像度レベル（縮小率）
             
-        base = None
-        for fname, col in zip(self.layer_files, colors):
+        Returns:
+            該当レベルのSignatureCompositor（クラスが多すぎる場合は enabled=False）
+        """
+        with self._compositor_lock:
+            if level not in self._signature:
+                self.layer_stack.wait_ready()
+                self._signature[level] = SignatureCompositor(
+                    self.layer_stack.level(level), COMPOSITE_SETTINGS["signature_max_class_ratio"])
+            return self._signature[level]
+
+    @property
+    def active_engine(self) -> str:
+        """実際に使う合成エンジン（近似エンジンは allow_approximate が True の場合だけ使い、それ以外は "fixed"）"""
+        if (self.composite_engine in COMPOSITE_SETTINGS["approximate_engines"]
+                and not COMPOSITE_SETTINGS["allow_approximate"]):
+            return "fixed"
+        return self.composite_engine
+
+    @staticmethod
+    def uses_tiles(stack: LayerStack) -> bool:
+        """タイル合成を使うか（COMPOSITE_SETTINGS["tiled"]に従う）
+        
+        Args:
+            stack: 合成対象のレイヤースタック（解像度レベル）
+            
+        Returns:
+            タイル合成を使う場合True
+        """
+        mode = COMPOSITE_SETTINGS["tiled"]
+        if mode == "auto":
+            return bool(stack.valid.any()) and stack.height * stack.width >= COMPOSITE_SETTINGS["tiled_min_pixels"]
+        return bool(mode) and bool(stack.valid.any())
+
+    @property
+    def gallery_level(self) -> int:
+        """ギャラリー表示用の解像度レベル（表示高さを下回らない最小解像度）
+        
+        起動直後に縮小レベルをバックグラウンドで構築中の場合は、フル解像度で合成せずに構築を待つ。
+        """
+        stack = self.layer_stack
+        wanted = [factor for factor in COMPOSITE_SETTINGS["pyramid_factors"]
+                  if factor > 1 and stack.height // factor >= PATTERN_GALLERY_HEIGHT]
+        if wanted and max(wanted) not in stack.levels:
+            stack.wait_pyramid()
+        candidates = [factor for factor, level in stack.levels.items()
+                      if level.height >= PATTERN_GALLERY_HEIGHT]
+        return max(candidates, default=1)
+
+    def _composite_key(self, layer_colors: List[str], level: int) -> Tuple:
+        """合成結果キャッシュのキーを作成
+        
+        レイヤー→グループ割り当てとグループ→色の対応は、合成結果に対しては
+        「各レイヤーの色」に集約される。表記ゆれを吸収するためRGB値で比較する。
+        
+        Args:
+            layer_colors: 各レイヤーの色のリスト
+            level: 解像度レベル（縮小率）
+            
+        Returns:
+            (レイヤーセットの内容キー, 合成エンジン, 解像度レベル, 各レイヤーのRGB値のバイト列)のタプル
+        """
+        stack = self.layer_stack.level(level)
+        rgbs = self.colors_to_rgb(layer_colors[:stack.num_layers]).tobytes()
+        return (self._layer_set.cache_key, self.active_engine, level, rgbs)
+
+    @property
+    def composite_cache_stats(self) -> Dict[str, int]:
+        """合成結果キャッシュのヒット・ミス統計（監視用）"""
+        return self._composite_cache.stats
+
+    def _compose_from_stack(self, layer_colors: List[str], layer_groups: List[str],
+                           incremental: bool = False, level: int = 1) -> Image.Image:
+        """レイヤースタックから乗算合成（同じ内容の合成結果はキャッシュから返す）
+        
+        Args:
+            layer_colors: 各レイヤーの色のリスト（先頭から順に適用）
+            layer_groups: 各レイヤーのグループ名のリスト（同じグループは同じ色）
+            incremental: 直前の合成結果からの差分合成を使うか（画素クラス・閉形式エンジンのみ）
+            level: 解像度レベル（縮小率、1はフル解像度）
+            
+        Returns:
+            合成された画像（キャッシュと共有されるため変更禁止）
+        """
+        self.layer_stack.wait_ready()
+        if not self.layer_stack.level(level).valid.any():
+            return self._render_from_stack(layer_colors, layer_groups, incremental, level)
+        
+        key = self._composite_key(layer_colors, level)
+        img = self._composite_cache.get(key)
+        if img is None:
+            img = self._render_from_stack(layer_colors, layer_groups, incremental, level)
+            self._composite_cache.put(key, img)
+        return img
+
+    def _render_from_stack(self, layer_colors: List[str], layer_groups: List[str],
+                           incremental: bool = False, level: int = 1) -> Image.Image:
+        """レイヤースタックから乗算合成（設定された合成エンジンで実行）
+        
+        Args:
+            layer_colors: 各レイヤーの色のリスト（先頭から順に適用）
+            layer_groups: 各レイヤーのグループ名のリスト（同じグループは同じ色）
+            incremental: 直前の合成結果からの差分合成を使うか（画素クラス・閉形式エンジンのみ）
+            level: 解像度レベル（縮小率、1はフル解像度）
+            
+        Returns:
+            合成された画像
+        """
+        stack = self.layer_stack.level(level)
+        if not stack.valid.any():
+            print("⚠️ [WARNING] 合成画像がありません。空の画像を作成します")
+            dummy_size = IMAGE_SETTINGS["dummy_image_size"]
+            dummy_color = IMAGE_SETTINGS["dummy_image_color"]
+            return Image.new(IMAGE_SETTINGS["default_image_mode"], dummy_size, dummy_color)
+        
+        # 合成エンジンは出力バッファに直接書き込み、画像はバッファをコピーせずに包む
+        engine = self.active_engine
+        out = self.output_pool.acquire(stack.height, stack.width)
+        if self.uses_tiles(stack):
+            try:
+                TiledCompositor(stack, COMPOSITE_SETTINGS["tile_size"]).compose(
+                    layer_colors, layer_groups, engine, out=out)
+                return self.output_pool.wrap(out)
+            except Exception as e:
+                print(f"❌ [ERROR] タイル合成エラー、フルフレーム合成にフォールバック: {e}")
+        
+        if engine == "signature" and len(layer_colors) >= stack.num_layers:
+            try:
+                compositor = self.signature_compositor_for(level)
+                if compositor.enabled:
+                    if incremental:
+                        compositor.compose_incremental(layer_colors, layer_groups, out=out)
+                    else:
+                        compositor.compose(layer_colors, layer_groups, out=out)
+                    return self.output_pool.wrap(out)
+            except Exception as e:
+                print(f"❌ [ERROR] 画素クラス合成エラー、固定小数点合成にフォールバック: {e}")
+        
+        if engine == "factorized" and len(layer_colors) >= stack.num_layers:
+            try:
+                compositor = self.factorized_compositor_for(level)
+                if incremental:
+                    compositor.compose_incremental(layer_colors, layer_groups, out=out)
+                else:
+                    compositor.compose(layer_colors, layer_groups, out=out)
+                return self.output_pool.wrap(out)
+            except Exception as e:
+                print(f"❌ [ERROR] 閉形式合成エラー、順次乗算にフォールバック: {e}")
+        
+        # 画素クラス合成が使えないセットは固定小数点合成で代替する（結果は同一）
+        if engine in ("fixed", "signature"):
             try:
-                layer = Image.open(fname).convert(IMAGE_SETTINGS["default_image_mode"])
-                rgb = self.hex_to_rgb(col)
-                colored = self.replace_color(layer, rgb)
-                base = colored if base is None else self.multiply_rgba(base, colored)
+                return self.output_pool.wrap(self._compose_fixed_point(layer_colors, stack, out=out))
             except Exception as e:
-                print(f"❌ [ERROR] レイヤー合成エラー: {e}")
+                print(f"❌ [ERROR] 固定小数点合成エラー、順次乗算にフォールバック: {e}")
+        
+        return self.output_pool.wrap(self._compose_sequential(layer_colors, stack, out=out))
+
+    def _compose_sequential(self, layer_colors: List[str], stack: LayerStack,
+                            out: Optional[np.ndarray] = None) -> np.ndarray:
+        """レイヤーを順次乗算合成（multiply_rgbaと同じ計算）
+        
+        白との乗算は値を変えないため、各レイヤーの描画ピクセルだけを乗算する。
+        処理量はレイヤー数 × キャンバスではなく描画面積に比例する。
+        
+        Args:
+            layer_colors: 各レイヤーの色のリスト（先頭から順に適用）
+            stack: 合成対象のレイヤースタック（解像度レベル）
+            out: 書き込み先の (H, W, 4) uint8 配列（省略時は新しく確保）
+            
+        Returns:
+            (H, W, 4) uint8 のRGBA配列
+        """
+        if out is None:
+            out = np.empty((stack.height, stack.width, 4), dtype=np.uint8)
+        out[...] = 255
+        out[..., 3] = stack.composite_alpha
+        # 1ピクセル=1要素として集める（(N, 4)の行インデックスより大幅に速い）
+        pixels = out.view(np.uint32).reshape(-1)
+        
+        for i, rgb in enumerate(self.colors_to_rgb(layer_colors[:stack.num_layers])):
+            if not stack.valid[i]:
+                continue
+            try:
+                # アルファには255を掛ける（値は変わらない）
+                indices, shading, positions = stack.active_pixels(i)
+                colored = shading.astype(np.float32)
+                colored[positions, :3] = rgb
+                values = pixels[indices].view(np.uint8).reshape(-1, 4).astype(np.float32)
+                product = values / 255.0 * (colored / 255.0)
+                pixels[indices] = (product * 255).clip(0, 255).astype(np.uint8).view(np.uint32).reshape(-1)
+            except Exception as e:
+                print(f"❌ [ERROR] レイヤー{i+1}合成エラー: {e}")
                 continue
+        return out
+
+    def _compose_fixed_point(self, layer_colors: List[str], stack: LayerStack,
+                             out: Optional[np.ndarray] = None) -> np.ndarray:
+        """整数固定小数点でレイヤーを順次乗算合成
         
-        if base is None:
-            dummy_size = IMAGE_SETTINGS["dummy_image_size"]
-            dummy_color = IMAGE_SETTINGS["dummy_image_color"]
-            base = Image.new(IMAGE_SETTINGS["default_image_mode"], dummy_size, dummy_color)
-        return base
+        uint16バッファに上書きで累積し、各乗算は floor(a * b / 255) で切り捨てる
+        （順次乗算のfloat32計算と全てのuint8の組で一致するため、結果は_compose_sequentialと同一）。
+        float32の一時バッファを作らず、各レイヤーの描画ピクセルだけを処理する。
+        
+        Args:
+            layer_colors: 各レイヤーの色のリスト（先頭から順に適用）
+            stack: 合成対象のレイヤースタック（解像度レベル）
+            out: 書き込み先の (H, W, 4) uint8 配列（省略時は新しく確保）
+            
+        Returns:
+            (H, W, 4) uint8 のRGBA配列
+        """
+        # 4チャンネル目は詰め物（1ピクセル=uint64の1要素として集める）
+        acc = np.full((stack.height * stack.width, 4), 255, dtype=np.uint16)
+        pixels = acc.view(np.uint64).reshape(-1)
+        
+        for i, rgb in enumerate(self.colors_to_rgb(layer_colors[:stack.num_layers])):
+            if not stack.valid[i]:
+                continue
+            # 描画ピクセルだけ陰影（マゼンタ領域は指定色）を乗算
+            indices, shading, positions = stack.active_pixels(i)
+            colored = shading.astype(np.uint16)
+            colored[positions, :3] = rgb
+            values = pixels[indices].view(np.uint16).reshape(-1, 4)
+            values *= colored
+            self._div255_floor_inplace(values, colored)
+            pixels[indices] = values.view(np.uint64).reshape(-1)
+        
+        if out is None:
+            out = np.empty((stack.height, stack.width, 4), dtype=np.uint8)
+        out[..., :3] = acc.reshape(stack.height, stack.width, 4)[..., :3]
+        out[..., 3] = stack.composite_alpha
+        return out
+
+    @staticmethod
+    def _div255_inplace(values: np.ndarray, scratch: np.ndarray) -> np.ndarray:
+        """uint16の積を255で割って丸める（round(x / 255) を整数演算で上書き計算）
+        
+        Args:
+            values: 0-65025 の uint16 配列（結果で上書きされる）
+            scratch: valuesと同じ形状の作業用配列
+            
+        Returns:
+            0-255 に丸められた values
+        """
+        values += 128
+        np.right_shift(values, 8, out=scratch)
+        values += scratch
+        values >>= 8
+        return values
+
+    @staticmethod
+    def _div255_floor_inplace(values: np.ndarray, scratch: np.ndarray) -> np.ndarray:
+        """uint16の積を255で割って切り捨てる（floor(x / 255) を整数演算で上書き計算）
+        
+        順次乗算の (a / 255 * (b / 255) * 255) をfloat32で計算してuint8に切り捨てた値と、
+        全てのuint8の組 (a, b) で一致する。
+        
+        Args:
+            values: 0-65025 の uint16 配列（結果で上書きされる）
+            scratch: valuesと同じ形状の作業用配列
+            
+        Returns:
+            0-255 に切り捨てられた values
+        """
+        np.right_shift(values, 8, out=scratch)
+        values += scratch
+        values += 1
+        values >>= 8
+        return values
 
     def clear_image_cache(self):
         """画像キャッシュをクリア（メモリ節約用）"""
         self._image_cache.clear()
+        self.output_pool.clear()
         print("🧹 [CACHE] 画像キャッシュをクリアしました")
 
+    @staticmethod
+    def colors_to_rgb(colors: Sequence) -> np.ndarray:
+        """色のリストをまとめてRGBに変換（hex_to_rgbの配列版）
+        
+        Args:
+            colors: 色の文字列（16進数カラーコード、rgb()形式など）またはRGBタプルのリスト
+            
+        Returns:
+            (N, 3) uint8 のRGB配列
+        """
+        rgb, valid = color_convert.hex_to_rgb_bytes(colors)
+        # 16進数カラーコードでないもの（rgb()形式・タプルなど）だけ1色ずつ解釈
+        for i in np.flatnonzero(~valid):
+            rgb[i] = np.clip(LayerColorizer._parse_color(colors[i]), 0, 255)
+        return rgb
+
     @staticmethod
     def hex_to_rgb(color_str) -> Tuple[int, int, int]:
         """16進数カラーコードをRGBに変換
@@ -464,19 +1650,20 @@ class LayerColorizer:
         Returns:
             RGB値のタプル
         """
-        if isinstance(color_str, str):
-            # 16進数カラーコードの場合
-            if color_str.startswith("#"):
-                h = color_str.lstrip("#")
-                if len(h) == 6:  # 6桁の16進数かチェック
-                    try:
-                        return tuple(int(h[i:i+2], 16) for i in (0, 2, 4))
-                    except ValueError:
-                        # configからデフォルトRGB値を取得
-                        return COLOR_SETTINGS["default_rgb_fallback"]
-                else:
-                    return COLOR_SETTINGS["default_rgb_fallback"]
+        r, g, b = LayerColorizer.colors_to_rgb([color_str])[0].tolist()
+        return (r, g, b)
+
+    @staticmethod
+    def _parse_color(color_str) -> Tuple[int, int, int]:
+        """16進数カラーコード以外の色表現をRGBに変換
+        
+        Args:
+            color_str: 色の文字列（rgb()形式など）またはRGBタプル
             
+        Returns:
+            RGB値のタプル
+        """
+        if isinstance(color_str, str):
             # rgb()形式の場合
             if color_str.startswith("rgb"):
                 try:
@@ -486,7 +1673,7 @@ class LayerColorizer:
                 except (ValueError, IndexError):
                     return COLOR_SETTINGS["default_rgb_fallback"]
             
-            # その他の文字列（色名など）の場合
+            # その他の文字列（不正なカラーコード、色名など）の場合
             return COLOR_SETTINGS["default_rgb_fallback"]
         
         # tupleの場合はそのまま返す
@@ -525,13 +1712,27 @@ class LayerColorizer:
         Returns:
             乗算合成された画像
         """
-        a_arr = np.asarray(img_a.convert("RGBA"), dtype=np.float32) / 255.0
-        b_arr = np.asarray(img_b.convert("RGBA"), dtype=np.float32) / 255.0
+        a_arr = np.asarray(img_a.convert("RGBA"))
+        b_arr = np.asarray(img_b.convert("RGBA"))
+        return Image.fromarray(LayerColorizer._multiply_arrays(a_arr, b_arr), "RGBA")
+
+    @staticmethod
+    def _multiply_arrays(a_arr: np.ndarray, b_arr: np.ndarray) -> np.ndarray:
+        """RGBA配列の乗算合成（multiply_rgbaの配列版）
+        
+        Args:
+            a_arr: (H, W, 4) uint8 配列A
+            b_arr: (H, W, 4) uint8 配列B
+            
+        Returns:
+            乗算合成された (H, W, 4) uint8 配列
+        """
+        a_arr = a_arr.astype(np.float32) / 255.0
+        b_arr = b_arr.astype(np.float32) / 255.0
         rgb = a_arr[..., :3] * b_arr[..., :3]
         alpha = np.maximum(a_arr[..., 3], b_arr[..., 3])[..., None]
         out = np.concatenate([rgb, alpha], axis=-1)
-        out = (out * 255).clip(0, 255).astype(np.uint8)
-        return Image.fromarray(out, "RGBA")
+        return (out * 255).clip(0, 255).astype(np.uint8)
 
     @staticmethod
     def timestamp_filename(prefix: str) -> str:
@@ -0,0 +1,279 @@
+"""
+MS Color Generator - ラベルマップ形式のレイヤーパッケージ（自己完結型バンドル）
+
+レイヤーごとのRGB PNG・grouping.txtの代わりに、1ファイルでモデル全体を表す形式。
+
+- ラベルマップ: ピクセルごとにどのレイヤーのマゼンタ領域かを表すビットセット
+- 共有陰影: 全レイヤー共通の陰影とアルファ（1枚）
+- 差分: 共有陰影と異なるピクセルだけをレイヤーごとに記録
+- マゼンタ領域の外接矩形、既定のグループ割り当てと色（grouping.txtの内容）、メタデータ
+- 内容ハッシュ: 上記すべてのSHA-256（下流のキャッシュの鍵に使う）
+
+復元結果はレイヤーPNGから構築したLayerStackと完全に一致する。
+
+使い方（レイヤーフォルダからの変換）:
+    python layer_package.py [レイヤーフォルダ] [-o 出力ファイル] [-g グループ設定ファイル]
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+from config import LAYER_DIR, CONFIG_FILE, TARGET_COLOR, IMAGE_SETTINGS
+from layer_stack import LayerStack, PackedMasks, LayerShading
+
+PACKAGE_VERSION = 2
+# 旧バージョン（グループ設定・外接矩形・内容ハッシュなし）も読み込める
+_READABLE_VERSIONS = (1, 2)
+# 内容ハッシュの対象（この順に連結してハッシュする）
+_HASHED_ARRAYS = ("names", "valid", "labels", "shading", "alpha",
+                  "diff_layers", "diff_indices", "diff_values", "bboxes", "grouping")
+
+
+def package_path(directory: str) -> str:
+    """レイヤーフォルダ内のパッケージファイルのパス
+
+    Args:
+        directory: レイヤーフォルダ
+
+    Returns:
+        パッケージファイルのパス
+    """
+    return os.path.join(directory, IMAGE_SETTINGS["layer_package_file"])
+
+
+def find_layer_package(directory: str) -> Optional[str]:
+    """レイヤーフォルダ内のパッケージファイルを取得
+
+    Args:
+        directory: レイヤーフォルダ
+
+    Returns:
+        パッケージファイルのパス（ない場合はNone）
+    """
+    path = package_path(directory)
+    return path if os.path.isfile(path) else None
+
+
+def package_info(path: str) -> Dict:
+    """パッケージのレイヤー名・グループ設定・内容ハッシュなどを取得（画素配列は読み込まない）
+
+    Args:
+        path: パッケージファイルのパス
+
+    Returns:
+        names（レイヤーファイル名のリスト）, content_hash（旧バージョンはNone）,
+        grouping（grouping.txtの内容、ない場合はNone）, bboxes（(L, 4) の外接矩形、旧バージョンはNone）,
+        metadata の辞書
+    """
+    with np.load(path) as package:
+        version = int(package["version"])
+        if version not in _READABLE_VERSIONS:
+            raise ValueError(f"未対応のパッケージバージョン: {version}")
+        if version < 2:
+            return {"names": package["names"].tolist(), "content_hash": None,
+                    "grouping": None, "bboxes": None, "metadata": {}}
+        grouping = str(package["grouping"])
+        return {
+            "names": package["names"].tolist(),
+            "content_hash": str(package["content_hash"]),
+            "grouping": grouping or None,
+            "bboxes": package["bboxes"],
+            "metadata": json.loads(str(package["metadata"])),
+        }
+
+
+def _content_hash(arrays: Dict[str, np.ndarray]) -> str:
+    """パッケージ内容のSHA-256（配列の形状・型・値とグループ設定が対象）"""
+    digest = hashlib.sha256()
+    for name in _HASHED_ARRAYS:
+        array = np.ascontiguousarray(arrays[name])
+        digest.update(f"{name}:{array.dtype.str}:{array.shape};".encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+def write_package(stack: LayerStack, path: str, grouping: Optional[str] = None) -> str:
+    """レイヤースタックとグループ設定をパッケージファイルに保存
+
+    Args:
+        stack: 保存するレイヤースタック（フル解像度）
+        path: 出力ファイルのパス
+        grouping: 既定のグループ設定（grouping.txtの内容、省略時はなし）
+
+    Returns:
+        内容ハッシュ
+    """
+    valid = np.flatnonzero(stack.valid)
+
+    # 共有陰影: 各ピクセルでマゼンタでない最初の有効レイヤーの陰影
+    shading = np.full((stack.height, stack.width, 3), 255, dtype=np.uint8)
+    for i in valid[::-1]:
+        uncovered = ~stack.masks[i]
+        shading[uncovered] = stack.shading[i][uncovered]
+    alpha = stack.alphas[valid[0]].copy() if valid.size else np.zeros((stack.height, stack.width), dtype=np.uint8)
+
+    # 共有陰影と異なるピクセル（マゼンタ領域は白として比較）をレイヤーごとに記録
+    diff_layers, diff_indices, diff_values = [], [], []
+    for i in valid:
+        expected = np.where(stack.masks[i][..., None], np.uint8(255), shading)
+        differs = (stack.shading[i] != expected).any(axis=-1) | (stack.alphas[i] != alpha)
+        indices = np.flatnonzero(differs)
+        values = np.empty((indices.size, 4), dtype=np.uint8)
+        values[:, :3] = stack.shading[i].reshape(-1, 3)[indices]
+        values[:, 3] = stack.alphas[i].reshape(-1)[indices]
+        diff_layers.append(np.full(indices.size, i, dtype=np.uint16))
+        diff_indices.append(indices.astype(np.uint32))
+        diff_values.append(values)
+
+    # ラベルマップ: ビット i がレイヤー i のマゼンタ領域（8レイヤーごとに1バイト）
+    labels = np.packbits(np.moveaxis(np.asarray(stack.masks), 0, -1), axis=-1, bitorder="little")
+
+    arrays = {
+        "names": np.array([os.path.basename(f) for f in stack.files]),
+        "valid": stack.valid,
+        "labels": labels,
+        "shading": shading,
+        "alpha": alpha,
+        "diff_layers": np.concatenate(diff_layers) if diff_layers else np.zeros(0, dtype=np.uint16),
+        "diff_indices": np.concatenate(diff_indices) if diff_indices else np.zeros(0, dtype=np.uint32),
+        "diff_values": np.concatenate(diff_values) if diff_values else np.zeros((0, 4), dtype=np.uint8),
+        "bboxes": stack.mask_bboxes,
+        "grouping": np.array(grouping or ""),
+    }
+    content_hash = _content_hash(arrays)
+    metadata = {
+        "width": stack.width,
+        "height": stack.height,
+        "layers": stack.num_layers,
+        "target_color": list(TARGET_COLOR),
+        "created": datetime.now().isoformat(timespec="seconds"),
+    }
+    np.savez_compressed(
+        path,
+        version=np.array(PACKAGE_VERSION),
+        content_hash=np.array(content_hash),
+        metadata=np.array(json.dumps(metadata)),
+        **arrays,
+    )
+    return content_hash
+
+
+def read_package(path: str) -> LayerStack:
+    """パッケージファイルからレイヤースタックを復元（ファイルは1回だけ読み込む）
+
+    Args:
+        path: パッケージファイルのパス
+
+    Returns:
+        復元したLayerStack（filesはパッケージと同じフォルダのレイヤーファイル名）
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+
+    with np.load(io.BytesIO(data)) as package:
+        if int(package["version"]) not in _READABLE_VERSIONS:
+            raise ValueError(f"未対応のパッケージバージョン: {int(package['version'])}")
+        names = package["names"].tolist()
+        valid = package["valid"]
+        labels = package["labels"]
+        shading = package["shading"]
+        alpha = package["alpha"]
+        diff_layers = package["diff_layers"]
+        diff_indices = package["diff_indices"]
+        diff_values = package["diff_values"]
+
+    num_layers = len(names)
+    height, width = alpha.shape
+    masks = PackedMasks.zeros(num_layers, height, width)
+    layer_shading = LayerShading.blank(num_layers, height, width)
+    alphas = np.zeros((num_layers, height, width), dtype=np.uint8)
+
+    # 差分はレイヤー順に並んでいる
+    bounds = np.searchsorted(diff_layers, np.arange(num_layers + 1))
+    for i in np.flatnonzero(valid):
+        mask = (labels[..., i // 8] >> (i % 8)) & 1 != 0
+        masks[i] = mask
+        layer = shading.copy()
+        layer[mask] = 255
+        alphas[i] = alpha
+        start, stop = bounds[i], bounds[i + 1]
+        indices = diff_indices[start:stop]
+        layer.reshape(-1, 3)[indices] = diff_values[start:stop, :3]
+        alphas[i].reshape(-1)[indices] = diff_values[start:stop, 3]
+        layer_shading[i] = layer
+
+    directory = os.path.dirname(path)
+    files = [os.path.join(directory, name) for name in names]
+    print(f"📦 [PACKAGE] レイヤーパッケージを読み込み: {int(valid.sum())}/{num_layers}レイヤー, "
+          f"{width}x{height}, 差分{diff_indices.size}ピクセル ({path})")
+    return LayerStack(files, masks, layer_shading, alphas, valid)
+
+
+def default_grouping_file(directory: str) -> str:
+    """レイヤーフォルダに対応するグループ設定ファイル（LayerSetRegistryと同じ規則）
+
+    Args:
+        directory: レイヤーフォルダ
+
+    Returns:
+        既定のフォルダならルートのgrouping.txt、それ以外はフォルダ内のgrouping.txt
+    """
+    if os.path.normpath(directory) == os.path.normpath(LAYER_DIR):
+        return CONFIG_FILE
+    return os.path.join(directory, CONFIG_FILE)
+
+
+def convert_folder(directory: str, output: Optional[str] = None,
+                   grouping_file: Optional[str] = None) -> str:
+    """layerN.png のフォルダとグループ設定をパッケージファイルに変換
+
+    Args:
+        directory: レイヤーフォルダ
+        output: 出力ファイルのパス（省略時はフォルダ内の IMAGE_SETTINGS["layer_package_file"]）
+        grouping_file: 同梱するグループ設定ファイル（省略時はフォルダに対応するgrouping.txt）
+
+    Returns:
+        出力ファイルのパス
+    """
+    # 循環インポートを避けるためここで読み込む
+    from layer_sets import find_layer_files
+
+    files = find_layer_files(directory)
+    if not files:
+        raise FileNotFoundError(f"レイヤーファイルが見つかりません: {directory}")
+
+    images = [Image.open(fname).convert(IMAGE_SETTINGS["default_image_mode"]) for fname in files]
+    stack = LayerStack.from_images(files, images, [True] * len(images))
+    grouping_file = grouping_file or default_grouping_file(directory)
+    grouping = None
+    if os.path.isfile(grouping_file):
+        with open(grouping_file, encoding=IMAGE_SETTINGS["file_encoding"]) as f:
+            grouping = f.read()
+    else:
+        print(f"⚠️ [PACKAGE] {grouping_file} が見つかりません。グループ設定なしで変換します")
+
+    output = output or package_path(directory)
+    content_hash = write_package(stack, output, grouping)
+
+    source_bytes = sum(os.path.getsize(fname) for fname in files)
+    package_bytes = os.path.getsize(output)
+    print(f"✅ [PACKAGE] {len(files)}レイヤーを変換: {source_bytes / 1024 / 1024:.2f} MB → "
+          f"{package_bytes / 1024 / 1024:.2f} MB ({output}, 内容ハッシュ {content_hash[:16]})")
+    return output
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="layerN.png のフォルダをラベルマップ形式のパッケージに変換")
+    parser.add_argument("directory", nargs="?", default=LAYER_DIR, help="レイヤーフォルダ")
+    parser.add_argument("-o", "--output", help="出力ファイルのパス")
+    parser.add_argument("-g", "--grouping", help="同梱するグループ設定ファイル")
+    args = parser.parse_args()
+    convert_folder(args.directory, args.output, args.grouping)
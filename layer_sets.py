@@ -0,0 +1,285 @@
+"""
+MS Color Generator - レイヤーセット管理（複数のMSレイヤーセットの切り替え）
+"""
+
+import os
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from PIL import Image
+
+from config import (
+    MAX_LAYERS, LAYER_DIR, STACK_CACHE_DIR,
+    IMAGE_SETTINGS, COMPOSITE_SETTINGS, LAYER_SET_SETTINGS
+)
+from layer_stack import LayerStack
+from layer_package import find_layer_package, package_info, read_package, default_grouping_file
+
+
+def find_layer_files(directory: str) -> List[str]:
+    """フォルダ内のlayerXファイルを番号順に取得
+
+    Args:
+        directory: レイヤーフォルダ
+
+    Returns:
+        レイヤーファイルパスのリスト
+    """
+    layer_pattern = re.compile(
+        IMAGE_SETTINGS["layer_file_pattern"],
+        IMAGE_SETTINGS["layer_file_flags"]
+    )
+    layer_files = {}
+
+    if os.path.isdir(directory):
+        for fname in os.listdir(directory):
+            m = layer_pattern.fullmatch(fname)
+            if m:
+                idx = int(m.group(1))
+                if 1 <= idx <= MAX_LAYERS:
+                    layer_files[idx] = os.path.join(directory, fname)
+
+    return [layer_files[i] for i in sorted(layer_files)]
+
+
+def count_layers(directory: str) -> int:
+    """フォルダのレイヤー数（パッケージがあればパッケージのレイヤー数）
+
+    Args:
+        directory: レイヤーフォルダ
+
+    Returns:
+        レイヤー数
+    """
+    package = find_layer_package(directory)
+    if package is not None:
+        try:
+            return len(package_info(package)["names"])
+        except Exception as e:
+            print(f"⚠️ [LAYER SET] レイヤーパッケージを読み込めません {package}: {e}")
+    return len(find_layer_files(directory))
+
+
+class LayerSet:
+    """コンパイル済みのレイヤーセット"""
+
+    def __init__(self, name: str, directory: str, files: List[str], stack: LayerStack,
+                 grouping_file: str, package: Optional[str] = None, package_info: Optional[dict] = None):
+        """初期化
+
+        Args:
+            name: セット名（フォルダ名）
+            directory: レイヤーフォルダ
+            files: レイヤーファイルパスのリスト
+            stack: コンパイル済みレイヤースタック
+            grouping_file: グループ設定ファイルのパス
+            package: 読み込んだレイヤーパッケージのパス（layerXファイルから読み込んだ場合はNone）
+            package_info: パッケージのグループ設定・内容ハッシュなど（layer_package.package_info）
+        """
+        self.name = name
+        self.directory = directory
+        self.files = files
+        self.stack = stack
+        self.grouping_file = grouping_file
+        self.package = package
+        info = package_info or {}
+        # バンドルに同梱された既定のグループ設定（grouping.txtの内容）と外接矩形
+        self.grouping: Optional[str] = info.get("grouping")
+        self.bboxes = info.get("bboxes")
+        self.content_hash: Optional[str] = info.get("content_hash")
+        if self.bboxes is not None:
+            # 外接矩形は読み込み時に計算し直さず、タイル合成でマスクを展開するタイルの選別に使う
+            stack.mask_bboxes = self.bboxes
+        # 解像度レベルごとの閉形式合成エンジン・画素クラス合成エンジン（LayerColorizerが遅延構築）
+        self.compositors: Dict[int, object] = {}
+        self.signature_compositors: Dict[int, object] = {}
+        # 他のセットに切り替える直前のグループ割り当てと色
+        self.saved_state: Optional[dict] = None
+
+    @property
+    def cache_key(self) -> str:
+        """下流のキャッシュ（合成結果・スプライト・レイヤー画像）の鍵
+
+        内容ハッシュのあるバンドルは内容で識別するため、同じバンドルを置いた
+        別フォルダのセットとキャッシュを共有し、内容が変われば別の鍵になる。
+        """
+        return self.content_hash or f"set:{self.name}"
+
+    @property
+    def nbytes(self) -> int:
+        """スタック（縮小レベルを含む）の保持バイト数合計"""
+        return sum(level.nbytes for level in self.stack.levels.values())
+
+
+class LayerSetRegistry:
+    """レイヤーセットの一覧と、コンパイル済みセットの常駐管理
+
+    LAYER_DIRと同じ階層にあるlayerXファイル（またはレイヤーパッケージ）を含むフォルダを
+    別のセットとして見つける。
+    最近使ったセットをメモリ上限まで常駐させ、切り替え時の再コンパイルを省く。
+    """
+
+    def __init__(self, load_image: Callable[[str], Optional[Image.Image]], budget_bytes: int):
+        """初期化
+
+        Args:
+            load_image: ファイルパスからレイヤー画像をデコードする関数（失敗時はNone）
+            budget_bytes: 常駐させるセットの合計バイト数の上限
+        """
+        self.load_image = load_image
+        self.budget_bytes = budget_bytes
+        self.default_name = os.path.basename(os.path.normpath(LAYER_DIR))
+
+        # layerフォルダが存在しない場合は作成
+        os.makedirs(LAYER_DIR, exist_ok=True)
+
+        self.directories = self.discover()
+        self.layer_counts = {name: count_layers(path) for name, path in self.directories.items()}
+        self._resident: 'OrderedDict[str, LayerSet]' = OrderedDict()
+
+        # レイヤーPNGのデコード用スレッドプール（PILのデコーダはGILを解放する）
+        self.executor = ThreadPoolExecutor(
+            max_workers=max(1, LAYER_SET_SETTINGS["decode_workers"]), thread_name_prefix="layer-decode"
+        )
+
+    def discover(self) -> Dict[str, str]:
+        """レイヤーセットのフォルダを探す
+
+        Returns:
+            セット名 → フォルダの辞書（既定のセットが先頭）
+        """
+        directories = {self.default_name: LAYER_DIR}
+        if LAYER_SET_SETTINGS["discover_siblings"]:
+            parent = os.path.dirname(os.path.normpath(LAYER_DIR)) or "."
+            for name in sorted(os.listdir(parent)):
+                path = os.path.join(parent, name)
+                if name not in directories and os.path.isdir(path) \
+                        and (find_layer_package(path) or find_layer_files(path)):
+                    directories[name] = path
+        if len(directories) > 1:
+            print(f"🗂️ [LAYER SET] {len(directories)}個のレイヤーセットを検出: {', '.join(directories)}")
+        return directories
+
+    @property
+    def names(self) -> List[str]:
+        """セット名のリスト"""
+        return list(self.directories)
+
+    @property
+    def max_layer_count(self) -> int:
+        """全セットの中で最大のレイヤー数"""
+        return max(self.layer_counts.values(), default=0)
+
+    @property
+    def resident_names(self) -> List[str]:
+        """常駐しているセット名（古い順）"""
+        return list(self._resident)
+
+    def get(self, name: str) -> LayerSet:
+        """コンパイル済みのセットを取得（未常駐ならコンパイル）
+
+        Args:
+            name: セット名
+
+        Returns:
+            LayerSet
+        """
+        if name in self._resident:
+            self._resident.move_to_end(name)
+            return self._resident[name]
+
+        layer_set = self._compile(name)
+        self._resident[name] = layer_set
+        self._evict(keep=name)
+        return layer_set
+
+    def _compile(self, name: str) -> LayerSet:
+        """セットのレイヤーを読み込んでスタックを構築
+
+        Args:
+            name: セット名
+
+        Returns:
+            LayerSet
+        """
+        directory = self.directories[name]
+        cache_dir = os.path.join(STACK_CACHE_DIR, name)
+        # 既定のセットはルートのgrouping.txt、他のセットはフォルダ内のgrouping.txtを使う
+        # （グループ設定を同梱したバンドルはバンドルの設定を使う）
+        grouping_file = default_grouping_file(directory)
+
+        package = find_layer_package(directory)
+        if package is not None:
+            try:
+                info = package_info(package)
+                if info["content_hash"]:
+                    # 内容ハッシュで識別するため、同じバンドルはフォルダが違ってもキャッシュを共有する
+                    cache_dir = os.path.join(STACK_CACHE_DIR, f"bundle_{info['content_hash'][:16]}")
+                if info["grouping"] is not None:
+                    grouping_file = package
+                stack = self._compile_package(package, info["names"], cache_dir, info["content_hash"])
+                self.layer_counts[name] = stack.num_layers
+                return LayerSet(name, directory, stack.files, stack, grouping_file, package, info)
+            except Exception as e:
+                print(f"❌ [LAYER SET] レイヤーパッケージ読み込みエラー、layerXファイルを使用: {e}")
+
+        files = find_layer_files(directory)
+        self.layer_counts[name] = len(files)
+
+        def load(index: int) -> Optional[Image.Image]:
+            return self.load_image(files[index])
+
+        # デコードはスレッドプールで並列に行い、完了を待たずに返す（配列を使う処理が未完了のレイヤーだけ待つ）
+        # 読み込めなかったレイヤーは無効として扱われ、画像は参照されない
+        if COMPOSITE_SETTINGS["use_disk_cache"]:
+            # ディスクキャッシュが有効なら、変更のあったレイヤーだけをデコードする
+            stack = LayerStack.from_files_cached(
+                files, cache_dir, load, COMPOSITE_SETTINGS["pyramid_factors"], self.executor
+            )
+        else:
+            factors = COMPOSITE_SETTINGS["pyramid_factors"]
+            stack = LayerStack.from_files(files, load, self.executor,
+                                          finish=lambda built: built.build_pyramid(factors))
+        if not LAYER_SET_SETTINGS["background_decode"]:
+            stack.wait_finished()
+
+        return LayerSet(name, directory, files, stack, grouping_file)
+
+    @staticmethod
+    def _compile_package(package: str, names: List[str], cache_dir: str,
+                         content_hash: Optional[str] = None) -> LayerStack:
+        """レイヤーパッケージからスタックを構築（ディスクキャッシュが有効ならマップ）
+
+        Args:
+            package: パッケージファイルのパス
+            names: パッケージのレイヤーファイル名のリスト
+            cache_dir: キャッシュフォルダ
+            content_hash: パッケージの内容ハッシュ（旧バージョンはNone）
+
+        Returns:
+            構築されたLayerStack
+        """
+        if not COMPOSITE_SETTINGS["use_disk_cache"]:
+            stack = read_package(package)
+            stack.build_pyramid(COMPOSITE_SETTINGS["pyramid_factors"])
+            return stack
+
+        directory = os.path.dirname(package)
+        files = [os.path.join(directory, name) for name in names]
+        return LayerStack.from_source_cached(
+            files, package, cache_dir, lambda: read_package(package),
+            COMPOSITE_SETTINGS["pyramid_factors"], content_hash
+        )
+
+    def _evict(self, keep: str):
+        """メモリ上限を超えた分のセットを古い順に破棄
+
+        Args:
+            keep: 破棄しないセット名（直前に使用したセット）
+        """
+        while len(self._resident) > 1 and sum(s.nbytes for s in self._resident.values()) > self.budget_bytes:
+            oldest = next(name for name in self._resident if name != keep)
+            del self._resident[oldest]
+            print(f"🧹 [LAYER SET] 常駐セットを破棄: {oldest}")
@@ -0,0 +1,1012 @@
+"""
+MS Color Generator - コンパイル済みレイヤースタック
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import Executor, Future
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+from config import TARGET_COLOR, IMAGE_SETTINGS
+from startup_timing import startup_timer
+
+# ディスクキャッシュの形式（配列の構成を変えたら上げる）
+_CACHE_VERSION = 3
+_CACHE_ARRAYS = ("mask_bits", "shading_gray", "shading_color", "color_layers", "alphas", "valid")
+_MANIFEST_FILE = "manifest.json"
+
+
+def _file_signature(path: str) -> Optional[List[int]]:
+    """キャッシュの鍵にするファイルの [更新時刻(ns), サイズ]（存在しなければNone）"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _peek_size(files: List[str], indices: Sequence[int]) -> Optional[Tuple[int, int]]:
+    """最初に開けるレイヤーファイルのサイズをヘッダーだけ読んで取得
+
+    Args:
+        files: レイヤーファイルパスのリスト
+        indices: 調べるレイヤーインデックス（この順に試す）
+
+    Returns:
+        (width, height)（どれも開けない場合はNone）
+    """
+    for i in indices:
+        try:
+            with Image.open(files[i]) as img:
+                return img.size
+        except Exception:
+            continue
+    return None
+
+
+def _submit(executor: Optional[Executor], fn: Callable, *args) -> Future:
+    """スレッドプールに処理を投入（executorがNoneなら即時実行して完了済みのFutureを返す）"""
+    if executor is not None:
+        return executor.submit(fn, *args)
+    future: Future = Future()
+    future.set_result(fn(*args))
+    return future
+
+
+def _block_sum(values: np.ndarray, factor: int, height: int, width: int) -> np.ndarray:
+    """factor x factor ブロックごとの合計（ずらしたスライスの加算で求める）
+
+    reshapeしてからの多軸sumより、ストライドしたスライスの加算の方が大幅に速い。
+
+    Args:
+        values: (H, W, ...) の配列
+        factor: ブロックの一辺
+        height: 出力の高さ
+        width: 出力の幅
+
+    Returns:
+        (height, width, ...) uint32 のブロック合計
+    """
+    total = np.zeros((height, width) + values.shape[2:], dtype=np.uint32)
+    for dy in range(factor):
+        for dx in range(factor):
+            total += values[dy:height * factor:factor, dx:width * factor:factor]
+    return total
+
+
+def _split_layer_key(key) -> Tuple[object, tuple]:
+    """インデックスをレイヤー軸とそれ以降（画素の軸）に分ける"""
+    if not isinstance(key, tuple):
+        key = (key,)
+    return key[0], key[1:]
+
+
+class PackedMasks:
+    """(L, H, W) のマゼンタ領域マスクを1ピクセル1ビットで保持する
+
+    行ごとに横方向にビットを詰めて (L, H, ceil(W/8)) uint8 で持ち、
+    インデックス参照時に必要な範囲だけを bool 配列に展開する。
+    stack.masks[i] / stack.masks[i, rows, cols] / stack.masks[indices] のように
+    bool 配列と同じ書き方で参照できる。
+    """
+
+    def __init__(self, bits: np.ndarray, width: int):
+        """初期化
+
+        Args:
+            bits: np.packbits(..., axis=-1, bitorder="little") で詰めた (L, H, ceil(W/8)) uint8
+            width: 展開後の幅
+        """
+        self.bits = bits
+        self.width = width
+
+    @classmethod
+    def zeros(cls, num_layers: int, height: int, width: int) -> 'PackedMasks':
+        """全ピクセルが非被覆のマスクを作成"""
+        return cls(np.zeros((num_layers, height, (width + 7) // 8), dtype=np.uint8), width)
+
+    @classmethod
+    def from_bool(cls, masks: np.ndarray) -> 'PackedMasks':
+        """(L, H, W) bool 配列から作成"""
+        masks = np.asarray(masks, dtype=bool)
+        return cls(np.packbits(masks, axis=-1, bitorder="little"), masks.shape[-1])
+
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        return self.bits.shape[:2] + (self.width,)
+
+    @property
+    def nbytes(self) -> int:
+        return self.bits.nbytes
+
+    def __len__(self) -> int:
+        return len(self.bits)
+
+    def __getitem__(self, key) -> np.ndarray:
+        layers, pixels = _split_layer_key(key)
+        if len(pixels) > 2:
+            raise IndexError(f"マスクのインデックスが多すぎます: {key}")
+        rows = pixels[0] if pixels else slice(None)
+        cols = pixels[1] if len(pixels) > 1 else slice(None)
+        if isinstance(cols, slice) and cols.step in (None, 1):
+            # 列の範囲を含むバイトだけを展開する（タイル合成で使う）
+            start, stop, _ = cols.indices(self.width)
+            stop = max(start, stop)
+            first, last = start // 8, (stop + 7) // 8
+            unpacked = np.unpackbits(self._select_bits(layers, rows, slice(first, last)), axis=-1, bitorder="little")
+            return unpacked[..., start - first * 8:stop - first * 8].view(bool)
+        bits = self._select_bits(layers, rows, slice(None))
+        unpacked = np.unpackbits(bits, axis=-1, count=self.width, bitorder="little").view(bool)
+        return unpacked[..., cols]
+
+    def _select_bits(self, layers, rows, byte_cols: slice) -> np.ndarray:
+        """レイヤー・行・列のバイト範囲のビットを、選んだ範囲だけをコピーして取得
+
+        レイヤーをリストで選んでから行を切り出すと、各レイヤーのフレーム全体がコピーされる。
+        1回のインデックスで選ぶか、行を先に切り出してからレイヤーを選ぶ。
+        """
+        if isinstance(rows, (slice, int, np.integer)):
+            return self.bits[layers, rows, byte_cols]
+        # 行も配列で指定された場合（1回で指定するとレイヤーと行が対応付けになる）
+        return self.bits[:, rows, byte_cols][layers]
+
+    def __setitem__(self, index, mask: np.ndarray):
+        self.bits[index] = np.packbits(np.asarray(mask, dtype=bool), axis=-1, bitorder="little")
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        masks = self[:]
+        return masks if dtype is None else masks.astype(dtype)
+
+
+class LayerShading:
+    """(L, H, W, 3) の陰影を、グレースケールのレイヤーは1チャンネルで保持する
+
+    マゼンタ以外のピクセルが R=G=B のレイヤーは (H, W) uint8 の1チャンネルだけを持ち、
+    参照時は3チャンネルにブロードキャストした読み取り専用のビューを返す（コピーしない）。
+    色付きのレイヤーだけ (H, W, 3) を別に持つ。
+    """
+
+    def __init__(self, gray: np.ndarray, color: Optional[Dict[int, np.ndarray]] = None):
+        """初期化
+
+        Args:
+            gray: 各レイヤーの1チャンネル陰影 (L, H, W) uint8（色付きのレイヤーの行は使わない）
+            color: 色付きのレイヤーのインデックス → (H, W, 3) uint8 陰影
+        """
+        self.gray = gray
+        self.color: Dict[int, np.ndarray] = dict(color or {})
+
+    @classmethod
+    def blank(cls, num_layers: int, height: int, width: int) -> 'LayerShading':
+        """全ピクセルが白（乗算で影響しない）の陰影を作成"""
+        return cls(np.full((num_layers, height, width), 255, dtype=np.uint8))
+
+    @classmethod
+    def from_rgb(cls, shading: np.ndarray) -> 'LayerShading':
+        """(L, H, W, 3) uint8 配列から作成"""
+        shading = np.asarray(shading)
+        store = cls.blank(*shading.shape[:3])
+        for i in range(len(shading)):
+            store[i] = shading[i]
+        return store
+
+    @classmethod
+    def from_arrays(cls, gray: np.ndarray, color: np.ndarray, color_layers: np.ndarray) -> 'LayerShading':
+        """ディスクキャッシュの配列から作成（color は color_layers の順に並んだ (C, H, W, 3)）"""
+        return cls(gray, {int(i): color[row] for row, i in enumerate(color_layers)})
+
+    @property
+    def shape(self) -> Tuple[int, int, int, int]:
+        return self.gray.shape + (3,)
+
+    @property
+    def nbytes(self) -> int:
+        return self.gray.nbytes + sum(layer.nbytes for layer in self.color.values())
+
+    @property
+    def gray_layers(self) -> int:
+        """1チャンネルで保持しているレイヤー数"""
+        return len(self.gray) - len(self.color)
+
+    def color_arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """色付きのレイヤーの (C, H, W, 3) 陰影とレイヤーインデックス (C,)"""
+        layers = sorted(self.color)
+        if not layers:
+            return np.zeros((0,) + self.shape[1:], dtype=np.uint8), np.zeros(0, dtype=np.int32)
+        return np.stack([self.color[i] for i in layers]), np.array(layers, dtype=np.int32)
+
+    def __len__(self) -> int:
+        return len(self.gray)
+
+    def __getitem__(self, key) -> np.ndarray:
+        layers, pixels = _split_layer_key(key)
+        if isinstance(layers, (int, np.integer)):
+            index = int(layers) % len(self.gray)
+            layer = self.color.get(index)
+            if layer is None:
+                layer = np.broadcast_to(self.gray[index][..., None], self.shape[1:])
+            return layer[pixels]
+        # 画素の範囲を各レイヤーで切り出してから積む（フレーム全体を積んでから切り出さない）
+        indices = np.arange(len(self.gray))[layers]
+        return np.stack([self[(int(i),) + pixels] for i in indices])
+
+    def channels(self, key) -> np.ndarray:
+        """1レイヤーの陰影を保持している形のまま取得（ブロードキャストで乗算する用）
+
+        Args:
+            key: レイヤーインデックス（続けて行・列のスライスも指定できる）
+
+        Returns:
+            グレースケールのレイヤーは (..., 1)、色付きのレイヤーは (..., 3) の uint8 配列
+        """
+        layers, pixels = _split_layer_key(key)
+        index = int(layers) % len(self.gray)
+        layer = self.color.get(index)
+        if layer is None:
+            return self.gray[index][pixels][..., None]
+        return layer[pixels]
+
+    def __setitem__(self, index: int, shading: np.ndarray):
+        shading = np.asarray(shading)
+        if (shading[..., 0] == shading[..., 1]).all() and (shading[..., 1] == shading[..., 2]).all():
+            self.gray[index] = shading[..., 0]
+            self.color.pop(index, None)
+        else:
+            self.color[index] = np.array(shading, dtype=np.uint8)
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        shading = self[:]
+        return shading if dtype is None else shading.astype(dtype)
+
+
+def _array_path(cache_dir: str, name: str, factor: int = 1) -> str:
+    """キャッシュ配列のファイルパス（縮小レベルは名前に縮小率を付ける）"""
+    if factor == 1:
+        return os.path.join(cache_dir, f"{name}.npy")
+    return os.path.join(cache_dir, f"{name}_{factor}.npy")
+
+
+def _compile_settings() -> dict:
+    """コンパイル済みの配列を左右する設定（マニフェストに記録し、変わったらキャッシュを使わない）"""
+    return {
+        "target_color": [int(c) for c in TARGET_COLOR],
+        "image_mode": IMAGE_SETTINGS["default_image_mode"],
+    }
+
+
+def _read_manifest(cache_dir: str) -> Optional[dict]:
+    """キャッシュのマニフェストを読み込み（無効・未作成・設定が異なる場合はNone）"""
+    try:
+        with open(os.path.join(cache_dir, _MANIFEST_FILE), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != _CACHE_VERSION:
+        return None
+    if manifest.get("compile_settings") != _compile_settings():
+        # マゼンタ判定の設定が変わるとマスクが変わるため、全レイヤーを作り直す
+        print(f"⚠️ [STACK] マゼンタ判定の設定が変わったため、ディスクキャッシュを使いません ({cache_dir})")
+        return None
+    return manifest
+
+
+class LayerStack:
+    """レイヤー画像をNumPy配列にまとめたスタック（起動時に1回だけ構築）
+
+    合成のホットパスではPILやファイルシステムに触れず、
+    ここに保持した連続配列だけを参照する。
+    """
+
+    def __init__(self, files: List[str], masks, shading, alphas: np.ndarray, valid: np.ndarray):
+        """初期化
+
+        マスクは1ピクセル1ビット、陰影はグレースケールのレイヤーなら1チャンネルで保持する。
+
+        Args:
+            files: レイヤーファイルパスのリスト
+            masks: マゼンタ領域マスク (L, H, W) bool（またはPackedMasks）
+            shading: マゼンタ以外の陰影 (L, H, W, 3) uint8（マゼンタ領域は白、またはLayerShading）
+            alphas: 各レイヤーのアルファ (L, H, W) uint8
+            valid: 合成に使えるレイヤーかどうか (L,) bool
+        """
+        self.files = files
+        self.masks = masks if isinstance(masks, PackedMasks) else PackedMasks.from_bool(masks)
+        self.shading = shading if isinstance(shading, LayerShading) else LayerShading.from_rgb(shading)
+        self.alphas = np.ascontiguousarray(alphas, dtype=np.uint8)
+        self.valid = np.asarray(valid, dtype=bool)
+        self.num_layers, self.height, self.width = self.masks.shape
+        self._mask_indices: List[Optional[np.ndarray]] = [None] * self.num_layers
+        self._active_pixels: List[Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]] = [None] * self.num_layers
+        # タイル合成用（(レイヤー, 行範囲, 列範囲) / (行範囲, 列範囲) → 計算結果）
+        self._tile_active_pixels: Dict[Tuple[int, ...], Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+        self._tile_shading_products: Dict[Tuple[int, ...], np.ndarray] = {}
+        self._composite_alpha: Optional[np.ndarray] = None
+        self._layer_bits: Optional[np.ndarray] = None
+        self._mask_bboxes: Optional[np.ndarray] = None
+        self.levels: Dict[int, 'LayerStack'] = {1: self}
+        # デコード中のレイヤー（from_filesでスレッドプールから書き込まれる）
+        self._pending: Dict[int, Future] = {}
+        self._finished: Optional[Future] = None
+        # 縮小レベルの構築完了（バックグラウンドで構築する間だけ未完了になる）
+        self._pyramid_built = threading.Event()
+        self._pyramid_built.set()
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        """キャンバスサイズ (width, height)"""
+        return (self.width, self.height)
+
+    @property
+    def nbytes(self) -> int:
+        """マスク・陰影・アルファの保持バイト数"""
+        return self.masks.nbytes + self.shading.nbytes + self.alphas.nbytes
+
+    @property
+    def dense_nbytes(self) -> int:
+        """マスク (bool) と陰影 (RGB) を展開して持った場合のバイト数"""
+        return self.num_layers * self.height * self.width * (1 + 3) + self.alphas.nbytes
+
+    @classmethod
+    def from_images(cls, files: List[str], images: Sequence[Image.Image],
+                    valid: Sequence[bool]) -> 'LayerStack':
+        """読み込み済みのレイヤー画像からスタックを構築
+
+        Args:
+            files: レイヤーファイルパスのリスト
+            images: レイヤー画像のリスト（filesと同じ順序）
+            valid: 各画像が正常に読み込めたかどうか
+
+        Returns:
+            構築されたLayerStack
+        """
+        # キャンバスサイズは最初の有効レイヤーに合わせる
+        canvas_size = next(
+            (img.size for img, ok in zip(images, valid) if ok),
+            IMAGE_SETTINGS["dummy_image_size"]
+        )
+        width, height = canvas_size
+        num_layers = len(images)
+
+        masks = PackedMasks.zeros(num_layers, height, width)
+        shading = LayerShading.blank(num_layers, height, width)
+        alphas = np.zeros((num_layers, height, width), dtype=np.uint8)
+        valid_flags = np.zeros(num_layers, dtype=bool)
+
+        for i, (img, ok) in enumerate(zip(images, valid)):
+            if not ok:
+                continue
+            if img.size != canvas_size:
+                print(f"⚠️ [STACK] レイヤー{i+1}のサイズ{img.size}がキャンバス{canvas_size}と異なるため除外します")
+                continue
+
+            masks[i], shading[i], alphas[i] = cls._compile_layer(img)
+            valid_flags[i] = True
+
+        print(f"✅ [STACK] レイヤースタック構築完了: {int(valid_flags.sum())}/{num_layers}レイヤー, {width}x{height}")
+        return cls(files, masks, shading, alphas, valid_flags)
+
+    @staticmethod
+    def _compile_layer(img: Image.Image) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """レイヤー画像をマスク・陰影・アルファに分解
+
+        Args:
+            img: レイヤー画像
+
+        Returns:
+            (マスク (H, W) bool, 陰影 (H, W, 3) uint8, アルファ (H, W) uint8)のタプル
+        """
+        data = np.asarray(img.convert("RGBA"))
+        mask = np.all(data[..., :3] == TARGET_COLOR, axis=-1)
+        shading = data[..., :3].copy()
+        # マゼンタ領域の陰影は乗算で影響しない白にしておく
+        shading[mask] = 255
+        return mask, shading, data[..., 3]
+
+    @classmethod
+    def from_files_cached(cls, files: List[str], cache_dir: str,
+                          load_image: Callable[[int], Optional[Image.Image]],
+                          pyramid_factors: Sequence[int] = (),
+                          executor: Optional[Executor] = None) -> 'LayerStack':
+        """ディスクキャッシュを使ってスタック（解像度ピラミッドを含む）を構築
+
+        全レイヤーファイルの更新時刻とサイズがキャッシュと一致すれば、
+        配列をメモリマップで開くだけで画像のデコードは行わない。
+        一致しないレイヤーだけをデコードし直して、キャッシュを書き換える。
+
+        Args:
+            files: レイヤーファイルパスのリスト
+            cache_dir: キャッシュフォルダ
+            load_image: レイヤーインデックスから画像をデコードする関数（失敗時はNone）
+            pyramid_factors: 作成する縮小率のリスト
+            executor: デコードに使うスレッドプール（指定時はデコード完了を待たずに返し、
+                ピラミッド構築とキャッシュ保存もデコード後にプール内で行う）
+
+        Returns:
+            構築されたLayerStack
+        """
+        signatures = [_file_signature(fname) for fname in files]
+        stack = cls._map_if_current(files, cache_dir, signatures, pyramid_factors)
+        if stack is not None:
+            return stack
+        manifest = _read_manifest(cache_dir)
+
+        # 変更のないレイヤーはキャッシュの行をそのまま使う
+        reusable = {}
+        if manifest is not None:
+            cached_rows = {name: (row, sig) for row, (name, sig)
+                           in enumerate(zip(manifest["files"], manifest["signatures"]))}
+            for i, (fname, sig) in enumerate(zip(files, signatures)):
+                row, cached_sig = cached_rows.get(os.path.basename(fname), (None, None))
+                if row is not None and sig is not None and sig == cached_sig:
+                    reusable[i] = row
+
+        # キャンバスサイズが変わった場合はキャッシュを使わずに全レイヤーを作り直す
+        pending = [i for i in range(len(files)) if i not in reusable]
+        if reusable and pending and _peek_size(files, pending) not in (None, (manifest["width"], manifest["height"])):
+            reusable = {}
+        print(f"🔄 [STACK] ディスクキャッシュ: 再利用{len(reusable)} / デコード{len(files) - len(reusable)}レイヤー")
+
+        reuse = None
+        canvas_size = None
+        if reusable:
+            cached = cls._map_cached(files, cache_dir)
+            reuse = {i: (cached.masks[row], cached.shading[row], cached.alphas[row], cached.valid[row])
+                     for i, row in reusable.items()}
+            canvas_size = (manifest["width"], manifest["height"])
+
+        def finish(stack: 'LayerStack'):
+            stack.build_pyramid(pyramid_factors)
+            stack.save(cache_dir, signatures)
+
+        return cls.from_files(files, load_image, executor, canvas_size, reuse, finish)
+
+    @classmethod
+    def from_files(cls, files: List[str], load_image: Callable[[int], Optional[Image.Image]],
+                   executor: Optional[Executor] = None, canvas_size: Optional[Tuple[int, int]] = None,
+                   reuse: Optional[Dict[int, Tuple[np.ndarray, np.ndarray, np.ndarray, bool]]] = None,
+                   finish: Optional[Callable[['LayerStack'], None]] = None) -> 'LayerStack':
+        """レイヤー画像をスレッドプールでデコードしながらスタックを構築
+
+        配列を確保した時点で返し、各レイヤーはデコードが終わり次第書き込まれる。
+        配列を参照する処理は wait_ready / wait_layer で未完了のレイヤーだけを待つ。
+        executorを省略した場合は呼び出し元のスレッドで全レイヤーをデコードしてから返す。
+
+        Args:
+            files: レイヤーファイルパスのリスト
+            load_image: レイヤーインデックスから画像をデコードする関数（失敗時はNone）
+            executor: デコードに使うスレッドプール
+            canvas_size: キャンバスサイズ (width, height)（省略時はファイルのヘッダーから取得）
+            reuse: デコードせずに使うレイヤーの (マスク, 陰影, アルファ, 有効か)
+            finish: 全レイヤーのデコード後に実行する処理（ピラミッド構築・キャッシュ保存）
+
+        Returns:
+            構築中のLayerStack
+        """
+        reuse = reuse or {}
+        pending = [i for i in range(len(files)) if i not in reuse]
+        width, height = canvas_size or _peek_size(files, pending) or IMAGE_SETTINGS["dummy_image_size"]
+
+        masks = PackedMasks.zeros(len(files), height, width)
+        shading = LayerShading.blank(len(files), height, width)
+        alphas = np.zeros((len(files), height, width), dtype=np.uint8)
+        valid = np.zeros(len(files), dtype=bool)
+        for i, (mask, shade, alpha, ok) in reuse.items():
+            masks[i], shading[i], alphas[i], valid[i] = mask, shade, alpha, ok
+        stack = cls(files, masks, shading, alphas, valid)
+
+        started = time.perf_counter()
+        stack._pending = {i: _submit(executor, stack._decode_into, i, load_image) for i in pending}
+
+        def complete():
+            for future in list(stack._pending.values()):
+                future.result()
+            if pending:
+                startup_timer.record(f"レイヤーデコード ({len(pending)}枚)", time.perf_counter() - started)
+            print(f"✅ [STACK] レイヤースタック構築完了: {int(stack.valid.sum())}/{len(files)}レイヤー, {width}x{height}")
+            if finish is not None:
+                try:
+                    with startup_timer.phase("ピラミッド構築・キャッシュ保存"):
+                        finish(stack)
+                except Exception as e:
+                    print(f"❌ [STACK] ピラミッド構築・キャッシュ保存エラー: {e}")
+                finally:
+                    # finishが縮小レベルを作らなかった・失敗した場合も待っている側を進める
+                    stack._pyramid_built.set()
+
+        if finish is not None:
+            stack._pyramid_built.clear()
+        # デコードの後に投入するので、同じプールで先に投入したデコードを待っても詰まらない
+        stack._finished = _submit(executor, complete)
+        return stack
+
+    def _decode_into(self, index: int, load_image: Callable[[int], Optional[Image.Image]]):
+        """レイヤーをデコードしてスタックの配列に書き込む（デコードスレッドで実行）
+
+        Args:
+            index: レイヤーインデックス
+            load_image: レイヤーインデックスから画像をデコードする関数（失敗時はNone）
+        """
+        try:
+            img = load_image(index)
+            if img is None:
+                return
+            if img.size != self.size:
+                print(f"⚠️ [STACK] レイヤー{index+1}のサイズ{img.size}がキャンバス{self.size}と異なるため除外します")
+                return
+            self.masks[index], self.shading[index], self.alphas[index] = self._compile_layer(img)
+            self.valid[index] = True
+        except Exception as e:
+            print(f"❌ [STACK] レイヤー{index+1}のデコードエラー: {e}")
+
+    def wait_layer(self, index: int):
+        """レイヤーのデコード完了を待つ（完了済みなら待たない）
+
+        Args:
+            index: レイヤーインデックス
+        """
+        future = self._pending.get(index)
+        if future is not None and not future.done():
+            future.result()
+
+    def wait_ready(self):
+        """全レイヤーのデコード完了を待つ（未完了のレイヤーだけを待つ）"""
+        if not self._pending:
+            return
+        waiting = [f for f in self._pending.values() if not f.done()]
+        if waiting:
+            start = time.perf_counter()
+            for future in waiting:
+                future.result()
+            print(f"⏳ [STACK] デコード待ち {len(waiting)}レイヤー: {(time.perf_counter() - start) * 1000:.1f} ms")
+        self._pending = {}
+
+    def wait_finished(self):
+        """デコード後の処理（ピラミッド構築・キャッシュ保存）の完了を待つ"""
+        if self._finished is not None:
+            self._finished.result()
+
+    def wait_pyramid(self):
+        """バックグラウンドで構築中の縮小レベルを待つ（キャッシュ保存の完了は待たない）"""
+        if self._pyramid_built.is_set():
+            return
+        start = time.perf_counter()
+        self._pyramid_built.wait()
+        print(f"⏳ [STACK] 解像度ピラミッド構築待ち: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    @classmethod
+    def from_source_cached(cls, files: List[str], source: str, cache_dir: str,
+                           build: Callable[[], 'LayerStack'],
+                           pyramid_factors: Sequence[int] = (),
+                           content_hash: Optional[str] = None) -> 'LayerStack':
+        """1つのファイル（レイヤーパッケージ）から作るスタックをディスクキャッシュ経由で構築
+
+        全レイヤーがsourceから作られるため、sourceの内容ハッシュ
+        （なければ更新時刻とサイズ）で全体を検証する。
+
+        Args:
+            files: レイヤーファイルパスのリスト
+            source: 全レイヤーを含むファイルのパス
+            cache_dir: キャッシュフォルダ
+            build: キャッシュが使えない場合にスタックを構築する関数
+            pyramid_factors: 作成する縮小率のリスト
+            content_hash: sourceの内容ハッシュ（同じ内容のファイルはコピーでもキャッシュを共有する）
+
+        Returns:
+            構築されたLayerStack
+        """
+        signature = [content_hash] if content_hash else _file_signature(source)
+        signatures = [signature] * len(files)
+        stack = cls._map_if_current(files, cache_dir, signatures, pyramid_factors)
+        if stack is None:
+            stack = build()
+            stack.build_pyramid(pyramid_factors)
+            stack.save(cache_dir, signatures)
+        return stack
+
+    @classmethod
+    def _map_if_current(cls, files: List[str], cache_dir: str, signatures: List[Optional[List[int]]],
+                        pyramid_factors: Sequence[int]) -> Optional['LayerStack']:
+        """キャッシュが全レイヤーについて最新ならメモリマップで開く
+
+        Args:
+            files: レイヤーファイルパスのリスト
+            cache_dir: キャッシュフォルダ
+            signatures: 各レイヤーの [更新時刻(ns), サイズ]（または内容ハッシュ）
+            pyramid_factors: 作成する縮小率のリスト
+
+        Returns:
+            マップしたLayerStack（キャッシュが古い・ない場合はNone）
+        """
+        manifest = _read_manifest(cache_dir)
+        if manifest is None or manifest["files"] != [os.path.basename(f) for f in files] \
+                or manifest["signatures"] != signatures:
+            return None
+
+        stack = cls._map_cached(files, cache_dir)
+        for factor in manifest["levels"]:
+            stack.levels[factor] = cls._map_cached(files, cache_dir, factor)
+        print(f"⚡ [STACK] ディスクキャッシュをマップ: {len(files)}レイヤー, "
+              f"{manifest['width']}x{manifest['height']} ({cache_dir})")
+        stack.build_pyramid(pyramid_factors)
+        if set(stack.levels) - {1} != set(manifest["levels"]):
+            stack.save(cache_dir, signatures)
+        return stack
+
+    @classmethod
+    def _map_cached(cls, files: List[str], cache_dir: str, factor: int = 1) -> 'LayerStack':
+        """キャッシュフォルダの配列を読み取り専用のメモリマップで開く
+
+        Args:
+            files: レイヤーファイルパスのリスト
+            cache_dir: キャッシュフォルダ
+            factor: 解像度レベル（縮小率）
+
+        Returns:
+            メモリマップされた配列を参照するLayerStack
+        """
+        arrays = {name: np.load(_array_path(cache_dir, name, factor), mmap_mode="r")
+                  for name in _CACHE_ARRAYS}
+        width = arrays["alphas"].shape[-1]
+        masks = PackedMasks(arrays["mask_bits"], width)
+        shading = LayerShading.from_arrays(arrays["shading_gray"], arrays["shading_color"], arrays["color_layers"])
+        return cls(files, masks, shading, arrays["alphas"], arrays["valid"])
+
+    def _cache_arrays(self) -> Dict[str, np.ndarray]:
+        """ディスクキャッシュに保存する配列（_CACHE_ARRAYS の名前 → 配列）"""
+        color, color_layers = self.shading.color_arrays()
+        return {
+            "mask_bits": self.masks.bits,
+            "shading_gray": self.shading.gray,
+            "shading_color": color,
+            "color_layers": color_layers,
+            "alphas": self.alphas,
+            "valid": self.valid,
+        }
+
+    def save(self, cache_dir: str, signatures: List[Optional[List[int]]]):
+        """スタックと縮小レベルをメモリマップ可能な .npy としてキャッシュフォルダに保存
+
+        書き込みに失敗してもアプリの動作には影響しない（警告のみ）。
+
+        Args:
+            cache_dir: キャッシュフォルダ
+            signatures: 各レイヤーファイルの [更新時刻(ns), サイズ]
+        """
+        self.wait_ready()
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            # 配列を書き終えてからマニフェストを置き換える（途中で落ちても不整合にならない）
+            manifest_path = os.path.join(cache_dir, _MANIFEST_FILE)
+            if os.path.exists(manifest_path):
+                os.remove(manifest_path)
+            for factor, stack in self.levels.items():
+                for name, array in stack._cache_arrays().items():
+                    path = _array_path(cache_dir, name, factor)
+                    np.save(path + ".tmp.npy", array)
+                    os.replace(path + ".tmp.npy", path)
+            manifest = {
+                "version": _CACHE_VERSION,
+                "files": [os.path.basename(f) for f in self.files],
+                "signatures": signatures,
+                "compile_settings": _compile_settings(),
+                "width": self.width,
+                "height": self.height,
+                "levels": sorted(factor for factor in self.levels if factor > 1),
+            }
+            with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(manifest, f)
+            os.replace(manifest_path + ".tmp", manifest_path)
+            print(f"💾 [STACK] ディスクキャッシュを保存: {cache_dir}")
+        except OSError as e:
+            print(f"⚠️ [STACK] ディスクキャッシュを保存できません: {e}")
+
+    def downsample(self, factor: int) -> 'LayerStack':
+        """面積平均で縮小したスタックを作成
+
+        陰影はブロック内のマゼンタ以外のピクセルだけで平均し、
+        マスクはブロック内の被覆率が半分以上なら被覆とみなす（多数決）。
+
+        Args:
+            factor: 縮小率（縦横それぞれ 1/factor）
+
+        Returns:
+            縮小されたLayerStack
+        """
+        self.wait_ready()
+        height, width = self.height // factor, self.width // factor
+
+        masks = PackedMasks.zeros(self.num_layers, height, width)
+        shading = LayerShading.blank(self.num_layers, height, width)
+        alphas = np.zeros((self.num_layers, height, width), dtype=np.uint8)
+        block_area = factor * factor
+
+        for i in np.flatnonzero(self.valid):
+            mask_count = _block_sum(self.masks[i], factor, height, width)
+            mask = mask_count * 2 >= block_area
+            masks[i] = mask
+
+            # マゼンタ領域の陰影は白(255)なので、その分を引いてマゼンタ以外の平均を求める
+            shade_sum = _block_sum(self.shading[i], factor, height, width)
+            shade_sum -= (255 * mask_count)[..., None]
+            keep_count = (block_area - mask_count)[..., None]
+            average = (shade_sum + keep_count // 2) // np.maximum(keep_count, 1)
+            layer_shading = np.where(keep_count > 0, average, 255).astype(np.uint8)
+            layer_shading[mask] = 255
+            shading[i] = layer_shading
+
+            alpha_sum = _block_sum(self.alphas[i], factor, height, width)
+            alphas[i] = (alpha_sum + block_area // 2) // block_area
+
+        return LayerStack(self.files, masks, shading, alphas, self.valid.copy())
+
+    def build_pyramid(self, factors: Sequence[int]):
+        """縮小レベルを読み込み時に構築（構築済みのレベルはそのまま）
+
+        Args:
+            factors: 作成する縮小率のリスト
+        """
+        # デコードスレッドから呼ばれても参照中の辞書を変えないよう、作り直してから差し替える
+        levels = dict(self.levels)
+        for factor in factors:
+            if factor > 1 and factor not in levels and self.height // factor > 0 and self.width // factor > 0:
+                levels[factor] = self.downsample(factor)
+        self.levels = levels
+        self._pyramid_built.set()
+        sizes = [f"1/{f}:{lv.width}x{lv.height}" for f, lv in sorted(levels.items())]
+        print(f"✅ [STACK] 解像度ピラミッド構築: {', '.join(sizes)}")
+        self.report_memory()
+
+    def report_memory(self):
+        """レイヤーの保持メモリ（全解像度レベル）と、従来形式からの削減量を表示
+
+        従来形式はレイヤーごとのRGBA画像（フル解像度）と展開した配列（マスクbool・陰影RGB）。
+        """
+        levels = list(self.levels.values())
+        compact = sum(level.nbytes for level in levels)
+        before = sum(level.dense_nbytes for level in levels) + self.num_layers * self.height * self.width * 4
+        valid = int(self.valid.sum())
+        gray = sum(1 for i in np.flatnonzero(self.valid) if int(i) not in self.shading.color)
+        megabyte = 1024 * 1024
+        print(f"💾 [STACK] レイヤー保持メモリ: {compact / megabyte:.1f} MB "
+              f"（従来のRGBA画像+展開配列 {before / megabyte:.1f} MB から {(1 - compact / max(before, 1)) * 100:.0f}% 削減, "
+              f"1ビットマスク, 1チャンネル陰影 {gray}/{valid}レイヤー）")
+
+    def level(self, factor: int) -> 'LayerStack':
+        """指定縮小率のスタックを取得（未構築ならフル解像度）
+
+        Args:
+            factor: 縮小率
+
+        Returns:
+            該当レベルのLayerStack
+        """
+        return self.levels.get(factor, self)
+
+    def mask_indices(self, index: int) -> np.ndarray:
+        """マゼンタ領域のフラットなピクセルインデックスを取得（初回のみ計算）
+
+        Args:
+            index: レイヤーインデックス
+
+        Returns:
+            マスク内ピクセルのインデックス配列
+        """
+        self.wait_layer(index)
+        if self._mask_indices[index] is None:
+            self._mask_indices[index] = np.flatnonzero(self.masks[index])
+        return self._mask_indices[index]
+
+    def active_pixels(self, index: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """乗算で値が変わるピクセル（マゼンタ領域と白以外の陰影）を取得（初回のみ計算）
+
+        白(255)との乗算は値を変えないため、合成ではこのピクセルだけを処理すればよい。
+        レイヤーの外接矩形と違い、線画がキャンバス全体に散っていても描画面積に比例する。
+
+        Args:
+            index: レイヤーインデックス
+
+        Returns:
+            (フラットなピクセルインデックス (N,) int32,
+             その陰影 (N, 4) uint8（4チャンネル目は255）,
+             マゼンタ領域の位置 (M,) int32)のタプル
+        """
+        self.wait_layer(index)
+        if self._active_pixels[index] is None:
+            mask = self.masks[index].reshape(-1)
+            # 1チャンネルで保持しているレイヤーは (N, 1) のまま判定し、集めた後にRGBへ広げる
+            shading = self.shading.channels(index).reshape(mask.size, -1)
+            indices = np.flatnonzero(mask | (shading != 255).any(axis=1)).astype(np.int32)
+            active = np.full((indices.size, 4), 255, dtype=np.uint8)
+            active[:, :3] = shading[indices]
+            positions = np.flatnonzero(mask[indices]).astype(np.int32)
+            self._active_pixels[index] = (indices, active, positions)
+        return self._active_pixels[index]
+
+    @property
+    def mask_bboxes(self) -> np.ndarray:
+        """各レイヤーのマゼンタ領域の外接矩形（初回のみ計算、パッケージから読み込んだセットは保存値）
+
+        Returns:
+            (L, 4) int32 の [x0, y0, x1, y1)（マゼンタ領域のないレイヤーは全て0）
+        """
+        if self._mask_bboxes is None:
+            self.wait_ready()
+            bboxes = np.zeros((self.num_layers, 4), dtype=np.int32)
+            for i in range(self.num_layers):
+                rows = np.flatnonzero(self.masks[i].any(axis=1))
+                if rows.size:
+                    cols = np.flatnonzero(self.masks[i].any(axis=0))
+                    bboxes[i] = (cols[0], rows[0], cols[-1] + 1, rows[-1] + 1)
+            self._mask_bboxes = bboxes
+        return self._mask_bboxes
+
+    @mask_bboxes.setter
+    def mask_bboxes(self, bboxes: np.ndarray):
+        self._mask_bboxes = np.asarray(bboxes, dtype=np.int32)
+
+    def mask_overlaps(self, index: int, rows: slice, cols: slice) -> bool:
+        """レイヤーのマゼンタ領域の外接矩形がタイルと重なるか
+
+        Args:
+            index: レイヤーインデックス
+            rows: タイルの行範囲
+            cols: タイルの列範囲
+
+        Returns:
+            重なる場合True（重ならないタイルではマスクが全てFalse）
+        """
+        x0, y0, x1, y1 = self.mask_bboxes[index].tolist()
+        return x0 < cols.stop and cols.start < x1 and y0 < rows.stop and rows.start < y1
+
+    def tile_active_pixels(self, index: int, rows: slice, cols: slice) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """タイル内で乗算により値が変わるピクセルを取得（active_pixelsのタイル版、タイルごとに初回のみ計算）
+
+        Args:
+            index: レイヤーインデックス
+            rows: タイルの行範囲
+            cols: タイルの列範囲
+
+        Returns:
+            (タイル内のフラットなピクセルインデックス (N,) int32,
+             その陰影 (N, 4) uint8（4チャンネル目は255）,
+             マゼンタ領域の位置 (M,) int32)のタプル
+        """
+        key = (index, rows.start, rows.stop, cols.start, cols.stop)
+        cached = self._tile_active_pixels.get(key)
+        if cached is None:
+            self.wait_layer(index)
+            # 外接矩形の外のタイルはマスクを展開しない
+            if self.mask_overlaps(index, rows, cols):
+                mask = self.masks[index, rows, cols].reshape(-1)
+            else:
+                mask = np.zeros((rows.stop - rows.start) * (cols.stop - cols.start), dtype=bool)
+            # 1チャンネルで保持しているレイヤーは (N, 1) のまま判定し、集めた後にRGBへ広げる
+            shading = self.shading.channels((index, rows, cols)).reshape(mask.size, -1)
+            # 白以外の陰影 = チャンネルの最小値が255未満（any(axis=1)より高速）
+            darkest = shading[:, 0]
+            if shading.shape[1] > 1:
+                darkest = np.minimum(np.minimum(darkest, shading[:, 1]), shading[:, 2])
+            indices = np.flatnonzero(mask | (darkest != 255)).astype(np.int32)
+            active = np.full((indices.size, 4), 255, dtype=np.uint8)
+            active[:, :3] = shading[indices]
+            cached = (indices, active, np.flatnonzero(mask[indices]).astype(np.int32))
+            self._tile_active_pixels[key] = cached
+        return cached
+
+    def tile_shading_product(self, rows: slice, cols: slice) -> np.ndarray:
+        """タイル内の陰影の積（shading_productのタイル版、タイルごとに初回のみ計算、変更禁止）
+
+        Args:
+            rows: タイルの行範囲
+            cols: タイルの列範囲
+
+        Returns:
+            (h, w, 3) float32 の配列
+        """
+        key = (rows.start, rows.stop, cols.start, cols.stop)
+        cached = self._tile_shading_products.get(key)
+        if cached is None:
+            cached = self.shading_product(rows, cols)
+            self._tile_shading_products[key] = cached
+        return cached
+
+    def shading_product(self, rows: slice = slice(None), cols: slice = slice(None)) -> np.ndarray:
+        """有効レイヤーの陰影の積（0-1）を計算
+
+        1チャンネルで保持しているレイヤーは1チャンネルのまま掛け合わせ、最後にRGBへ広げる。
+        FactorizedCompositor と TiledCompositor はこの関数を共有し、結果を一致させる。
+
+        Args:
+            rows: 行の範囲（タイル合成用）
+            cols: 列の範囲（タイル合成用）
+
+        Returns:
+            (h, w, 3) float32 の配列
+        """
+        self.wait_ready()
+        gray = np.ones(self.alphas[0, rows, cols].shape if self.num_layers else (0, 0), dtype=np.float32)
+        product = np.ones(gray.shape + (3,), dtype=np.float32)
+        for i in np.flatnonzero(self.valid):
+            layer = self.shading.channels((i, rows, cols))
+            if layer.shape[-1] == 1:
+                gray *= layer[..., 0].astype(np.float32) / 255.0
+            else:
+                product *= layer.astype(np.float32) / 255.0
+        product *= gray[..., None]
+        return product
+
+    @property
+    def composite_alpha(self) -> np.ndarray:
+        """合成後のアルファ（有効レイヤーのアルファの最大値、初回のみ計算）"""
+        self.wait_ready()
+        if self._composite_alpha is None:
+            alpha = np.zeros((self.height, self.width), dtype=np.uint8)
+            for i in np.flatnonzero(self.valid):
+                np.maximum(alpha, self.alphas[i], out=alpha)
+            self._composite_alpha = alpha
+        return self._composite_alpha
+
+    @property
+    def layer_bits(self) -> np.ndarray:
+        """ピクセルごとのレイヤー所属ビットセット（初回のみ計算）
+
+        ビット i がレイヤー i のマゼンタ領域を表す。64レイヤーごとに1ワード使う。
+
+        Returns:
+            (H, W, ワード数) uint64 の配列
+        """
+        self.wait_ready()
+        if self._layer_bits is None:
+            words = max(1, (self.num_layers + 63) // 64)
+            bits = np.zeros((self.height, self.width, words), dtype=np.uint64)
+            for i in np.flatnonzero(self.valid):
+                bits[..., i // 64][self.masks[i]] |= np.uint64(1 << (i % 64))
+            self._layer_bits = bits
+        return self._layer_bits
+
+    def layers_at(self, x: int, y: int) -> List[int]:
+        """指定座標でマゼンタ領域を持つレイヤーを取得
+
+        Args:
+            x: X座標
+            y: Y座標
+
+        Returns:
+            レイヤーインデックスのリスト（キャンバス外なら空）
+        """
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return []
+        hits = []
+        for word, bits in enumerate(self.layer_bits[y, x].tolist()):
+            while bits:
+                low = bits & -bits
+                hits.append(word * 64 + low.bit_length() - 1)
+                bits ^= low
+        return hits
+
+    def colored_layer(self, index: int, rgb: Tuple[int, int, int],
+                      out: Optional[np.ndarray] = None) -> np.ndarray:
+        """マゼンタ領域を指定色に置換したRGBA配列を作成
+
+        LayerColorizer.replace_color と同じ結果を配列で返す。
+
+        Args:
+            index: レイヤーインデックス
+            rgb: 置換後のRGB値
+            out: 書き込み先の (H, W, 4) uint8 配列（省略時は新規作成）
+
+        Returns:
+            (H, W, 4) uint8 のRGBA配列
+        """
+        self.wait_layer(index)
+        if out is None:
+            out = np.empty((self.height, self.width, 4), dtype=np.uint8)
+        out[..., :3] = self.shading[index]
+        out[..., :3][self.masks[index]] = rgb
+        out[..., 3] = self.alphas[index]
+        return out
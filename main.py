@@ -3,6 +3,8 @@ MS Color Generator - メインエントリポイント
 """
 
 import os
+# 起動時間の計測はできるだけ早く始める
+from startup_timing import startup_timer
 from config import VERSION, LAYER_DIR, SAVE_DIR
 
 
@@ -53,7 +55,9 @@ def main():
         is_restart = check_restart_flag()
         
         # 遅延インポート（起動時間短縮のため）
-        from ui import colorizer, create_ui
+        # レイヤーのデコードはバックグラウンドで続き、初回合成で未完了のレイヤーだけを待つ
+        with startup_timer.phase("モジュール読み込み・レイヤー準備"):
+            from ui import colorizer, create_ui
         
         # 起動情報表示
         display_startup_info(colorizer)
@@ -18,6 +18,7 @@ class ColorGenerationParams:
     color_count: int = 4                # 生成色数
     equal_hue_spacing: bool = False     # 色相等間隔生成モード
     min_hue_distance: float = 30.0      # 最小色相距離 (0-180度)
+    best_of_n: bool = False             # ベスト配色探索モード（多数の候補から採点上位を選ぶ）
     
     def __post_init__(self):
         """パラメータ値の検証"""
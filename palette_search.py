@@ -0,0 +1,212 @@
+"""
+MS Color Generator - ベスト配色探索（候補配色をまとめて生成・採点）
+
+候補配色を数千個まとめて生成し、明度差・色相の広がり・色相ハーモニーへの適合度を
+配列演算で採点して、上位の配色を返す。1回にまとめて生成する候補数は、計測した
+処理速度から時間予算の残りに収まるように決める。
+"""
+
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import color_convert
+from color_utils import sample_palettes, feasible_hue_distance
+from config import PALETTE_SEARCH_SETTINGS
+from models import ColorGenerationParams
+
+# 採点の指標（palette_metricsの列の順）
+METRICS = ("value_contrast", "hue_spread", "harmony")
+
+
+def _pairs(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(N, C) の配列から配色ごとの全ペア (N, C*(C-1)/2) を取り出す"""
+    first, second = np.triu_indices(values.shape[1], k=1)
+    return values[:, first], values[:, second]
+
+
+def value_contrast(lab: np.ndarray) -> np.ndarray:
+    """明度差（L*の全ペアの平均差）
+
+    Args:
+        lab: (N, C, 3) のLab配列
+
+    Returns:
+        (N,) の明度差（L*）
+    """
+    first, second = _pairs(lab[..., 0])
+    return np.abs(first - second).mean(axis=1)
+
+
+def hue_spread(hsv: np.ndarray) -> np.ndarray:
+    """色相の広がり（全ペアの最小色相距離）
+
+    Args:
+        hsv: (N, C, 3) のHSV配列（0-1）
+
+    Returns:
+        (N,) の最小色相距離（度）
+    """
+    first, second = _pairs(hsv[..., 0] * 360.0)
+    diff = np.abs(first - second)
+    return np.minimum(diff, 360.0 - diff).min(axis=1)
+
+
+def harmony_deviation(hsv: np.ndarray, templates: Dict[str, Sequence[Tuple[float, float]]]) -> np.ndarray:
+    """色相ハーモニーのテンプレートからのずれ（最もよく合うテンプレートと回転角で評価）
+
+    各色の色相が最も近い扇形からはみ出した角度を、彩度で重み付けして平均する
+    （無彩色に近い色はどの色相でも調和するため）。ずれは回転角に対して区分線形なので、
+    最小値はいずれかの色相が扇形の端に一致する回転角で得られる。その回転角だけを調べる。
+
+    Args:
+        hsv: (N, C, 3) のHSV配列（0-1）
+        templates: テンプレート名 → [(扇形の中心の相対角度, 扇形の幅), ...] の辞書
+
+    Returns:
+        (N,) のずれ（度、0なら完全に適合）
+    """
+    hues = hsv[..., 0] * 360.0
+    weights = hsv[..., 1] / np.maximum(hsv[..., 1].sum(axis=1, keepdims=True), 1e-9)
+    # 全ペアの色相差 h_k - h_i (N, C_i, C_k)
+    relative = hues[:, None, :] - hues[:, :, None]
+    best = np.full(len(hsv), np.inf)
+    for sectors in templates.values():
+        centers, widths = np.asarray(sectors, dtype=np.float64).T
+        half = widths / 2
+        edges = np.concatenate([centers - half, centers + half])
+        # 色相 h_i を扇形の端 e に合わせた回転での各色の角度 h_k - h_i + e (N, C_i, E, C_k)
+        angles = (relative[:, :, None, :] + edges[:, None]) % 360.0
+        # 各扇形の中心との距離 (N, C_i, E, C_k, M) から、最も近い扇形からはみ出した角度を求める
+        diff = np.abs(angles[..., None] - centers)
+        diff = np.minimum(diff, 360.0 - diff)
+        outside = np.maximum(diff - half, 0.0).min(axis=-1)
+        cost = (outside * weights[:, None, None, :]).sum(axis=-1)
+        best = np.minimum(best, cost.reshape(len(hsv), -1).min(axis=1))
+    return best
+
+
+def palette_metrics(hsv: np.ndarray, templates: Dict[str, Sequence[Tuple[float, float]]]) -> np.ndarray:
+    """配色ごとの採点指標（大きいほど良い）
+
+    Args:
+        hsv: (N, C, 3) のHSV配列（0-1）
+        templates: 色相ハーモニーのテンプレート
+
+    Returns:
+        (N, 3) の [明度差, 色相の広がり, -ハーモニーのずれ]（METRICSの順、2色未満はすべて0）
+    """
+    if hsv.shape[1] < 2:
+        return np.zeros((len(hsv), len(METRICS)))
+    lab = color_convert.rgb_to_lab(color_convert.hsv_to_rgb(hsv))
+    return np.stack([
+        value_contrast(lab),
+        hue_spread(hsv),
+        -harmony_deviation(hsv, templates),
+    ], axis=1)
+
+
+def combine_scores(metrics: np.ndarray, weights: Dict[str, float]) -> np.ndarray:
+    """指標を候補全体で 0-1 に正規化して重み付けした合計スコア
+
+    Args:
+        metrics: (N, 3) の採点指標（palette_metrics）
+        weights: 指標名 → 重みの辞書
+
+    Returns:
+        (N,) のスコア
+    """
+    low = metrics.min(axis=0)
+    spread = metrics.max(axis=0) - low
+    # 全候補で同じ値の指標は順位に影響しないため0とする
+    normalized = np.where(spread > 0, (metrics - low) / np.where(spread > 0, spread, 1.0), 0.0)
+    return normalized @ np.array([weights[name] for name in METRICS], dtype=np.float64)
+
+
+class PaletteSearch:
+    """時間予算内で候補配色を生成・採点して上位の配色を返す
+
+    1回にまとめて生成する候補数は、直前に計測した処理速度（候補数/秒）と
+    時間予算の残りから決める。速度が未計測の最初の探索は少数の候補で速度を測ってから
+    残りを一括生成する。各回は残り時間の半分に収まる候補数にするため、見積もりがずれても
+    時間予算を超えない。速度は探索をまたいで引き継ぐ。
+    """
+
+    def __init__(self, settings: Optional[dict] = None):
+        """初期化
+
+        Args:
+            settings: 探索設定（省略時はconfigのPALETTE_SEARCH_SETTINGS）
+        """
+        self.settings = settings or PALETTE_SEARCH_SETTINGS
+        self.rate: Optional[float] = None
+        self.last_stats: Dict[str, float] = {}
+
+    def _batch_size(self, remaining: float, searched: int) -> int:
+        """次にまとめて生成する候補数（0なら打ち切り）
+
+        Args:
+            remaining: 時間予算の残り（秒）
+            searched: 生成済みの候補数
+        """
+        settings = self.settings
+        if searched and remaining <= 0:
+            return 0
+        if self.rate is None:
+            # 未計測のときは少数の候補で速度だけを測り、次の一括生成で残り時間に合わせる
+            size = settings["probe_batch"]
+        else:
+            # 残り時間の半分に収める（大きな一括生成は候補あたりの時間が延びるため、
+            # 見積もりが2倍ずれても予算を超えない。残りは次以降の小さな一括生成で使う）
+            size = int(self.rate * max(remaining, 0.0) * 0.5)
+        size = min(size, settings["max_batch"], settings["max_candidates"] - searched)
+        if searched == 0:
+            # 時間予算に関係なく最低1回は探索する（予算を超えないよう最小限の候補数）
+            return max(size, 1)
+        return size if size >= settings["min_batch"] else 0
+
+    def search(self, params: ColorGenerationParams, top_k: int,
+               score_count: Optional[int] = None) -> List[List[str]]:
+        """候補配色を生成・採点して上位の配色を取得
+
+        Args:
+            params: 色生成パラメータ
+            top_k: 取得する配色数
+            score_count: 採点に使う先頭の色数（使用する色数、省略時は全色）
+
+        Returns:
+            スコアの高い順の配色（16進数カラーコードのリスト）のリスト
+        """
+        # 候補の生成・採点は、集計の時間を残した分だけ行う
+        budget = (self.settings["time_budget_ms"] - self.settings["finish_reserve_ms"]) / 1000.0
+        start = time.perf_counter()
+        palettes, metrics = [], []
+        searched = 0
+        if not params.equal_hue_spacing:
+            _, warning = feasible_hue_distance(params)
+            if warning:
+                print(f"⚠️ [PALETTE] {warning}")
+
+        while True:
+            size = self._batch_size(budget - (time.perf_counter() - start), searched)
+            if size <= 0:
+                break
+            batch_start = time.perf_counter()
+            hsv = sample_palettes(params, size)
+            metrics.append(palette_metrics(hsv[:, :score_count], self.settings["harmony_templates"]))
+            palettes.append(hsv)
+            self.rate = size / max(time.perf_counter() - batch_start, 1e-6)
+            searched += size
+
+        scores = combine_scores(np.concatenate(metrics), self.settings["weights"])
+        top = np.argsort(-scores, kind="stable")[:top_k]
+        best = np.concatenate(palettes)[top]
+        colors = color_convert.hsv_to_hex(best.reshape(-1, 3))
+        count = best.shape[1]
+
+        elapsed = time.perf_counter() - start
+        self.last_stats = {"candidates": searched, "batches": len(palettes), "elapsed_ms": elapsed * 1000}
+        print(f"🏆 [PALETTE] {searched}配色を採点（{len(palettes)}回, {elapsed * 1000:.0f} ms / "
+              f"予算 {self.settings['time_budget_ms']} ms）: 上位スコア {[round(float(scores[i]), 2) for i in top]}")
+        return [colors[k * count:(k + 1) * count] for k in range(len(top))]
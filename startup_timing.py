@@ -0,0 +1,58 @@
+"""
+MS Color Generator - 起動時間の計測（フェーズごとのログ）
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Tuple
+
+
+class StartupTimer:
+    """起動処理のフェーズごとの所要時間を記録・表示する
+
+    計測の起点はこのモジュールの読み込み時刻（main.pyの先頭で読み込む）。
+    バックグラウンドのデコードスレッドからも記録できる。
+    """
+
+    def __init__(self):
+        """初期化（計測開始）"""
+        self.origin = time.perf_counter()
+        self.phases: List[Tuple[str, float]] = []
+        self._lock = threading.Lock()
+
+    def elapsed(self) -> float:
+        """計測開始からの経過時間（秒）"""
+        return time.perf_counter() - self.origin
+
+    def record(self, name: str, seconds: float):
+        """フェーズの所要時間を記録して表示
+
+        Args:
+            name: フェーズ名
+            seconds: 所要時間（秒）
+        """
+        with self._lock:
+            self.phases.append((name, seconds))
+        print(f"⏱️ [STARTUP] {name}: {seconds * 1000:.1f} ms（起動から {self.elapsed() * 1000:.0f} ms）")
+
+    @contextmanager
+    def phase(self, name: str, once: bool = False):
+        """with文で囲んだ処理の所要時間を記録
+
+        Args:
+            name: フェーズ名
+            once: Trueなら最初の1回だけ記録（ページ読み込みごとに呼ばれる処理など）
+        """
+        if once and any(recorded == name for recorded, _ in self.phases):
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+
+# アプリ全体で共有する計測器
+startup_timer = StartupTimer()
@@ -0,0 +1,76 @@
+"""
+MS Color Generator - テスト共通の設定と合成用の小さなレイヤー画像
+"""
+
+import os
+import sys
+from typing import List
+
+import numpy as np
+import pytest
+from PIL import Image
+
+# ルートのモジュール（config, layer_stack など）を読み込めるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import TARGET_COLOR  # noqa: E402
+
+
+def make_layer_images(num_layers: int, height: int = 24, width: int = 32, seed: int = 0) -> List[Image.Image]:
+    """マゼンタ領域・陰影・アルファを持つランダムなレイヤー画像を作成
+
+    各レイヤーは白地に陰影の矩形（グレースケールか色付き）とマゼンタの矩形を持ち、
+    一部のピクセルは半透明・透明になる。矩形は重なるため、複数レイヤーが覆うピクセルもできる。
+
+    Args:
+        num_layers: レイヤー数
+        height: 高さ
+        width: 幅
+        seed: 乱数シード
+
+    Returns:
+        RGBA画像のリスト
+    """
+    rng = np.random.default_rng(seed)
+    images = []
+    for i in range(num_layers):
+        data = np.full((height, width, 4), 255, dtype=np.uint8)
+
+        y0, x0 = rng.integers(0, height // 2), rng.integers(0, width // 2)
+        y1, x1 = rng.integers(y0 + 1, height + 1), rng.integers(x0 + 1, width + 1)
+        shape = (y1 - y0, x1 - x0)
+        if i % 2:
+            data[y0:y1, x0:x1, :3] = rng.integers(0, 256, shape + (3,))
+        else:
+            data[y0:y1, x0:x1, :3] = rng.integers(0, 256, shape)[..., None]
+
+        y0, x0 = rng.integers(0, height // 2), rng.integers(0, width // 2)
+        y1, x1 = rng.integers(y0 + 1, height + 1), rng.integers(x0 + 1, width + 1)
+        data[y0:y1, x0:x1, :3] = TARGET_COLOR
+
+        data[..., 3] = np.where(rng.random((height, width)) < 0.1, rng.integers(0, 256, (height, width)), 255)
+        images.append(Image.fromarray(data, "RGBA"))
+    return images
+
+
+@pytest.fixture
+def layer_images():
+    """レイヤー画像を作成する関数（make_layer_images）"""
+    return make_layer_images
+
+
+@pytest.fixture
+def layer_files(tmp_path):
+    """レイヤー画像を layerN.png として一時フォルダに保存する関数
+
+    Returns:
+        (images) → ファイルパスのリスト を返す関数
+    """
+    def write(images: List[Image.Image]) -> List[str]:
+        files = []
+        for i, img in enumerate(images):
+            path = os.path.join(str(tmp_path), f"layer{i + 1}.png")
+            img.save(path)
+            files.append(path)
+        return files
+    return write
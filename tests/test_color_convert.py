@@ -0,0 +1,63 @@
+"""
+MS Color Generator - 配列ベースの色変換のテスト
+"""
+
+import colorsys
+
+import numpy as np
+import pytest
+
+import color_convert
+
+
+def _colorsys_hex(h, s, v):
+    """1色ずつの従来の変換（colorsys → int(x * 255) の切り捨て）"""
+    return "#" + "".join(f"{max(0, min(255, int(c * 255))):02x}" for c in colorsys.hsv_to_rgb(h, s, v))
+
+
+def _hsv_samples():
+    """ランダムなHSVに、色相の区間の境界・無彩色・黒を加えた (N, 3) 配列"""
+    rng = np.random.default_rng(0)
+    edges = [[k / 6, s, v] for k in range(7) for s in (0.0, 0.5, 1.0) for v in (0.0, 0.5, 1.0)]
+    return np.concatenate([rng.random((20000, 3)), edges])
+
+
+def test_hsv_to_rgb_matches_colorsys():
+    hsv = _hsv_samples()
+    expected = [colorsys.hsv_to_rgb(*row) for row in hsv]
+    np.testing.assert_array_equal(color_convert.hsv_to_rgb(hsv), expected)
+
+
+def test_hsv_to_hex_matches_colorsys():
+    hsv = _hsv_samples()
+    assert color_convert.hsv_to_hex(hsv) == [_colorsys_hex(*row) for row in hsv]
+
+
+def test_rgb_to_hsv_matches_colorsys():
+    rng = np.random.default_rng(1)
+    rgb = np.concatenate([rng.random((20000, 3)), rng.integers(0, 256, (2000, 3)) / 255.0, [[0, 0, 0], [1, 1, 1]]])
+    expected = [colorsys.rgb_to_hsv(*row) for row in rgb]
+    np.testing.assert_allclose(color_convert.rgb_to_hsv(rgb), expected, rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize("color, rgb, valid", [
+    ("#c08040", [192, 128, 64], True),
+    ("C08040", [192, 128, 64], True),
+    ("#FFffFF", [255, 255, 255], True),
+    ("#c0804", [0, 0, 0], False),
+    ("#c0804g", [0, 0, 0], False),
+    ("#c0804あ", [0, 0, 0], False),
+    ("", [0, 0, 0], False),
+    (None, [0, 0, 0], False),
+])
+def test_hex_to_rgb_bytes_parses_each_color(color, rgb, valid):
+    values, flags = color_convert.hex_to_rgb_bytes(["#123456", color])
+    np.testing.assert_array_equal(values, [[0x12, 0x34, 0x56], rgb])
+    np.testing.assert_array_equal(flags, [True, valid])
+
+
+def test_lab_round_trip_keeps_every_byte_color():
+    rgb = np.random.default_rng(2).integers(0, 256, (5000, 3)).astype(np.uint8)
+    hexes = color_convert.rgb_bytes_to_hex(rgb)
+    lab = color_convert.hex_to_lab(hexes)
+    np.testing.assert_array_equal(np.rint(color_convert.lab_to_rgb(lab) * 255), rgb)
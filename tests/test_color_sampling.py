@@ -0,0 +1,185 @@
+"""
+MS Color Generator - 配色サンプリング（並び・色相配置・配色生成）のテスト
+"""
+
+import itertools
+import math
+import random
+from collections import Counter
+
+import numpy as np
+import pytest
+
+import color_utils
+from color_utils import (
+    count_distinct_permutations, unrank_distinct_permutation, sample_distinct_permutations, generate_four_patterns,
+    max_hue_distance, feasible_hue_distance, sample_separated_hues, sample_palettes,
+)
+from models import ColorGenerationParams
+
+MULTISETS = [
+    ["a", "b", "c", "d"],
+    ["a", "b", "a", "c", "a"],
+    ["#ff0000", "#00ff00", "#ff0000", "#00ff00", "#0000ff", "#0000ff"],
+    ["x", "x", "x"],
+]
+SEEDS = range(8)
+
+
+@pytest.fixture
+def seeded(monkeypatch):
+    """color_utils の乱数生成器をシードで固定する関数"""
+    def seed(value: int):
+        monkeypatch.setattr(color_utils, "_rng", np.random.default_rng(value))
+        random.seed(value)
+    return seed
+
+
+def _circular_distances(hues: np.ndarray) -> np.ndarray:
+    """配色内の全ての色相の組の円周上の距離（度）"""
+    i, j = np.triu_indices(hues.shape[-1], k=1)
+    diff = np.abs(hues[..., i] - hues[..., j]) % 360
+    return np.minimum(diff, 360 - diff)
+
+
+def _on_arc(hues: np.ndarray, start: float, width: float) -> bool:
+    """全ての色相が start から width 度の弧の上にあるか"""
+    return bool(((hues - start) % 360 <= width + 1e-9).all())
+
+
+@pytest.mark.parametrize("items", MULTISETS)
+def test_count_matches_multinomial_coefficient(items):
+    expected = math.factorial(len(items))
+    for count in Counter(items).values():
+        expected //= math.factorial(count)
+    assert count_distinct_permutations(items) == expected
+    assert count_distinct_permutations(items) == len(set(itertools.permutations(items)))
+
+
+@pytest.mark.parametrize("items", MULTISETS)
+def test_every_rank_unranks_to_a_distinct_arrangement(items):
+    total = count_distinct_permutations(items)
+    arrangements = [tuple(unrank_distinct_permutation(items, rank)) for rank in range(total)]
+
+    assert len(set(arrangements)) == total
+    assert set(arrangements) == set(itertools.permutations(items))
+    # 値を最初に現れた順に並べた辞書順
+    order = {value: i for i, value in reversed(list(enumerate(items)))}
+    assert arrangements == sorted(arrangements, key=lambda a: [order[v] for v in a])
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_sampled_permutations_are_distinct(seeded, seed):
+    seeded(seed)
+    items = ["#111111", "#222222", "#111111", "#333333", "#444444", "#222222", "#555555",
+             "#666666", "#777777", "#888888"]
+    patterns = sample_distinct_permutations(items, 4)
+    assert len({tuple(p) for p in patterns}) == 4
+    assert all(Counter(p) == Counter(items) for p in patterns)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_sampling_beyond_64_bit_permutation_counts(seeded, seed):
+    # 10色 × 3 の30要素: 異なる並びは 30! / (3!)^10 ≈ 4.4 × 10^24 通り（2**63 を超える）
+    seeded(seed)
+    colors = [f"#{i:02x}{i:02x}{i:02x}" for i in range(10)] * 3
+    assert count_distinct_permutations(colors) > 2 ** 63
+
+    patterns = sample_distinct_permutations(colors, 4)
+    assert len({tuple(p) for p in patterns}) == 4
+    assert all(Counter(p) == Counter(colors) for p in patterns)
+
+    patterns = generate_four_patterns(colors, [f"GROUP{i + 1}" for i in range(len(colors))])
+    assert len({tuple(p) for p in patterns}) == 4
+
+
+def test_sampling_more_than_available_returns_every_arrangement():
+    items = ["a", "a", "b"]
+    patterns = sample_distinct_permutations(items, 4)
+    assert sorted(map(tuple, patterns)) == sorted(set(itertools.permutations(items)))
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("start, width, count, min_distance", [
+    (120, 120, 4, 30),
+    (300, 120, 5, 25),      # 0度をまたぐ弧
+    (0, 60, 4, 20),         # 間隔がちょうど弧を埋める
+    (0, 360, 6, 60),        # 全周を等間隔で埋める
+    (10, 360, 3, 0),
+    (0, 340, 8, 40),        # 両端の色も円周側で離す
+])
+def test_separated_hues_keep_distance_and_arc(seeded, seed, start, width, count, min_distance):
+    seeded(seed)
+    hues = sample_separated_hues(start, width, count, min_distance, size=200)
+
+    assert hues.shape == (200, count)
+    assert ((hues >= 0) & (hues < 360)).all()
+    assert _circular_distances(hues).min() >= min_distance - 1e-9
+    if width < 360:
+        assert _on_arc(hues, start, width)
+
+
+def test_separated_hues_without_size_returns_one_palette(seeded):
+    seeded(0)
+    hues = sample_separated_hues(0, 90, 3, 20)
+    assert hues.shape == (3,)
+    assert _circular_distances(hues).min() >= 20 - 1e-9
+
+
+@pytest.mark.parametrize("hue_range, count, expected", [
+    (60, 4, 40.0),
+    (180, 4, 90.0),
+    (170, 8, 45.0),
+    (10, 2, 20.0),
+])
+def test_max_hue_distance(hue_range, count, expected):
+    assert max_hue_distance(hue_range, count) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_palettes_respect_parameters(seeded, seed):
+    seeded(seed)
+    params = ColorGenerationParams(hue_center=350, hue_range=45, color_count=4, min_hue_distance=25,
+                                   saturation_base=40, saturation_range=10,
+                                   brightness_base=95, brightness_range=20)
+    hsv = sample_palettes(params, 300)
+
+    assert hsv.shape == (300, 4, 3)
+    hues = hsv[..., 0] * 360
+    assert _circular_distances(hues).min() >= 25 - 1e-9
+    assert _on_arc(hues, 350 - 45, 90)
+    assert ((hsv[..., 1] >= 0.30) & (hsv[..., 1] <= 0.50)).all()
+    # 明度は 100 で打ち切る
+    assert ((hsv[..., 2] >= 0.75) & (hsv[..., 2] <= 1.0)).all()
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("hue_range, count, min_distance", [
+    (60, 4, 90),            # 弧に収まらない
+    (180, 5, 180),          # 全周でも収まらない
+    (10, 10, 30),
+])
+def test_infeasible_distance_falls_back_to_maximum(seeded, seed, hue_range, count, min_distance):
+    seeded(seed)
+    params = ColorGenerationParams(hue_center=90, hue_range=hue_range, color_count=count,
+                                   min_hue_distance=min_distance)
+    limit, warning = feasible_hue_distance(params)
+    assert limit == max_hue_distance(hue_range, count) < min_distance
+    assert f"{limit:.1f}°" in warning
+
+    hues = sample_palettes(params, 100)[..., 0] * 360
+    assert _circular_distances(hues).min() >= limit - 1e-6
+    if hue_range < 180:
+        assert _on_arc(hues, 90 - hue_range, 2 * hue_range)
+
+
+def test_feasible_distance_is_kept_without_warning():
+    params = ColorGenerationParams(hue_range=60, color_count=4, min_hue_distance=40)
+    assert feasible_hue_distance(params) == (40, None)
+
+
+def test_equal_spacing_uses_evenly_spaced_hues(seeded):
+    seeded(0)
+    params = ColorGenerationParams(hue_center=0, hue_range=180, color_count=5, equal_hue_spacing=True)
+    hues = np.sort(sample_palettes(params, 10)[..., 0] * 360, axis=-1)
+    np.testing.assert_allclose(hues, np.tile(np.arange(5) * 72.0, (10, 1)), atol=1e-9)
@@ -0,0 +1,277 @@
+"""
+MS Color Generator - 合成エンジンの一致テスト
+
+小さな合成用レイヤーセットで、各合成エンジンの結果を元の multiply_rgba による
+順次乗算（replace_color → multiply_rgba のループ）と、正確な積と比較する。
+縮小レベルでは、そのレベルのスタックから作ったレイヤー画像を同じく比較に使う。
+
+許容誤差:
+    sequential: 元の順次乗算と完全に一致
+    fixed: 元の順次乗算と完全に一致（各乗算を同じく切り捨てる）
+    factorized: 近似エンジン（allow_approximate が False の間は使わず fixed で合成）
+        正確な積（float64）の丸めと ±1
+        元の順次乗算とは、各ピクセル・チャンネルで値を255未満にするレイヤー数 + 1 まで
+        （元の順次乗算はレイヤーごとに切り捨てるため、1回の乗算ごとに1未満ずつ暗くなる）
+    signature: 元の順次乗算と完全に一致（クラスが多すぎて使わない場合もfixedで一致）
+    閉形式の上限: 1グループ255レイヤーでも正確な積と一致し、256レイヤーは使わない（ValueError）
+        signature はレイヤー数の上限なく順次乗算と一致
+    タイル合成: 同じエンジンのフルフレーム合成と完全に一致
+    差分合成・バッチ合成: 同じエンジンの通常の合成と完全に一致（signatureの差分合成は元の順次乗算と一致）
+"""
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import layer_sets
+from config import COMPOSITE_SETTINGS, LAYER_SET_SETTINGS, CONFIG_FILE, IMAGE_SETTINGS, MAX_LAYERS, TARGET_COLOR
+from layer_manager import (
+    LayerColorizer, FactorizedCompositor, SignatureCompositor, TiledCompositor, MAX_COVERAGE_LAYERS,
+)
+from layer_stack import LayerStack
+
+GROUPING = "1,3,5:#c08040\n2,6,9:#4080c0\n4,7,8:#80c040\n"
+GROUP_LAYERS = [[1, 3, 5], [2, 6, 9], [4, 7, 8]]
+PALETTES = [
+    ["#c08040", "#4080c0", "#80c040"],
+    ["#ffffff", "#000000", "#ff00ff"],
+    ["#123456", "#fedcba", "#7f7f7f"],
+    ["#01ff80", "#808080", "#fe0102"],
+]
+
+
+@pytest.fixture
+def images(layer_images):
+    """合成用のレイヤー画像（8枚）"""
+    return layer_images(8, height=40, width=48, seed=3)
+
+
+@pytest.fixture
+def colorizer(tmp_path, monkeypatch, images, layer_files):
+    """一時フォルダのレイヤーセット（8レイヤー + 読み込めないレイヤー1枚）を読み込んだLayerColorizer"""
+    layer_files(images)
+    (tmp_path / "layer9.png").write_bytes(b"not a png")
+    (tmp_path / CONFIG_FILE).write_text(GROUPING, encoding=IMAGE_SETTINGS["file_encoding"])
+
+    monkeypatch.setattr(layer_sets, "LAYER_DIR", str(tmp_path))
+    monkeypatch.setitem(LAYER_SET_SETTINGS, "discover_siblings", False)
+    monkeypatch.setitem(LAYER_SET_SETTINGS, "background_decode", False)
+    monkeypatch.setitem(COMPOSITE_SETTINGS, "use_disk_cache", False)
+    monkeypatch.setitem(COMPOSITE_SETTINGS, "tiled", False)
+    monkeypatch.setitem(COMPOSITE_SETTINGS, "signature_max_class_ratio", 1.0)
+    monkeypatch.setitem(COMPOSITE_SETTINGS, "allow_approximate", True)
+    colorizer = LayerColorizer()
+    assert colorizer.num_layers == 9 and not colorizer.layer_stack.valid[8]
+    return colorizer
+
+
+def _rgb(color):
+    """#rrggbb → (r, g, b)"""
+    return tuple(int(color[i:i + 2], 16) for i in (1, 3, 5))
+
+
+def _layer_colors(palette):
+    """グループ順の配色を各レイヤー（layer1〜layer9）の色に展開"""
+    colors = {layer: color for color, layers in zip(palette, GROUP_LAYERS) for layer in layers}
+    return [colors[i + 1] for i in range(len(colors))]
+
+
+def _levels(colorizer, images):
+    """各解像度レベルと、そのレベルのレイヤー画像（縮小レベルはスタックから作成）"""
+    for level, stack in sorted(colorizer.layer_stack.levels.items()):
+        if level > 1:
+            images = [Image.fromarray(stack.colored_layer(i, TARGET_COLOR), "RGBA")
+                      for i in np.flatnonzero(stack.valid)]
+        yield level, images
+
+
+def _compose(colorizer, engine, palette, level=1):
+    """指定エンジンで配色を合成した (H, W, 4) int 配列"""
+    colorizer.composite_engine = engine
+    return np.asarray(colorizer.compose_layers_with_colors(palette, level=level)).astype(int)
+
+
+def _legacy_compose(images, palette):
+    """元の順次乗算（replace_color → multiply_rgba のループ）。読み込めない layer9 は含まない"""
+    base = None
+    for img, color in zip(images, _layer_colors(palette)):
+        colored = LayerColorizer.replace_color(img, _rgb(color))
+        base = colored if base is None else LayerColorizer.multiply_rgba(base, colored)
+    return np.asarray(base).astype(int)
+
+
+def _multipliers(images, palette):
+    """各レイヤーの乗数（マゼンタ領域は指定色、それ以外は陰影） (N, H, W, 3) uint8"""
+    data = np.stack([np.asarray(img)[..., :3] for img in images])
+    masks = (data == TARGET_COLOR).all(axis=-1)
+    rgbs = np.array([_rgb(color) for color in _layer_colors(palette)[:len(images)]], dtype=np.uint8)
+    return np.where(masks[..., None], rgbs[:, None, None], data)
+
+
+def _exact_product(images, palette):
+    """正確な積（float64）を丸めたRGB (H, W, 3)"""
+    product = np.prod(_multipliers(images, palette) / 255.0, axis=0)
+    return np.rint(product * 255.0).astype(int)
+
+
+@pytest.mark.parametrize("engine", ["sequential", "fixed", "signature"])
+def test_sequential_engines_match_legacy_loop(colorizer, images, engine):
+    for level, level_images in _levels(colorizer, images):
+        assert colorizer.signature_compositor_for(level).enabled
+        for palette in PALETTES:
+            np.testing.assert_array_equal(_compose(colorizer, engine, palette, level),
+                                          _legacy_compose(level_images, palette))
+
+
+def test_factorized_matches_exact_product(colorizer, images):
+    for level, level_images in _levels(colorizer, images):
+        for palette in PALETTES:
+            result = _compose(colorizer, "factorized", palette, level)
+            assert np.abs(result[..., :3] - _exact_product(level_images, palette)).max() <= 1
+            np.testing.assert_array_equal(result[..., 3], _legacy_compose(level_images, palette)[..., 3])
+
+
+def test_factorized_stays_within_truncation_bound_of_legacy_loop(colorizer, images):
+    for level, level_images in _levels(colorizer, images):
+        for palette in PALETTES:
+            result = _compose(colorizer, "factorized", palette, level)
+            legacy = _legacy_compose(level_images, palette)
+            darkening = (_multipliers(level_images, palette) < 255).sum(axis=0)
+
+            difference = result[..., :3] - legacy[..., :3]
+            # 元の順次乗算は切り捨てのため、閉形式より暗くなる方向にだけずれる
+            assert difference.min() >= -1
+            assert (difference <= darkening + 1).all()
+
+
+def test_approximate_engines_are_not_used_unless_allowed(colorizer, monkeypatch, images):
+    monkeypatch.setitem(COMPOSITE_SETTINGS, "allow_approximate", False)
+    colorizer.composite_engine = "factorized"
+    assert colorizer.active_engine == "fixed"
+    for level, level_images in _levels(colorizer, images):
+        for palette in PALETTES:
+            np.testing.assert_array_equal(_compose(colorizer, "factorized", palette, level),
+                                          _legacy_compose(level_images, palette))
+
+
+def test_signature_falls_back_to_fixed_point_with_too_many_classes(monkeypatch, colorizer, images):
+    monkeypatch.setitem(COMPOSITE_SETTINGS, "signature_max_class_ratio", 0.0)
+    fallback = LayerColorizer()
+    assert not fallback.signature_compositor_for(1).enabled
+    for palette in PALETTES:
+        np.testing.assert_array_equal(_compose(fallback, "signature", palette), _legacy_compose(images, palette))
+
+
+@pytest.mark.parametrize("engine", ["sequential", "fixed", "factorized", "signature"])
+@pytest.mark.parametrize("tile_size", [7, 16, 1000])
+def test_tiled_matches_full_frame(colorizer, monkeypatch, engine, tile_size):
+    levels = sorted(colorizer.layer_stack.levels)
+    full = {(level, k): _compose(colorizer, engine, palette, level)
+            for level in levels for k, palette in enumerate(PALETTES)}
+
+    monkeypatch.setitem(COMPOSITE_SETTINGS, "tiled", True)
+    monkeypatch.setitem(COMPOSITE_SETTINGS, "tile_size", tile_size)
+    tiled = LayerColorizer()
+    for (level, k), expected in full.items():
+        np.testing.assert_array_equal(_compose(tiled, engine, PALETTES[k], level), expected)
+
+
+def test_incremental_single_group_change_matches_full_recompose(colorizer):
+    compositor = FactorizedCompositor(colorizer.layer_stack)
+    groups = colorizer.layers
+    base = _layer_colors(PALETTES[0])
+    compositor.compose_incremental(base, groups)
+
+    for k, color in enumerate(["#102030", "#ffffff", "#e0a000"]):
+        palette = list(PALETTES[0])
+        palette[k] = color
+        layer_colors = _layer_colors(palette)
+        incremental = compositor.compose_incremental(layer_colors, groups)
+        np.testing.assert_array_equal(incremental, compositor.compose(layer_colors, groups))
+        # 元の色に戻しても全体の再合成と一致する
+        np.testing.assert_array_equal(compositor.compose_incremental(base, groups), compositor.compose(base, groups))
+
+
+def test_signature_incremental_matches_legacy_loop(colorizer, images):
+    compositor = SignatureCompositor(colorizer.layer_stack, max_class_ratio=1.0)
+    groups = colorizer.layers
+    compositor.compose_incremental(_layer_colors(PALETTES[0]), groups)
+
+    # 1グループずつ変える（差分合成）、全グループを変える（全体の再合成）、元に戻す
+    for palette in [["#102030"] + PALETTES[0][1:], PALETTES[1], PALETTES[1][:2] + ["#e0a000"], PALETTES[0]]:
+        incremental = compositor.compose_incremental(_layer_colors(palette), groups)
+        np.testing.assert_array_equal(incremental, _legacy_compose(images, palette))
+
+
+def test_colorizer_incremental_recompose_after_group_color_change(colorizer):
+    assert colorizer.active_engine == "signature"
+    colorizer.compose_layers()
+    colorizer.group_colors["GROUP2"] = "#204060"
+    incremental = np.asarray(colorizer.compose_layers())
+
+    layer_colors = [colorizer.get_layer_color(i) for i in range(colorizer.num_layers)]
+    np.testing.assert_array_equal(incremental, colorizer._compose_sequential(layer_colors, colorizer.layer_stack))
+
+
+@pytest.mark.parametrize("engine", ["sequential", "fixed", "factorized", "signature"])
+def test_compose_batch_matches_single_compose(colorizer, engine):
+    # 合成結果キャッシュを共有しない別のインスタンスで1パターンずつ合成する
+    single = LayerColorizer()
+    colorizer.composite_engine = engine
+    for level in sorted(colorizer.layer_stack.levels):
+        # 先頭のパターンはキャッシュ済み、残りはまとめて合成される
+        cached = colorizer.compose_layers_with_colors(PALETTES[0], level=level)
+        images = colorizer.compose_batch(PALETTES, level=level)
+        assert len(images) == len(PALETTES) and images[0] is cached
+        for palette, img in zip(PALETTES, images):
+            np.testing.assert_array_equal(np.asarray(img).astype(int), _compose(single, engine, palette, level))
+
+
+def test_default_engine_composes_batches_without_per_pattern_fallback(colorizer, monkeypatch, images):
+    def per_pattern(*args, **kwargs):
+        raise AssertionError("パターンごとに合成された")
+
+    monkeypatch.setattr(colorizer, "_render_from_stack", per_pattern)
+    assert colorizer.active_engine == "signature"
+    for palette, img in zip(PALETTES, colorizer.compose_batch(PALETTES)):
+        np.testing.assert_array_equal(np.asarray(img).astype(int), _legacy_compose(images, palette))
+
+
+def _uniform_stack(num_layers: int) -> LayerStack:
+    """全レイヤーが全ピクセルをマゼンタで覆うスタック（1グループなら指数 = レイヤー数）"""
+    shape = (num_layers, 4, 5)
+    return LayerStack([f"layer{i + 1}.png" for i in range(num_layers)], np.ones(shape, dtype=bool),
+                      np.full(shape + (3,), 255, dtype=np.uint8), np.full(shape, 255, dtype=np.uint8),
+                      np.ones(num_layers, dtype=bool))
+
+
+def test_max_layers_fits_coverage_count():
+    assert MAX_LAYERS <= MAX_COVERAGE_LAYERS
+
+
+def test_closed_form_engines_at_max_coverage_layers():
+    stack = _uniform_stack(MAX_COVERAGE_LAYERS)
+    layer_colors = ["#fefdfc"] * stack.num_layers
+    groups = ["GROUP1"] * stack.num_layers
+    exact = np.rint(255.0 * (np.array([254, 253, 252]) / 255.0) ** stack.num_layers)
+
+    results = [
+        FactorizedCompositor(stack).compose(layer_colors, groups),
+        TiledCompositor(stack, 3).compose(layer_colors, groups, "factorized"),
+    ]
+    for result in results:
+        np.testing.assert_array_equal(result[..., :3], np.broadcast_to(exact, (4, 5, 3)))
+
+
+def test_closed_form_engines_refuse_more_layers_than_coverage_count():
+    stack = _uniform_stack(MAX_COVERAGE_LAYERS + 1)
+    layer_colors = ["#fefdfc"] * stack.num_layers
+    groups = ["GROUP1"] * stack.num_layers
+    with pytest.raises(ValueError):
+        FactorizedCompositor(stack)
+    with pytest.raises(ValueError):
+        TiledCompositor(stack, 3).compose(layer_colors, groups, "factorized")
+    # 順次乗算と画素クラス合成は上限なく合成でき、結果も一致する
+    sequential = TiledCompositor(stack, 3).compose(layer_colors, groups, "sequential")
+    np.testing.assert_array_equal(SignatureCompositor(stack, max_class_ratio=1.0).compose(layer_colors, groups),
+                                  sequential)
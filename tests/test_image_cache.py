@@ -0,0 +1,94 @@
+"""
+MS Color Generator - 合成結果キャッシュと出力バッファプールのテスト
+"""
+
+import threading
+
+import numpy as np
+
+from image_cache import CompositeCache, OutputBufferPool
+
+
+def _composite(pool: OutputBufferPool, value: int):
+    """プールのバッファに書き込んで包んだ画像"""
+    buffer = pool.acquire(4, 5)
+    buffer[...] = value
+    return pool.wrap(buffer)
+
+
+def test_buffer_is_reused_after_every_image_is_dropped():
+    pool = OutputBufferPool(4)
+    buffer = pool.acquire(4, 5)
+    address = buffer.ctypes.data
+    img = pool.wrap(buffer)
+    del buffer
+    assert pool.acquire(4, 5).ctypes.data != address
+
+    del img
+    assert pool.acquire(4, 5).ctypes.data == address
+    assert pool.reuses >= 1
+
+
+def test_buffer_is_not_reused_while_an_image_references_it():
+    pool = OutputBufferPool(4)
+    shown = _composite(pool, 10)
+    other = _composite(pool, 20)
+
+    assert pool.reuses == 0
+    assert np.asarray(shown)[0, 0, 0] == 10
+    assert np.asarray(other)[0, 0, 0] == 20
+    assert pool.stats["in_use"] == 2
+
+
+def test_evicted_image_keeps_its_pixels_while_still_displayed():
+    # キャッシュから破棄された画像を表示側がまだ持っている場合、次の合成で上書きしない
+    pool = OutputBufferPool(4)
+    cache = CompositeCache(budget_bytes=4 * 5 * 4)
+    shown = _composite(pool, 10)
+    cache.put("shown", shown)
+    cache.put("next", _composite(pool, 20))
+    assert cache.get("shown") is None
+
+    _composite(pool, 30)
+    assert (np.asarray(shown) == 10).all()
+
+
+def test_pool_size_limits_tracked_buffers():
+    pool = OutputBufferPool(1)
+    images = [_composite(pool, value) for value in range(3)]
+    assert pool.stats["buffers"] == 1
+    assert [int(np.asarray(img)[0, 0, 0]) for img in images] == [0, 1, 2]
+
+
+def test_disabled_pool_always_allocates():
+    pool = OutputBufferPool(4, enabled=False)
+    _composite(pool, 1)
+    _composite(pool, 2)
+    assert pool.reuses == 0
+    assert pool.allocations == 2
+
+
+def test_composite_cache_accounts_bytes_under_concurrent_use():
+    pool = OutputBufferPool(0)
+    cache = CompositeCache(budget_bytes=4 * 5 * 4 * 8)
+    errors = []
+
+    def worker(seed: int):
+        rng = np.random.default_rng(seed)
+        try:
+            for _ in range(200):
+                key = int(rng.integers(0, 32))
+                if cache.get(key) is None:
+                    cache.put(key, _composite(pool, key))
+        except Exception as e:  # pragma: no cover - 失敗時の報告用
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert cache.used_bytes == len(cache) * 4 * 5 * 4
+    assert cache.used_bytes <= cache.budget_bytes
@@ -0,0 +1,150 @@
+"""
+MS Color Generator - レイヤースタック（ディスクキャッシュ・圧縮したマスクと陰影・外接矩形）のテスト
+"""
+
+import os
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+import layer_stack
+from layer_sets import LayerSet
+from layer_stack import LayerStack, PackedMasks, LayerShading
+
+
+def _build_cached(files, cache_dir):
+    """ディスクキャッシュを使ってスタックを構築（呼び出し元のスレッドでデコード）"""
+    decoded = []
+
+    def load(index):
+        decoded.append(index)
+        return Image.open(files[index]).convert("RGBA")
+
+    stack = LayerStack.from_files_cached(files, cache_dir, load, [2])
+    stack.wait_finished()
+    return stack, decoded
+
+
+def test_cache_is_reused_when_files_are_unchanged(tmp_path, layer_images, layer_files):
+    files = layer_files(layer_images(4))
+    cache_dir = os.path.join(str(tmp_path), "cache")
+
+    first, decoded = _build_cached(files, cache_dir)
+    assert decoded == [0, 1, 2, 3]
+
+    second, decoded = _build_cached(files, cache_dir)
+    assert decoded == []
+    np.testing.assert_array_equal(np.asarray(second.masks), np.asarray(first.masks))
+    np.testing.assert_array_equal(np.asarray(second.shading), np.asarray(first.shading))
+
+
+def test_cache_is_rebuilt_when_target_color_changes(tmp_path, monkeypatch, layer_images, layer_files):
+    images = layer_images(3)
+    files = layer_files(images)
+    cache_dir = os.path.join(str(tmp_path), "cache")
+    first, _ = _build_cached(files, cache_dir)
+    assert np.asarray(first.masks).any()
+
+    # 陰影の色をターゲット色にすると、マスクはその色の領域になる
+    target = tuple(int(c) for c in np.asarray(images[1])[0, 0, :3])
+    monkeypatch.setattr(layer_stack, "TARGET_COLOR", target)
+    second, decoded = _build_cached(files, cache_dir)
+
+    assert decoded == [0, 1, 2]
+    expected = np.stack([np.all(np.asarray(img)[..., :3] == target, axis=-1) for img in images])
+    np.testing.assert_array_equal(np.asarray(second.masks), expected)
+
+
+def _peak_bytes(func):
+    """func() の実行中に確保されたメモリのピーク（バイト）と戻り値"""
+    tracemalloc.start()
+    try:
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak, result
+
+
+def test_packed_mask_tile_copies_only_the_tile():
+    # 64レイヤー x 1024^2 のマスク（ビットで 8 MB）から 128^2 のタイルを取り出す
+    num_layers, size = 64, 1024
+    bits = np.random.default_rng(0).integers(0, 256, (num_layers, size, size // 8), dtype=np.uint8)
+    masks = PackedMasks(bits, size)
+    layers, rows, cols = list(range(num_layers)), slice(256, 384), slice(512, 640)
+
+    peak, tile = _peak_bytes(lambda: masks[layers, rows, cols])
+    expected = np.unpackbits(bits[:, rows, 64:80], axis=-1, bitorder="little").view(bool)
+    np.testing.assert_array_equal(tile, expected)
+    # タイル分（1 MB）の展開だけで、各レイヤーのフレーム全体はコピーしない
+    assert peak < 2 * tile.nbytes
+
+
+def test_shading_tile_copies_only_the_tile():
+    # 32レイヤー x 512^2 のグレースケール陰影（8 MB、3チャンネルでは 24 MB）から 128^2 のタイルを取り出す
+    num_layers, size = 32, 512
+    gray = np.random.default_rng(1).integers(0, 256, (num_layers, size, size), dtype=np.uint8)
+    shading = LayerShading(gray)
+    layers, rows, cols = list(range(num_layers)), slice(128, 256), slice(256, 384)
+
+    peak, tile = _peak_bytes(lambda: shading[layers, rows, cols])
+    np.testing.assert_array_equal(tile, np.repeat(gray[:, rows, cols, None], 3, axis=-1))
+    assert peak < 2 * tile.nbytes
+
+
+def test_tile_active_pixels_are_cached_tile_parts_of_active_pixels():
+    rng = np.random.default_rng(2)
+    num_layers, height, width = 3, 20, 30
+    masks = rng.random((num_layers, height, width)) < 0.2
+    shading = np.where(rng.random((num_layers, height, width, 1)) < 0.3,
+                       rng.integers(0, 256, (num_layers, height, width, 3)), 255).astype(np.uint8)
+    shading[masks] = 255
+    stack = LayerStack([f"layer{i + 1}.png" for i in range(num_layers)], masks, shading,
+                       np.full((num_layers, height, width), 255, dtype=np.uint8), np.ones(num_layers, dtype=bool))
+    rows, cols = slice(7, 14), slice(21, 30)
+    tile = np.zeros((height, width), dtype=bool)
+    tile[rows, cols] = True
+
+    for i in range(num_layers):
+        indices, active, positions = stack.active_pixels(i)
+        inside = tile.reshape(-1)[indices]
+        tile_indices, tile_active, tile_positions = stack.tile_active_pixels(i, rows, cols)
+        np.testing.assert_array_equal(np.flatnonzero(tile.reshape(-1))[tile_indices], indices[inside])
+        np.testing.assert_array_equal(tile_active, active[inside])
+        np.testing.assert_array_equal(tile_positions, np.flatnonzero(np.isin(np.flatnonzero(inside), positions)))
+        # 2回目以降は計算し直さない
+        assert stack.tile_active_pixels(i, rows, cols)[0] is tile_indices
+
+    product = stack.tile_shading_product(rows, cols)
+    np.testing.assert_array_equal(product, stack.shading_product(rows, cols))
+    assert stack.tile_shading_product(rows, cols) is product
+
+
+def test_mask_bboxes_select_the_tiles_that_touch_a_mask():
+    masks = np.zeros((2, 20, 30), dtype=bool)
+    masks[0, 3:6, 22:25] = True
+    shading = np.full((2, 20, 30, 3), 255, dtype=np.uint8)
+    shading[0, 15, 2] = 100
+    stack = LayerStack(["layer1.png", "layer2.png"], masks, shading,
+                       np.full((2, 20, 30), 255, dtype=np.uint8), np.ones(2, dtype=bool))
+
+    np.testing.assert_array_equal(stack.mask_bboxes, [[22, 3, 25, 6], [0, 0, 0, 0]])
+    assert stack.mask_overlaps(0, slice(0, 10), slice(20, 30))
+    assert not stack.mask_overlaps(0, slice(0, 10), slice(0, 22))
+    assert not stack.mask_overlaps(1, slice(0, 20), slice(0, 30))
+
+    # 外接矩形の外のタイルでも陰影のあるピクセルは拾う
+    indices, active, positions = stack.tile_active_pixels(0, slice(10, 20), slice(0, 10))
+    np.testing.assert_array_equal(indices, [5 * 10 + 2])
+    np.testing.assert_array_equal(active, [[100, 100, 100, 255]])
+    assert positions.size == 0
+
+
+def test_layer_set_uses_bundled_bboxes():
+    masks = np.zeros((1, 4, 5), dtype=bool)
+    stack = LayerStack(["layer1.png"], masks, np.full((1, 4, 5, 3), 255, dtype=np.uint8),
+                       np.full((1, 4, 5), 255, dtype=np.uint8), np.ones(1, dtype=bool))
+    bboxes = np.array([[1, 2, 3, 4]], dtype=np.int32)
+    LayerSet("bundle", ".", stack.files, stack, "grouping.txt", package_info={"bboxes": bboxes})
+    np.testing.assert_array_equal(stack.mask_bboxes, bboxes)
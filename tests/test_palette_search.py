@@ -0,0 +1,128 @@
+"""
+MS Color Generator - ベスト配色探索（採点指標・時間予算）のテスト
+"""
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import palette_search
+from config import PALETTE_SEARCH_SETTINGS
+from models import ColorGenerationParams
+from palette_search import (
+    PaletteSearch, value_contrast, hue_spread, harmony_deviation, palette_metrics, combine_scores,
+)
+
+TEMPLATES = PALETTE_SEARCH_SETTINGS["harmony_templates"]
+
+
+def _hsv(hues_deg, saturations=None):
+    """色相（度）の配色1つを (1, C, 3) のHSV配列にする（彩度・明度は1）"""
+    hues = np.asarray(hues_deg, dtype=np.float64) / 360.0
+    sats = np.ones_like(hues) if saturations is None else np.asarray(saturations, dtype=np.float64)
+    return np.stack([hues, sats, np.ones_like(hues)], axis=-1)[None]
+
+
+def test_value_contrast_is_mean_lightness_difference():
+    lab = np.zeros((1, 3, 3))
+    lab[0, :, 0] = [0, 50, 100]
+    assert value_contrast(lab) == pytest.approx([200 / 3])
+
+
+def test_hue_spread_is_minimum_circular_distance():
+    assert hue_spread(_hsv([0, 90, 324])) == pytest.approx([36])
+    assert hue_spread(_hsv([10, 130, 250])) == pytest.approx([120])
+
+
+@pytest.mark.parametrize("hues", [
+    [10, 60, 150],              # T型の半円に収まる
+    [350, 80, 170],             # 0度をまたいで半円に収まる
+    [0, 40, 180, 220],          # X型の向かい合う扇形に収まる
+    [200, 200, 200],
+])
+def test_harmony_deviation_is_zero_inside_a_template(hues):
+    assert harmony_deviation(_hsv(hues), TEMPLATES) == pytest.approx([0], abs=1e-9)
+
+
+def test_harmony_deviation_of_evenly_spaced_triad():
+    # 半円は3色のうち2色しか覆えず、残りの1色が60度はみ出す（重みは1/3）
+    assert harmony_deviation(_hsv([0, 120, 240]), {"T": [(0, 180)]}) == pytest.approx([20])
+
+
+def test_harmony_deviation_ignores_achromatic_colors():
+    assert harmony_deviation(_hsv([0, 120, 240], [1, 1, 0]), {"T": [(0, 180)]}) == pytest.approx([0], abs=1e-9)
+
+
+def test_palette_metrics_of_a_single_color_are_zero():
+    np.testing.assert_array_equal(palette_metrics(_hsv([30]), TEMPLATES), [[0, 0, 0]])
+
+
+def test_combine_scores_normalizes_each_metric():
+    metrics = np.array([[0.0, 0.0, 5.0], [1.0, 2.0, 5.0], [0.5, 1.0, 5.0]])
+    weights = {"value_contrast": 1.0, "hue_spread": 2.0, "harmony": 1.0}
+    # 全候補で同じ値の指標（harmony）は0として扱う
+    np.testing.assert_allclose(combine_scores(metrics, weights), [0.0, 3.0, 1.5])
+
+
+class _FakeClock:
+    """候補の生成・採点ごとに候補数に応じて進む時計（大きな一括生成ほど候補あたりの時間が長い）"""
+
+    def __init__(self, seconds_per_candidate: float):
+        self.now = 0.0
+        self.seconds_per_candidate = seconds_per_candidate
+
+    def perf_counter(self) -> float:
+        return self.now
+
+    def advance(self, size: int):
+        self.now += size * self.seconds_per_candidate * (1 + size / 4096)
+
+
+@pytest.fixture
+def fake_clock(monkeypatch):
+    """palette_search の時計を候補数で進む時計に置き換える"""
+    def install(seconds_per_candidate: float) -> _FakeClock:
+        clock = _FakeClock(seconds_per_candidate)
+        sample = palette_search.sample_palettes
+
+        def timed_sample(params, size):
+            clock.advance(size)
+            return sample(params, size)
+
+        monkeypatch.setattr(palette_search, "time", SimpleNamespace(perf_counter=clock.perf_counter))
+        monkeypatch.setattr(palette_search, "sample_palettes", timed_sample)
+        return clock
+    return install
+
+
+@pytest.mark.parametrize("seconds_per_candidate", [5e-6, 2e-5, 1e-4, 2e-3])
+def test_search_stays_within_time_budget(fake_clock, seconds_per_candidate):
+    fake_clock(seconds_per_candidate)
+    settings = PALETTE_SEARCH_SETTINGS
+    search = PaletteSearch()
+    params = ColorGenerationParams(color_count=4, min_hue_distance=20, best_of_n=True)
+
+    for _ in range(3):
+        palettes = search.search(params, 4, score_count=3)
+        assert len(palettes) == 4 and all(len(p) == 4 for p in palettes)
+        assert search.last_stats["elapsed_ms"] <= settings["time_budget_ms"] - settings["finish_reserve_ms"]
+        assert search.last_stats["candidates"] <= settings["max_candidates"]
+
+
+def test_search_uses_most_of_the_budget_once_rate_is_known(fake_clock):
+    fake_clock(2e-5)
+    search = PaletteSearch()
+    params = ColorGenerationParams(color_count=4, min_hue_distance=20, best_of_n=True)
+    search.search(params, 4)
+    search.search(params, 4)
+    assert search.last_stats["candidates"] > PALETTE_SEARCH_SETTINGS["max_batch"]
+
+
+def test_first_search_always_scores_at_least_one_batch(fake_clock):
+    # 予算より遅い環境でも最初の少数の候補だけは採点する
+    fake_clock(1.0)
+    search = PaletteSearch()
+    palettes = search.search(ColorGenerationParams(color_count=3, best_of_n=True), 2)
+    assert len(palettes) == 2
+    assert search.last_stats["candidates"] == PALETTE_SEARCH_SETTINGS["probe_batch"]
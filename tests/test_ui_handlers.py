@@ -0,0 +1,54 @@
+"""
+MS Color Generator - ギャラリー選択のテスト
+"""
+
+from types import SimpleNamespace
+
+from PIL import Image
+
+from ui_handlers import UIHandlers
+from ui_state import UIState
+
+
+def _colorizer(full_image):
+    """on_gallery_selectが使う属性だけを持つLayerColorizerの代わり（compose_layersはフル解像度の画像を返す）"""
+    colorizer = SimpleNamespace(
+        layers=["GROUP1", "GROUP2"],
+        group_colors={"GROUP1": "#000000", "GROUP2": "#000000"},
+        picker_count=3,
+        current_composite=None,
+        get_sorted_group_data=lambda layers: [(group, [i]) for i, group in enumerate(layers)],
+    )
+    colorizer.compose_layers = lambda: full_image
+    return colorizer
+
+
+def _state(compositions):
+    """ギャラリーに縮小画像を1つ表示している状態"""
+    state = UIState()
+    state.current_main_image = Image.new("RGBA", (40, 30))
+    state.pattern_images = [Image.new("RGBA", (20, 15))]
+    state.pattern_compositions = compositions
+    state.used_groups_list = ["GROUP1", "GROUP2"] if compositions else []
+    return state
+
+
+def test_gallery_select_recomposes_main_image_at_full_resolution():
+    full = Image.new("RGBA", (40, 30), "#ff8000")
+    colorizer = _colorizer(full)
+    state = _state([["#ff8000", "#0080ff"]])
+
+    updates = UIHandlers(colorizer, state).on_gallery_select(SimpleNamespace(index=0))
+
+    assert updates[0] is full and state.current_main_image is full
+    assert colorizer.group_colors == {"GROUP1": "#ff8000", "GROUP2": "#0080ff"}
+
+
+def test_gallery_select_without_colors_keeps_main_image():
+    state = _state([])
+    main = state.current_main_image
+
+    updates = UIHandlers(_colorizer(None), state).on_gallery_select(SimpleNamespace(index=0))
+
+    assert state.current_main_image is main
+    assert updates[0] is not state.pattern_images[0]
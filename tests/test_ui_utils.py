@@ -0,0 +1,33 @@
+"""
+MS Color Generator - カラーピッカー更新のテスト
+"""
+
+from types import SimpleNamespace
+
+from config import DEFAULT_GROUP_COLOR
+from ui_utils import update_pickers_only
+
+
+def _colorizer(group_colors):
+    """update_pickers_onlyが使う属性だけを持つLayerColorizerの代わり"""
+    groups = list(group_colors)
+    return SimpleNamespace(
+        layers=groups,
+        group_colors=group_colors,
+        picker_count=len(groups) + 1,
+        get_sorted_group_data=lambda layers: [(group, [i]) for i, group in enumerate(layers)],
+    )
+
+
+def test_invalid_color_only_affects_its_own_picker():
+    # "#-1ffff" は int(..., 16) では解釈できるが、カラーコードとしては無効
+    colorizer = _colorizer({"GROUP1": "#ff8000", "GROUP2": "#-1ffff", "GROUP3": "rgb(0, 128, 255)"})
+    updates = update_pickers_only(colorizer)
+
+    assert len(updates) == 4
+    assert updates[0]["value"] == "#ff8000"
+    assert updates[0]["label"].startswith("#ff8000 (H:30")
+    assert updates[1]["value"] == DEFAULT_GROUP_COLOR
+    assert updates[1]["label"] == "GROUP2 (エラー)"
+    assert updates[2]["value"] == "#0080ff"
+    assert updates[3]["visible"] is False
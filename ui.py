@@ -4,7 +4,6 @@ MS Color Generator - UI関連（Color Extractor統合版・完全修正版）
 
 import os
 from typing import List, Union, Dict, Any
-import colorsys
 from collections import Counter
 
 import gradio as gr
@@ -15,7 +14,9 @@ from config import (
     VERSION, DEFAULT_GROUP_COLOR, LAYER_DIR, UI_LAYOUT, 
     SLIDER_CONFIGS, UI_CHOICES, get_slider_config, IS_HUGGING_FACE_SPACES
 )
+import color_convert
 from layer_manager import LayerColorizer
+from startup_timing import startup_timer
 from ui_state import UIState
 from ui_handlers import UIHandlers
 from ui_generators import PatternGenerator
@@ -70,23 +71,18 @@ class ColorExtractor:
                             saturation_min: float = 30.0) -> List[tuple]:
         """色相補完色を検索"""
         complement_colors = []
+        complement_hues = []
         
         # ベース色の色相を取得（グレースケール除外）
-        base_hues = []
-        for rgb in base_colors:
-            h, s, v = ColorUtils.rgb_to_hsv(rgb)
-            if s >= saturation_min:
-                base_hues.append(h)
+        base_hues = [h for h, s, v in ColorUtils.rgb_to_hsv_array(base_colors).tolist() if s >= saturation_min]
         
         print(f"🔍 ベース色相: {[f'{h:.0f}°' for h in base_hues]} (彩度{saturation_min}%以上)")
         
-        # 拡張色から重要な色相を検索
-        for rgb in extended_colors:
+        # 拡張色から重要な色相を検索（HSVはまとめて変換）
+        for rgb, (h, s, v) in zip(extended_colors, ColorUtils.rgb_to_hsv_array(extended_colors).tolist()):
             if rgb in base_colors:
                 continue
             
-            h, s, v = ColorUtils.rgb_to_hsv(rgb)
-            
             # 彩度と明度の条件チェック
             if s < saturation_min or v < 20:
                 continue
@@ -99,18 +95,17 @@ class ColorExtractor:
                     is_different_hue = False
                     break
             
-            # 既に追加された補完色との重複チェック
+            # 既に追加された補完色との重複チェック（補完色は彩度条件を満たしている）
             if is_different_hue:
-                for comp_rgb in complement_colors:
-                    comp_h, comp_s, comp_v = ColorUtils.rgb_to_hsv(comp_rgb)
-                    if comp_s >= saturation_min:
-                        hue_diff = self._calculate_hue_difference(h, comp_h)
-                        if hue_diff < hue_threshold:
-                            is_different_hue = False
-                            break
+                for comp_h in complement_hues:
+                    hue_diff = self._calculate_hue_difference(h, comp_h)
+                    if hue_diff < hue_threshold:
+                        is_different_hue = False
+                        break
             
             if is_different_hue:
                 complement_colors.append(rgb)
+                complement_hues.append(h)
                 base_hues.append(h)
                 color_name = ColorUtils.get_color_name(rgb)
                 print(f"  ➕ 補完色発見: {color_name} (色相{h:.0f}°, 彩度{s:.0f}%, 明度{v:.0f}%)")
@@ -187,9 +182,14 @@ class ColorUtils:
     @staticmethod
     def rgb_to_hsv(rgb: tuple) -> tuple:
         """RGB値をHSV値に変換"""
-        r, g, b = [x / 255.0 for x in rgb]
-        h, s, v = colorsys.rgb_to_hsv(r, g, b)
-        return (h * 360, s * 100, v * 100)
+        h, s, v = ColorUtils.rgb_to_hsv_array([rgb])[0].tolist()
+        return (h, s, v)
+    
+    @staticmethod
+    def rgb_to_hsv_array(colors: List[tuple]) -> np.ndarray:
+        """RGB値のリストをまとめてHSV値 (N, 3) [色相(度), 彩度(%), 明度(%)] に変換"""
+        rgb = np.asarray(colors, dtype=np.float64).reshape(-1, 3) / 255.0
+        return color_convert.rgb_to_hsv(rgb) * np.array([360.0, 100.0, 100.0])
     
     @staticmethod
     def get_color_name(rgb: tuple) -> str:
@@ -251,7 +251,9 @@ extracted_colors = []  # 抽出された色の保存用
 
 def update_colors() -> List[Union[gr.update, list]]:
     """初期色更新処理"""
-    ui_state.set_initial_state(colorizer)
+    # 初回はデコードが終わっていないレイヤーだけを待って合成する
+    with startup_timer.phase("初期表示の合成", once=True):
+        ui_state.set_initial_state(colorizer)
     picker_updates = update_pickers_only(colorizer)
     return [ui_state.current_main_image, ui_state.pattern_images] + picker_updates
 
@@ -298,9 +300,9 @@ def extract_and_display_colors(image):
         all_colors = base_colors + complement_colors
         
         print("🔍 全色処理中...")
-        for i, rgb in enumerate(all_colors):
+        all_hsv = ColorUtils.rgb_to_hsv_array(all_colors).tolist()
+        for i, (rgb, (h, s, v)) in enumerate(zip(all_colors, all_hsv)):
             hex_color = ColorUtils.rgb_to_hex(rgb)
-            h, s, v = ColorUtils.rgb_to_hsv(rgb)
             
             color_data.append({
                 'rgb': rgb,
@@ -414,66 +416,41 @@ def apply_selected_colors_to_patterns(*checkbox_values):
         picker_updates = update_pickers_only(colorizer)
         return [gr.update(), []] + picker_updates + [0, 0, 0]
 
+def _adjust_hsv(hex_color, hue_shift=0.0, saturation_factor=1.0, brightness_factor=1.0):
+    """色相シフト・彩度/明度の倍率を適用した色を返す（不正な色は元の色）"""
+    rgb, valid = color_convert.hex_to_rgb_bytes([hex_color])
+    if not valid[0]:
+        return hex_color
+    hsv = color_convert.rgb_to_hsv(rgb / 255.0)
+    hsv[:, 0] = (hsv[:, 0] + hue_shift / 360.0) % 1.0
+    # 彩度・明度は0-1の範囲内で調整
+    hsv[:, 1:] = np.clip(hsv[:, 1:] * [saturation_factor, brightness_factor], 0.0, 1.0)
+    return color_convert.hsv_to_hex(hsv)[0]
+
+
 def adjust_color_brightness(hex_color, factor):
     """色の明度を調整"""
-    try:
-        rgb = tuple(int(hex_color[i:i+2], 16) for i in (1, 3, 5))
-        h, s, v = ColorUtils.rgb_to_hsv(rgb)
-        
-        # 明度を調整（0-100の範囲内で）
-        v = min(100, max(0, v * factor))
-        
-        # HSV to RGB
-        r, g, b = colorsys.hsv_to_rgb(h/360, s/100, v/100)
-        rgb_adjusted = (int(r*255), int(g*255), int(b*255))
-        
-        return ColorUtils.rgb_to_hex(rgb_adjusted)
-    except:
-        return hex_color
+    return _adjust_hsv(hex_color, brightness_factor=factor)
 
 
 def adjust_color_saturation(hex_color, factor):
     """色の彩度を調整"""
-    try:
-        rgb = tuple(int(hex_color[i:i+2], 16) for i in (1, 3, 5))
-        h, s, v = ColorUtils.rgb_to_hsv(rgb)
-        
-        # 彩度を調整（0-100の範囲内で）
-        s = min(100, max(0, s * factor))
-        
-        # HSV to RGB
-        r, g, b = colorsys.hsv_to_rgb(h/360, s/100, v/100)
-        rgb_adjusted = (int(r*255), int(g*255), int(b*255))
-        
-        return ColorUtils.rgb_to_hex(rgb_adjusted)
-    except:
-        return hex_color
+    return _adjust_hsv(hex_color, saturation_factor=factor)
 
 
 def shift_color_hue(hex_color, hue_shift):
     """色相をシフトした色を返す"""
-    try:
-        # HEX to RGB
-        rgb = tuple(int(hex_color[i:i+2], 16) for i in (1, 3, 5))
-        
-        # RGB to HSV
-        h, s, v = ColorUtils.rgb_to_hsv(rgb)
-        
-        # 色相をシフト
-        h = (h + hue_shift) % 360
-        
-        # HSV to RGB
-        r, g, b = colorsys.hsv_to_rgb(h/360, s/100, v/100)
-        rgb_shifted = (int(r*255), int(g*255), int(b*255))
-        
-        # RGB to HEX
-        return ColorUtils.rgb_to_hex(rgb_shifted)
-    except:
-        return hex_color  # エラー時は元の色を返す
+    return _adjust_hsv(hex_color, hue_shift=hue_shift)
 
 
 def create_ui() -> gr.Blocks:
     """Gradio UIを作成"""
+    with startup_timer.phase("UI構築"):
+        return _build_ui()
+
+
+def _build_ui() -> gr.Blocks:
+    """Gradio UIのコンポーネントとイベントを構築"""
     
     custom_css = """
     #edit-panel { 
@@ -526,7 +503,7 @@ def create_ui() -> gr.Blocks:
             return demo
         
         # メインUI構築
-        main_image, pickers, layer_group_radio, color_inherit_radio, save_btn, downloader = _create_main_ui_section()
+        main_image, pickers, layer_group_radio, color_inherit_radio, save_btn, downloader, layer_set_dropdown = _create_main_ui_section()
         pattern_gallery, backup_btn, restart_btn = _create_pattern_gallery_section()
         
         # パラメータ制御部分を横並びで配置
@@ -544,7 +521,8 @@ def create_ui() -> gr.Blocks:
         _register_events(
             main_image, pattern_gallery, layer_group_radio, color_inherit_radio,
             save_btn, backup_btn, restart_btn, pickers, 
-            parameter_controls, hsv_controls, downloader, color_extractor_components
+            parameter_controls, hsv_controls, downloader, color_extractor_components,
+            layer_set_dropdown
         )
         
         # 初期表示
@@ -576,6 +554,14 @@ def _create_main_ui_section():
             
             # 右: カラーピッカー＋レイヤー編集（configから寸法取得）
             with gr.Column(scale=layout["picker_control_scale"]):
+                # レイヤーセット選択（別のMSレイヤーセットがある場合のみ表示）
+                layer_set_dropdown = gr.Dropdown(
+                    choices=colorizer.layer_sets.names,
+                    value=colorizer.active_layer_set,
+                    label="レイヤーセット",
+                    visible=len(colorizer.layer_sets.names) > 1
+                )
+                
                 # カラーピッカー
                 gr.Markdown("### レイヤーカラー")
                 pickers = create_initial_pickers(colorizer)
@@ -604,7 +590,7 @@ def _create_main_ui_section():
                 )
                 downloader = gr.File(label="ダウンロード", visible=False)
     
-    return main_image, pickers, layer_group_radio, color_inherit_radio, save_btn, downloader
+    return main_image, pickers, layer_group_radio, color_inherit_radio, save_btn, downloader, layer_set_dropdown
 
 
 def _create_pattern_gallery_section():
@@ -764,6 +750,9 @@ def _create_parameter_controls():
                 )
                 sliders.append(min_hue_distance)
                 
+                best_of_n = gr.Checkbox(value=False, label="ベスト配色探索（多数の候補から上位を選ぶ）")
+                sliders.append(best_of_n)
+                
                 generate_btn = gr.Button(
                     "現在のパラメーターで4配色パターン生成", 
                     variant="primary", 
@@ -923,7 +912,7 @@ def _create_color_extractor_section():
 
 def _register_events(main_image, pattern_gallery, layer_group_radio, color_inherit_radio,
                     save_btn, backup_btn, restart_btn, pickers, parameter_controls, 
-                    hsv_controls, downloader, color_extractor_components):
+                    hsv_controls, downloader, color_extractor_components, layer_set_dropdown):
     """イベントを登録（重複修正版）"""
     
     # Color Extractor イベント登録（一意のapi_name指定）
@@ -985,6 +974,14 @@ def _register_events(main_image, pattern_gallery, layer_group_radio, color_inher
         api_name="gallery_select"  # 一意のapi_name
     )
     
+    # レイヤーセット切り替え
+    layer_set_dropdown.change(
+        fn=ui_handlers.switch_layer_set,
+        inputs=[layer_set_dropdown],
+        outputs=[main_image, pattern_gallery] + pickers + [layer_group_radio] + hsv_controls['sliders'],
+        api_name="switch_layer_set"  # 一意のapi_name
+    )
+    
     # ラジオボタン変更で即適用
     layer_group_radio.change(
         fn=ui_handlers.apply_group_change,
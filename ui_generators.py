@@ -8,13 +8,15 @@ import time
 from typing import List, Union, TYPE_CHECKING
 
 import gradio as gr
+import numpy as np
+from PIL import Image
 
 from config import (
     DEFAULT_GROUP_COLOR, HSV_VARIATION_PATTERNS, SYSTEM_SETTINGS,
     get_hsv_variation_steps, get_hsv_random_range
 )
 from models import ColorGenerationParams
-from color_utils import hex_to_hsv, hsv_to_hex, generate_four_patterns
+from color_utils import hex_to_hsv_array, hsv_array_to_hex, generate_four_patterns, feasible_hue_distance
 from ui_utils import update_pickers_only
 
 # 循環インポート回避
@@ -49,6 +51,17 @@ class PatternGenerator:
         thread.daemon = SYSTEM_SETTINGS["thread_daemon_mode"]
         thread.start()
 
+    def _compose_pattern_images(self, patterns: List[List[str]]) -> List[Image.Image]:
+        """パターンの色配列からまとめてギャラリー用の合成画像を生成（縮小解像度）
+        
+        Args:
+            patterns: パターンごとの色リスト
+            
+        Returns:
+            合成画像のリスト
+        """
+        return self.colorizer.compose_batch(patterns, level=self.colorizer.gallery_level)
+
     def _adjust_color_count(self, colors: List[str], target_count: int) -> List[str]:
         """色数をグループ数に合わせて調整
         
@@ -101,7 +114,7 @@ class PatternGenerator:
             if not self.state.used_groups_list:
                 print(f"❌ 使用中のグループがありません")
                 self.state.updating_programmatically = False
-                return [gr.update(), []] + [gr.update() for _ in range(self.colorizer.num_layers)] + [0, 0, 0]
+                return [gr.update(), []] + [gr.update() for _ in range(self.colorizer.picker_count)] + [0, 0, 0]
             
             # 色数とグループ数を一致させる
             adjusted_colors = self._adjust_color_count(selected_colors, len(self.state.used_groups_list))
@@ -114,25 +127,20 @@ class PatternGenerator:
             # 4パターン生成（既存のgenerate_four_patterns関数を使用）
             self.state.pattern_compositions = generate_four_patterns(adjusted_colors, self.state.used_groups_list)
             
-            # 4つの合成画像を生成
-            new_pattern_images = []
-            for pattern in self.state.pattern_compositions:
-                image = self.colorizer.compose_layers_with_colors(pattern)
-                new_pattern_images.append(image)
+            # 4つの合成画像をまとめて生成
+            new_pattern_images = self._compose_pattern_images(self.state.pattern_compositions)
             
             # グローバル変数を更新
             self.state.pattern_images = new_pattern_images
             
-            # 最初のパターンをメイン画像として設定
-            self.state.current_main_image = self.state.pattern_images[0]
-            
             # 最初のパターンの色を現在の色として設定
             first_pattern = self.state.pattern_compositions[0]
             for group_name, color in zip(self.state.used_groups_list, first_pattern):
                 self.colorizer.group_colors[group_name] = color
             
-            # カラーピッカーにも反映
-            self.colorizer.current_composite = self.state.current_main_image
+            # 最初のパターンをフル解像度で合成してメイン画像に設定
+            self.colorizer.current_composite = self.colorizer.compose_layers()
+            self.state.current_main_image = self.colorizer.current_composite
             
             # ベース色をリセット（新しいパターンが設定されたため）
             self.state.save_base_colors(self.colorizer)
@@ -222,7 +230,7 @@ class PatternGenerator:
             if not self.state.used_groups_list:
                 print(f"❌ [generate_hsv_variation_patterns] 使用中のグループがありません")
                 self.state.updating_programmatically = False
-                return [gr.update(), []] + [gr.update() for _ in range(self.colorizer.num_layers)] + [0, 0, 0]
+                return [gr.update(), []] + [gr.update() for _ in range(self.colorizer.picker_count)] + [0, 0, 0]
             
             # 現在の色を取得
             current_colors = []
@@ -266,59 +274,40 @@ class PatternGenerator:
                 last_val = variations[-1] if variations else 0
                 variations.extend([last_val] * (pattern_count - len(variations)))
             
-            # 4つのパターン色配列を生成
+            # 4つのパターン色配列を生成（全パターン・全色をまとめてHSV変換）
+            current_hsv = hex_to_hsv_array(current_colors)
+            # 指定されたパラメータのみ変化（デフォルトは色相変化）
+            channel = {"saturation": 1, "value": 2, "brightness": 2}.get(variation_type, 0)
+            pattern_hsv = np.repeat(current_hsv[None], len(variations), axis=0)
+            pattern_hsv[..., channel] += np.asarray(variations, dtype=np.float64)[:, None]
+            if channel == 0:
+                pattern_hsv[..., 0] %= 360
+            else:
+                np.clip(pattern_hsv[..., channel], 0, 100, out=pattern_hsv[..., channel])
+            
+            # HSVから16進数に変換
+            pattern_hexes = hsv_array_to_hex(pattern_hsv.reshape(-1, 3))
+            color_count = len(current_colors)
             self.state.pattern_compositions = []
-            for variation in variations:
-                pattern_colors = []
-                for color in current_colors:
-                    # 現在の色をHSVに変換
-                    h, s, v = hex_to_hsv(color)
-                    
-                    # 指定されたパラメータのみ変化
-                    if variation_type == "hue":
-                        new_h = (h + variation) % 360
-                        new_s = s
-                        new_v = v
-                    elif variation_type == "saturation":
-                        new_h = h
-                        new_s = max(0, min(100, s + variation))
-                        new_v = v
-                    elif variation_type in ["value", "brightness"]:
-                        new_h = h
-                        new_s = s
-                        new_v = max(0, min(100, v + variation))
-                    else:
-                        # デフォルトは色相変化
-                        new_h = (h + variation) % 360
-                        new_s = s
-                        new_v = v
-                    
-                    # HSVから16進数に変換
-                    new_color = hsv_to_hex(new_h, new_s / 100.0, new_v / 100.0)
-                    pattern_colors.append(new_color)
-                
+            for k, variation in enumerate(variations):
+                pattern_colors = pattern_hexes[k * color_count:(k + 1) * color_count]
                 self.state.pattern_compositions.append(pattern_colors)
                 print(f"🎨 [DEBUG] パターン{len(self.state.pattern_compositions)} ({variation:+}): {pattern_colors}")
             
-            # 4つの合成画像を生成
-            new_pattern_images = []
-            for pattern in self.state.pattern_compositions:
-                image = self.colorizer.compose_layers_with_colors(pattern)
-                new_pattern_images.append(image)
+            # 4つの合成画像をまとめて生成
+            new_pattern_images = self._compose_pattern_images(self.state.pattern_compositions)
             
             # グローバル変数を更新
             self.state.pattern_images = new_pattern_images
             
-            # 最初のパターンをメイン画像として設定
-            self.state.current_main_image = self.state.pattern_images[0]
-            
             # 最初のパターンの色を現在の色として設定
             first_pattern = self.state.pattern_compositions[0]
             for group_name, color in zip(self.state.used_groups_list, first_pattern):
                 self.colorizer.group_colors[group_name] = color
             
-            # カラーピッカーにも反映
-            self.colorizer.current_composite = self.state.current_main_image
+            # 最初のパターンをフル解像度で合成してメイン画像に設定
+            self.colorizer.current_composite = self.colorizer.compose_layers()
+            self.state.current_main_image = self.colorizer.current_composite
             
             # ベース色をリセット
             self.state.save_base_colors(self.colorizer)
@@ -366,7 +355,7 @@ class PatternGenerator:
             if not self.state.used_groups_list:
                 print(f"❌ [apply_current_colors_patterns] 使用中のグループがありません")
                 self.state.updating_programmatically = False
-                return [gr.update(), []] + [gr.update() for _ in range(self.colorizer.num_layers)] + [0, 0, 0]
+                return [gr.update(), []] + [gr.update() for _ in range(self.colorizer.picker_count)] + [0, 0, 0]
             
             # 現在のピッカーの色を取得
             current_colors = []
@@ -386,18 +375,12 @@ class PatternGenerator:
                 assignments = [f"{group}={color}" for group, color in zip(self.state.used_groups_list, pattern)]
                 print(f"🎨 [DEBUG] パターン{i+1}: {', '.join(assignments)}")
             
-            # 4つの合成画像を生成
-            new_pattern_images = []
-            for pattern in self.state.pattern_compositions:
-                image = self.colorizer.compose_layers_with_colors(pattern)
-                new_pattern_images.append(image)
+            # 4つの合成画像をまとめて生成
+            new_pattern_images = self._compose_pattern_images(self.state.pattern_compositions)
             
             # グローバル変数を更新
             self.state.pattern_images = new_pattern_images
             
-            # 最初のパターンをメイン画像として設定
-            self.state.current_main_image = self.state.pattern_images[0]
-            
             # ★★★ 重要: 最初のパターンの色を現在の色として設定 ★★★
             first_pattern = self.state.pattern_compositions[0]
             print(f"🔍 [DEBUG] 最初のパターン適用開始: {first_pattern}")
@@ -411,8 +394,9 @@ class PatternGenerator:
             
             print(f"🔍 [DEBUG] 適用後のgroup_colors: {dict(self.colorizer.group_colors)}")
             
-            # カラーピッカーにも反映（compose_layers実行前）
-            self.colorizer.current_composite = self.state.current_main_image
+            # 最初のパターンをフル解像度で合成してメイン画像に設定
+            self.colorizer.current_composite = self.colorizer.compose_layers()
+            self.state.current_main_image = self.colorizer.current_composite
             
             # ベース色をリセット（新しいパターンが設定されたため）
             print(f"🔍 [DEBUG] ベース色保存前のgroup_colors: {dict(self.colorizer.group_colors)}")
@@ -447,7 +431,8 @@ class PatternGenerator:
 
     def apply_custom_colors(self, sat_base: float, sat_range: float, bright_base: float, 
                           bright_range: float, hue_center: float, hue_range: float, 
-                          color_count: int, equal_spacing: bool, min_distance: float) -> List[Union[gr.update, float]]:
+                          color_count: int, equal_spacing: bool, min_distance: float,
+                          best_of_n: bool = False) -> List[Union[gr.update, float]]:
         """カスタムパラメータでランダムカラーを適用
         
         Args:
@@ -460,13 +445,14 @@ class PatternGenerator:
             color_count: 色数
             equal_spacing: 等間隔モード
             min_distance: 最小色相距離
+            best_of_n: ベスト配色探索モード
             
         Returns:
             [メイン画像, ギャラリー] + [ピッカー更新リスト] + [HSVスライダーリセット]
         """
         print(f"🔍 [DEBUG] === カスタムカラー開始 ===")
         print(f"🔍 [DEBUG] パラメータ: S({sat_base}±{sat_range}%), B({bright_base}±{bright_range}%), H({hue_center}±{hue_range}°), Count({color_count})")
-        print(f"🔍 [DEBUG] 等間隔モード: {equal_spacing}, 最小色相距離: {min_distance}°")
+        print(f"🔍 [DEBUG] 等間隔モード: {equal_spacing}, 最小色相距離: {min_distance}°, ベスト配色探索: {best_of_n}")
         
         # プログラム的更新フラグを立てる
         self.state.updating_programmatically = True
@@ -482,9 +468,16 @@ class PatternGenerator:
                 hue_range=hue_range,
                 color_count=color_count,
                 equal_hue_spacing=equal_spacing,
-                min_hue_distance=min_distance
+                min_hue_distance=min_distance,
+                best_of_n=best_of_n
             )
             
+            # 最小色相距離を実現できない場合は、制限した値で生成したことを画面に表示
+            if not custom_params.equal_hue_spacing:
+                _, warning = feasible_hue_distance(custom_params)
+                if warning:
+                    gr.Warning(warning)
+            
             # 4パターン生成（色配列とグループリストも取得）
             self.state.pattern_compositions = self.colorizer.apply_random_colors_with_params(custom_params)
             
@@ -493,20 +486,14 @@ class PatternGenerator:
             used_groups = set(group for group in self.colorizer.layers if group != default_group)
             self.state.used_groups_list = sorted(used_groups)
             
-            # 4つの合成画像を生成
-            new_pattern_images = []
-            for pattern in self.state.pattern_compositions:
-                image = self.colorizer.compose_layers_with_colors(pattern)
-                new_pattern_images.append(image)
+            # 4つの合成画像をまとめて生成
+            new_pattern_images = self._compose_pattern_images(self.state.pattern_compositions)
             
             # グローバル変数を更新
             self.state.pattern_images = new_pattern_images
             
-            # 最初のパターンをメイン画像として設定
-            self.state.current_main_image = self.state.pattern_images[0]
-            
-            # カラーピッカーにも1枚目のパターンの色を反映
-            self.colorizer.current_composite = self.state.current_main_image
+            # 最初のパターンをメイン画像として設定（フル解像度で合成済み）
+            self.state.current_main_image = self.colorizer.current_composite
             
             # ベース色をリセット（新しい色が設定されたため）
             self.state.save_base_colors(self.colorizer)
@@ -5,13 +5,13 @@ MS Color Generator - UIイベントハンドラー（config統合版）
 from typing import List, Tuple, Union, TYPE_CHECKING
 
 import gradio as gr
-from PIL import Image
+import numpy as np
 
 from config import (
-    TARGET_COLOR, DEFAULT_GROUP_COLOR, COLOR_SETTINGS, 
+    DEFAULT_GROUP_COLOR, COLOR_SETTINGS, 
     SYSTEM_SETTINGS, UI_CHOICES
 )
-from color_utils import hex_to_hsv, hsv_to_hex
+from color_utils import hex_to_hsv_array, hsv_array_to_hex
 from presets import COLOR_PRESETS
 from ui_utils import update_pickers_only
 
@@ -52,12 +52,9 @@ class UIHandlers:
             return self.state.current_main_image, gr.update(value=None)
         
         x, y = evt.index
-        hit_layers = []
         
-        # クリック位置のレイヤーを検出
-        for i, img in enumerate(self.colorizer.orig_images):
-            if x < img.width and y < img.height and img.getpixel((x, y))[:3] == TARGET_COLOR:
-                hit_layers.append(i)
+        # クリック位置のレイヤーを検出（ピクセルごとのレイヤービットセットを1回参照）
+        hit_layers = self.colorizer.layers_at(x, y)
         
         self.state.selected_layer_indices = hit_layers
         
@@ -69,26 +66,15 @@ class UIHandlers:
             return main_image_update, gr.update(value=None)
         
         # オーバーレイ作成（透明度はconfigから取得）
-        overlay = self.state.current_main_image.copy().convert("RGBA")
-        overlay_alpha = COLOR_SETTINGS["overlay_alpha"]
-        
-        for layer_idx in hit_layers:
-            layer = self.colorizer.replace_color(
-                self.colorizer.orig_images[layer_idx].copy(), 
-                self.colorizer.hex_to_rgb(self.colorizer.get_layer_color(layer_idx))
-            )
-            alpha = layer.split()[-1].point(lambda a: int(a * overlay_alpha))
-            layer.putalpha(alpha)
-            overlay = Image.alpha_composite(overlay, layer)
+        overlay = self.colorizer.selection_overlay(self.state.current_main_image, hit_layers)
         
         # レイヤー情報作成
         layer_info = []
-        groups_in_selection = set()
         for layer_idx in hit_layers:
             layer_num = layer_idx + 1
             group_name = self.colorizer.layers[layer_idx]
             layer_info.append(f"Layer{layer_num}({group_name})")
-            groups_in_selection.add(group_name)
+        groups_in_selection = self.colorizer.groups_at(x, y)
         
         info_text = f"座標 ({x}, {y}) → {', '.join(layer_info)}"
         
@@ -152,11 +138,9 @@ class UIHandlers:
             selected_index = evt.index
             print(f"🖼️ [on_gallery_select] パターン{selected_index + 1}が選択されました")
             
-            # 選択されたパターンをメイン画像として設定
+            # 選択されたパターンをメイン画像として設定（ギャラリーの縮小画像は使わず、
+            # 色情報がなければメイン画像は変更しない）
             if selected_index < len(self.state.pattern_images):
-                self.state.current_main_image = self.state.pattern_images[selected_index]
-                print(f"🔄 [on_gallery_select] メイン画像を更新: パターン{selected_index + 1}")
-                
                 # ★重要: 選択されたパターンの色情報を内部状態に反映
                 if selected_index < len(self.state.pattern_compositions) and self.state.used_groups_list:
                     # 修正：正しいパターンインデックスの色を取得
@@ -170,6 +154,11 @@ class UIHandlers:
                             self.colorizer.group_colors[group_name] = selected_colors[i]
                             print(f"   {group_name}: {old_color} → {selected_colors[i]}")
                     
+                    # メイン画像は選択時にフル解像度で合成する
+                    self.colorizer.current_composite = self.colorizer.compose_layers()
+                    self.state.current_main_image = self.colorizer.current_composite
+                    print(f"🔄 [on_gallery_select] メイン画像を更新: パターン{selected_index + 1}")
+                    
                     # ベース色をリセット（新しい色が選択されたため）
                     self.state.save_base_colors(self.colorizer)
                     
@@ -180,7 +169,30 @@ class UIHandlers:
                     return [self.state.current_main_image] + picker_updates + [0, 0, 0]  # HSVスライダーもリセット
         
         print(f"❌ [on_gallery_select] 選択処理に失敗")
-        return [gr.update()] + [gr.update() for _ in range(self.colorizer.num_layers)] + [gr.update(), gr.update(), gr.update()]
+        return [gr.update()] + [gr.update() for _ in range(self.colorizer.picker_count)] + [gr.update(), gr.update(), gr.update()]
+
+    def switch_layer_set(self, set_name: str) -> List[Union[gr.update, float]]:
+        """レイヤーセット切り替え時のイベントハンドラ
+        
+        Args:
+            set_name: 切り替え先のセット名
+            
+        Returns:
+            [メイン画像, ギャラリー] + [ピッカー更新リスト] + [ラジオボタン更新] + [HSVスライダーリセット]
+        """
+        print(f"🗂️ [switch_layer_set] {set_name} を選択")
+        if not set_name or not self.colorizer.switch_layer_set(set_name):
+            return ([gr.update(), gr.update()] + [gr.update() for _ in range(self.colorizer.picker_count)]
+                    + [gr.update(), gr.update(), gr.update(), gr.update()])
+        
+        # 選択状態とパターンを新しいセットで作り直す
+        self.state.selected_layer_indices = []
+        self.state.set_initial_state(self.colorizer)
+        picker_updates = update_pickers_only(self.colorizer)
+        radio_update = gr.update(value=None, choices=self.colorizer.get_available_groups() + ["GROUP追加"])
+        
+        return ([self.state.current_main_image, self.state.pattern_images] + picker_updates
+                + [radio_update, 0, 0, 0])
 
     def apply_group_change(self, selected_group: str, color_option: str = None) -> List[gr.update]:
         """選択したレイヤーにグループを適用
@@ -313,7 +325,7 @@ class UIHandlers:
             if current_color == new_color:
                 print(f"🔍 [DEBUG] {group_name}の色は既に{new_color}です - HSVスライダーリセットなし")
                 # HSVスライダーをリセットせずに現在の状態を保持
-                return [gr.update()] + [gr.update() for _ in range(self.colorizer.num_layers)] + [gr.update(), gr.update(), gr.update()]
+                return [gr.update()] + [gr.update() for _ in range(self.colorizer.picker_count)] + [gr.update(), gr.update(), gr.update()]
             
             print(f"🔍 [DEBUG] {group_name}の色を{current_color} → {new_color}に更新")
             self.colorizer.group_colors[group_name] = new_color
@@ -329,7 +341,7 @@ class UIHandlers:
             picker_updates = update_pickers_only(self.colorizer)
             return [updated_image] + picker_updates + [0, 0, 0]  # HSVスライダーもリセット
         
-        return [gr.update()] + [gr.update() for _ in range(self.colorizer.num_layers)] + [gr.update(), gr.update(), gr.update()]
+        return [gr.update()] + [gr.update() for _ in range(self.colorizer.picker_count)] + [gr.update(), gr.update(), gr.update()]
 
     def apply_hsv_shift(self, hue_shift: float, sat_shift: float, val_shift: float) -> List[gr.update]:
         """現在の全色にHSVシフトを適用（ベース色からの計算）
@@ -350,23 +362,26 @@ class UIHandlers:
         
         # 使用中のグループを取得（configから）
         default_group = SYSTEM_SETTINGS["default_group_name"]
-        used_groups = set(group for group in self.colorizer.layers if group != default_group)
-        
-        for group_name in used_groups:
-            # ベース色を取得（なければ現在の色）
-            base_color = self.state.base_colors.get(group_name, self.colorizer.group_colors.get(group_name, DEFAULT_GROUP_COLOR))
-            
-            # ベース色をHSVに変換
-            h, s, v = hex_to_hsv(base_color)
-            
-            # シフトを適用
-            new_h = (h + hue_shift) % 360  # 色相は0-360°でループ
-            new_s = max(0, min(100, s + sat_shift))  # 彩度は0-100%でクランプ
-            new_v = max(0, min(100, v + val_shift))  # 明度は0-100%でクランプ
-            
-            # HSVから16進数に変換
-            new_color = hsv_to_hex(new_h, new_s / 100.0, new_v / 100.0)
-            
+        used_groups = [group for group in set(self.colorizer.layers) if group != default_group]
+        
+        # ベース色を取得（なければ現在の色）し、全グループまとめてHSVに変換
+        base_colors = [
+            self.state.base_colors.get(group_name, self.colorizer.group_colors.get(group_name, DEFAULT_GROUP_COLOR))
+            for group_name in used_groups
+        ]
+        base_hsv = hex_to_hsv_array(base_colors)
+        
+        # シフトを適用
+        shifted = base_hsv.copy()
+        shifted[:, 0] = (shifted[:, 0] + hue_shift) % 360  # 色相は0-360°でループ
+        shifted[:, 1] = np.clip(shifted[:, 1] + sat_shift, 0, 100)  # 彩度は0-100%でクランプ
+        shifted[:, 2] = np.clip(shifted[:, 2] + val_shift, 0, 100)  # 明度は0-100%でクランプ
+        
+        # HSVから16進数に変換
+        new_colors = hsv_array_to_hex(shifted)
+        
+        for group_name, base_color, new_color, (h, s, v), (new_h, new_s, new_v) in zip(
+                used_groups, base_colors, new_colors, base_hsv.tolist(), shifted.tolist()):
             # 色を更新
             self.colorizer.group_colors[group_name] = new_color
             print(f"🔍 [DEBUG] {group_name}: {base_color} → {new_color} (H:{h:.0f}→{new_h:.0f}, S:{s:.0f}→{new_s:.0f}, V:{v:.0f}→{new_v:.0f})")
@@ -399,7 +414,8 @@ class UIHandlers:
                 params.hue_range,
                 params.color_count,
                 params.equal_hue_spacing,
-                params.min_hue_distance
+                params.min_hue_distance,
+                gr.update()  # ベスト配色探索モードはプリセットで切り替えない
             )
         else:
             # デフォルト値を返す（configのスライダー設定から取得）
@@ -413,7 +429,8 @@ class UIHandlers:
                 SLIDER_CONFIGS["hue_range"]["value"],
                 SLIDER_CONFIGS["color_count"]["value"],
                 False,  # equal_hue_spacing
-                SLIDER_CONFIGS["min_hue_distance"]["value"]
+                SLIDER_CONFIGS["min_hue_distance"]["value"],
+                gr.update()  # best_of_n
             )
 
     def create_picker_change_handler(self, picker_index: int):
@@ -429,7 +446,7 @@ class UIHandlers:
             # プログラム的更新中は念のためスキップ（ランダム生成時など）
             if self.state.updating_programmatically:
                 print(f"🔒 [DEBUG] プログラム的更新中のため、ピッカー{picker_index}の変更をスキップ")
-                return [gr.update()] + [gr.update() for _ in range(self.colorizer.num_layers)] + [gr.update(), gr.update(), gr.update()]
+                return [gr.update()] + [gr.update() for _ in range(self.colorizer.picker_count)] + [gr.update(), gr.update(), gr.update()]
             
             print(f"🔍 [DEBUG] ピッカー{picker_index}からの色更新: {new_color}")
             return self.update_color_from_picker(picker_index, new_color)
@@ -444,7 +461,7 @@ class UIHandlers:
         def handler(hue_shift: float, sat_shift: float, val_shift: float) -> List[gr.update]:
             if self.state.updating_programmatically:
                 print(f"🔒 [DEBUG] プログラム的更新中のため、HSVシフトをスキップ")
-                return [gr.update()] + [gr.update() for _ in range(self.colorizer.num_layers)]
+                return [gr.update()] + [gr.update() for _ in range(self.colorizer.picker_count)]
             
             print(f"🎨 [DEBUG] HSVシフト実行: H{hue_shift:+.0f}° S{sat_shift:+.0f}% V{val_shift:+.0f}%")
             return self.apply_hsv_shift(hue_shift, sat_shift, val_shift)
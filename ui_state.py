@@ -39,13 +39,9 @@ class UIState:
     def clear_old_patterns(self):
         """古いパターン画像をメモリから解放"""
         try:
-            if self.pattern_images:
-                # PIL画像オブジェクトを明示的に閉じる
-                for img in self.pattern_images:
-                    if hasattr(img, 'close'):
-                        img.close()
-                
-            self.pattern_images.clear()
+            # 画像は合成結果キャッシュと共有されることがあるため、閉じずに参照だけ外す
+            # （どこからも参照されなくなった出力バッファは、次の合成で再利用される）
+            self.pattern_images = []
             self.pattern_compositions.clear()
             print("🧹 [MEMORY] 古いパターンをクリアしました")
             
@@ -9,7 +9,7 @@ import threading
 import time
 import tempfile
 from datetime import datetime
-from typing import List, Optional, TYPE_CHECKING
+from typing import List, Optional, Tuple, TYPE_CHECKING
 
 import gradio as gr
 
@@ -17,7 +17,8 @@ from config import (
     DEFAULT_GROUP_COLOR, FILE_PREFIX, BACKUP_SETTINGS, 
     SYSTEM_SETTINGS, RESTART_SETTINGS, COLOR_SETTINGS, IS_HUGGING_FACE_SPACES
 )
-from color_utils import hex_to_hsv
+import color_convert
+from color_utils import hex_to_hsv_array
 
 # 循環インポート回避のための型チェック
 if TYPE_CHECKING:
@@ -62,6 +63,27 @@ def format_color_display(color: str) -> str:
     return DEFAULT_GROUP_COLOR
 
 
+def _group_display_colors(colorizer: 'LayerColorizer', sorted_group_data) -> Tuple[List[str], List[Optional[Tuple[float, float, float]]]]:
+    """各グループの表示色とHSV値を全グループまとめて計算
+    
+    Args:
+        colorizer: LayerColorizerインスタンス
+        sorted_group_data: get_sorted_group_dataの戻り値（(グループ名, レイヤーインデックス)のリスト）
+        
+    Returns:
+        (表示色のリスト, (色相, 彩度, 明度)のリスト) のタプル
+        （カラーコードとして解釈できない色のHSVはNone、グループごとにエラー表示する）
+    """
+    display_colors = [
+        format_color_display(colorizer.group_colors.get(group_name, DEFAULT_GROUP_COLOR))
+        for group_name, _ in sorted_group_data
+    ]
+    _, valid = color_convert.hex_to_rgb_bytes(display_colors)
+    group_hsv = [tuple(hsv) if ok else None
+                 for hsv, ok in zip(hex_to_hsv_array(display_colors).tolist(), valid)]
+    return display_colors, group_hsv
+
+
 def update_pickers_only(colorizer: 'LayerColorizer') -> List[gr.update]:
     """カラーピッカーのみを更新
     
@@ -79,15 +101,16 @@ def update_pickers_only(colorizer: 'LayerColorizer') -> List[gr.update]:
         
         print(f"🔍 [DEBUG] ソート済みグループデータ: {len(sorted_group_data)}個")
         
-        for group_name, layer_indices in sorted_group_data:
+        # 色とHSV値を全グループまとめて計算
+        display_colors, group_hsv = _group_display_colors(colorizer, sorted_group_data)
+        
+        for (group_name, layer_indices), display_color, hsv in zip(sorted_group_data, display_colors, group_hsv):
             try:
+                if hsv is None:
+                    raise ValueError(f"無効な色形式 '{display_color}'")
+                h, s, v = hsv
                 layer_numbers = [str(idx + 1) for idx in sorted(layer_indices)]
                 
-                # 色とHSV値を計算
-                color = colorizer.group_colors.get(group_name, DEFAULT_GROUP_COLOR)
-                display_color = format_color_display(color)
-                h, s, v = hex_to_hsv(display_color)
-                
                 # レイヤー番号を整理して表示
                 layer_list = ", ".join(layer_numbers)
                 
@@ -108,7 +131,7 @@ def update_pickers_only(colorizer: 'LayerColorizer') -> List[gr.update]:
                 picker_updates.append(gr.update(visible=True, label=f"{group_name} (エラー)", value=DEFAULT_GROUP_COLOR))
         
         # 残りを非表示に
-        while len(picker_updates) < colorizer.num_layers:
+        while len(picker_updates) < colorizer.picker_count:
             picker_updates.append(gr.update(visible=False))
         
         print(f"🔍 [DEBUG] update_pickers_only完了: {len(picker_updates)}個")
@@ -117,7 +140,7 @@ def update_pickers_only(colorizer: 'LayerColorizer') -> List[gr.update]:
     except Exception as e:
         print(f"❌ [ERROR] update_pickers_only 致命的エラー: {e}")
         # 全て非表示で返す
-        return [gr.update(visible=False) for _ in range(colorizer.num_layers)]
+        return [gr.update(visible=False) for _ in range(colorizer.picker_count)]
 
 
 def create_initial_pickers(colorizer: 'LayerColorizer') -> List[gr.ColorPicker]:
@@ -134,15 +157,16 @@ def create_initial_pickers(colorizer: 'LayerColorizer') -> List[gr.ColorPicker]:
     try:
         sorted_group_data = colorizer.get_sorted_group_data(colorizer.layers)
         
-        for i, (group_name, layer_indices) in enumerate(sorted_group_data):
+        # 色とHSV値を全グループまとめて計算
+        display_colors, group_hsv = _group_display_colors(colorizer, sorted_group_data)
+        
+        for (group_name, layer_indices), display_color, hsv in zip(sorted_group_data, display_colors, group_hsv):
             try:
+                if hsv is None:
+                    raise ValueError(f"無効な色形式 '{display_color}'")
+                h, s, v = hsv
                 layer_numbers = [str(idx + 1) for idx in sorted(layer_indices)]
                 
-                # 色とHSV値を計算
-                default_color = colorizer.group_colors.get(group_name, DEFAULT_GROUP_COLOR)
-                display_color = format_color_display(default_color)
-                h, s, v = hex_to_hsv(display_color)
-                
                 # レイヤー番号を整理して表示
                 layer_list = ", ".join(layer_numbers)
                 
@@ -171,7 +195,7 @@ def create_initial_pickers(colorizer: 'LayerColorizer') -> List[gr.ColorPicker]:
                 pickers.append(picker)
         
         # 残りのレイヤー用に非表示のピッカーを追加
-        while len(pickers) < colorizer.num_layers:
+        while len(pickers) < colorizer.picker_count:
             picker = gr.ColorPicker(
                 label="", 
                 value=DEFAULT_GROUP_COLOR, 
@@ -183,7 +207,7 @@ def create_initial_pickers(colorizer: 'LayerColorizer') -> List[gr.ColorPicker]:
     except Exception as e:
         print(f"❌ [ERROR] create_initial_pickers 致命的エラー: {e}")
         # 最低限のピッカーを作成
-        for i in range(max(4, colorizer.num_layers)):
+        for i in range(max(4, colorizer.picker_count)):
             picker = gr.ColorPicker(
                 label=f"グループ{i+1} (エラー)", 
                 value=DEFAULT_GROUP_COLOR, 